@@ -0,0 +1,48 @@
+// Copyright 2019 Yan Yan
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef SPARSE_CONV_DEPTHWISE_FUNCTOR_H_
+#define SPARSE_CONV_DEPTHWISE_FUNCTOR_H_
+#include <tensorview/tensorview.h>
+
+namespace spconv
+{
+  namespace functor
+  {
+    // outFeatures[indicesOut[i]] += features[indicesIn[i]] * filter
+    // (elementwise) for the size pairs of one kernel offset. filter:
+    // [numPlanes]. indicesOut must be unique.
+    template <typename Device, typename T, typename Index>
+    struct SparseDepthwiseConvFunctor
+    {
+      void operator()(const Device &d, tv::TensorView<T> outFeatures,
+                      tv::TensorView<const T> features, tv::TensorView<const T> filter,
+                      tv::TensorView<const Index> indicesIn,
+                      tv::TensorView<const Index> indicesOut, int size);
+    };
+
+    // filterGrad += sum_i features[indicesIn[i]] * outGrad[indicesOut[i]]
+    // (elementwise). filterGrad: [numPlanes].
+    template <typename Device, typename T, typename Index>
+    struct SparseDepthwiseFilterGradFunctor
+    {
+      void operator()(const Device &d, tv::TensorView<T> filterGrad,
+                      tv::TensorView<const T> features, tv::TensorView<const T> outGrad,
+                      tv::TensorView<const Index> indicesIn,
+                      tv::TensorView<const Index> indicesOut, int size);
+    };
+  } // namespace functor
+} // namespace spconv
+
+#endif
@@ -0,0 +1,64 @@
+// Copyright 2019 Yan Yan
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef SPARSE_CONV_FUSED_FUNCTOR_H_
+#define SPARSE_CONV_FUSED_FUNCTOR_H_
+#include <tensorview/tensorview.h>
+
+namespace spconv
+{
+  namespace functor
+  {
+    // outFeatures[indicesOut[i]] += features[indicesIn[i]] * filter for the
+    // size pairs of one kernel offset, through per-thread tile buffers only.
+    // filter: [numInPlanes, numOutPlanes]. indicesOut must be unique.
+    template <typename Device, typename T, typename Index>
+    struct SparseConvFusedFunctor
+    {
+      void operator()(const Device &d, tv::TensorView<T> outFeatures,
+                      tv::TensorView<const T> features, tv::TensorView<const T> filter,
+                      tv::TensorView<const Index> indicesIn,
+                      tv::TensorView<const Index> indicesOut, int size);
+    };
+
+    // filterGrad += sum_i features[indicesIn[i]]^T * outGrad[indicesOut[i]].
+    // filterGrad: [numInPlanes, numOutPlanes].
+    template <typename Device, typename T, typename Index>
+    struct SparseConvFilterGradFusedFunctor
+    {
+      void operator()(const Device &d, tv::TensorView<T> filterGrad,
+                      tv::TensorView<const T> features, tv::TensorView<const T> outGrad,
+                      tv::TensorView<const Index> indicesIn,
+                      tv::TensorView<const Index> indicesOut, int size);
+    };
+
+    // outFeatures[o] = bias + sum_k features[i] * filters[k] over the pairs
+    // (i, o) of every offset k, given as a tiled rulebook (see
+    // tileIndicePairs). the output rows of a tile stay in cache while every
+    // kernel offset accumulates into them. bias may be empty.
+    // filters: [kernelVolume, numInPlanes, numOutPlanes].
+    template <typename Device, typename T, typename Index>
+    struct SparseConvOutputStationaryFunctor
+    {
+      void operator()(const Device &d, tv::TensorView<T> outFeatures,
+                      tv::TensorView<const T> features, tv::TensorView<const T> filters,
+                      tv::TensorView<const Index> tileOffsets,
+                      tv::TensorView<const Index> tileIndicesIn,
+                      tv::TensorView<const Index> tileIndicesOut,
+                      tv::TensorView<const T> bias);
+    };
+  } // namespace functor
+} // namespace spconv
+
+#endif
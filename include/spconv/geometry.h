@@ -15,9 +15,12 @@
 #ifndef SPCONV_GEOMETRY_H_
 #define SPCONV_GEOMETRY_H_
 
+#include <cstdint>
 #include <iostream>
 #include <limits>
 #include <tensorview/tensorview.h>
+#include <unordered_map>
+#include <vector>
 
 namespace spconv
 {
@@ -161,17 +164,19 @@ namespace spconv
     return pointCounter;
   }
 
+  // the cpu indice generation appends the coordinates of new output sites to
+  // indicesOut and the interleaved (in, out) pairs of kernel offset k to
+  // indicePairs[k], which are written to the compact layout once the counts
+  // are known, see writeChunkIndicePairs.
   template <typename Index, typename IndexGrid, unsigned NDim>
   Index getIndicePairsConv(tv::TensorView<const Index> indicesIn,
-                           tv::TensorView<Index> indicesOut,
+                           std::vector<Index> &indicesOut,
                            tv::TensorView<IndexGrid> gridsOut,
-                           tv::TensorView<Index> indicePairs,
-                           tv::TensorView<Index> indiceNum,
+                           std::vector<std::vector<Index>> &indicePairs,
                            const Index *kernelSize, const Index *stride,
                            const Index *padding, const Index *dilation,
                            const Index *outSpatialShape)
   {
-    // indicesOut: num_active * kernelVolume * (NDim + 1)
     Index numAct = 0;
     auto numActIn = indicesIn.dim(0);
     Index batchIdx = 0;
@@ -210,16 +215,13 @@ namespace spconv
                      spatialVolume * batchIdx;
         if (gridsOut[index] == -1)
         {
-          for (unsigned k = 1; k < NDim + 1; ++k)
-          {
-            indicesOut(numAct, k) = pointPtr[k - 1];
-          }
-          indicesOut(numAct, 0) = batchIdx;
+          indicesOut.push_back(batchIdx);
+          indicesOut.insert(indicesOut.end(), pointPtr, pointPtr + NDim);
           gridsOut[index] = numAct++;
         }
-        // indicePairs: [K, 2, L]
-        indicePairs(offset, 0, indiceNum[offset]) = j;
-        indicePairs(offset, 1, indiceNum[offset]++) = gridsOut[index];
+        // indicePairs[offset]: interleaved (in, out) pairs.
+        indicePairs[offset].push_back(j);
+        indicePairs[offset].push_back(gridsOut[index]);
       }
     }
 #ifdef _MSC_VER
@@ -230,10 +232,9 @@ namespace spconv
 
   template <typename Index, typename IndexGrid, unsigned NDim>
   Index getIndicePairsDeConv(tv::TensorView<const Index> indicesIn,
-                             tv::TensorView<Index> indicesOut,
+                             std::vector<Index> &indicesOut,
                              tv::TensorView<IndexGrid> gridsOut,
-                             tv::TensorView<Index> indicePairs,
-                             tv::TensorView<Index> indiceNum,
+                             std::vector<std::vector<Index>> &indicePairs,
                              const Index *kernelSize, const Index *stride,
                              const Index *padding, const Index *dilation,
                              const Index *outSpatialShape)
@@ -276,16 +277,13 @@ namespace spconv
                      spatialVolume * batchIdx;
         if (gridsOut[index] == -1)
         {
-          for (unsigned k = 1; k < NDim + 1; ++k)
-          {
-            indicesOut(numAct, k) = pointPtr[k - 1];
-          }
-          indicesOut(numAct, 0) = batchIdx;
+          indicesOut.push_back(batchIdx);
+          indicesOut.insert(indicesOut.end(), pointPtr, pointPtr + NDim);
           gridsOut[index] = numAct++;
         }
-        // indicePairs: [K, 2, L]
-        indicePairs(offset, 0, indiceNum[offset]) = j;
-        indicePairs(offset, 1, indiceNum[offset]++) = gridsOut[index];
+        // indicePairs[offset]: interleaved (in, out) pairs.
+        indicePairs[offset].push_back(j);
+        indicePairs[offset].push_back(gridsOut[index]);
       }
     }
 #ifdef _MSC_VER
@@ -297,11 +295,11 @@ namespace spconv
   template <typename Index, typename IndexGrid, unsigned NDim>
   Index getIndicePairsSubM(tv::TensorView<const Index> indicesIn,
                            tv::TensorView<IndexGrid> gridsOut,
-                           tv::TensorView<Index> indicePairs,
-                           tv::TensorView<Index> indiceNum,
+                           std::vector<std::vector<Index>> &indicePairs,
                            const Index *const kernelSize,
                            const Index *const stride, const Index *const padding,
-                           const Index *dilation, const Index *const outSpatialShape)
+                           const Index *dilation, const Index *const outSpatialShape,
+                           bool half = false)
   {
     Index numAct = 0;
     auto numActIn = indicesIn.dim(0);
@@ -345,12 +343,17 @@ namespace spconv
       {
         pointPtr = validPoints + i * (NDim + 1);
         auto offset = pointPtr[NDim];
+        // the mirrored offsets of half rulebooks are not stored.
+        if (half && offset > kernelVolume / 2)
+        {
+          continue;
+        }
         index = tv::rowArrayIdx<Index, NDim>(pointPtr, outSpatialShape) +
                 spatialVolume * indicesIn(j, 0);
         if (gridsOut[index] > -1)
         {
-          indicePairs(offset, 0, indiceNum[offset]) = j;
-          indicePairs(offset, 1, indiceNum[offset]++) = gridsOut[index];
+          indicePairs[offset].push_back(j);
+          indicePairs[offset].push_back(gridsOut[index]);
         }
       }
     }
@@ -360,6 +363,132 @@ namespace spconv
     return numActIn;
   }
 
+  // flattened (batch, spatial) position of a site. unlike tv::rowArrayIdx this
+  // is computed in 64 bit so it can't overflow for large grids.
+  template <typename Index, unsigned NDim>
+  TV_HOST_DEVICE_INLINE int64_t getFlatIndex(const Index *pos, Index batchIdx,
+                                             const Index *outSpatialShape)
+  {
+    int64_t index = batchIdx;
+#pragma unroll
+    for (int i = 0; i < NDim; ++i)
+    {
+      index = index * outSpatialShape[i] + pos[i];
+    }
+    return index;
+  }
+
+  // hash table counterparts of getIndicePairsConv/getIndicePairsDeConv. output
+  // sites are looked up in a hash table keyed by their flattened position
+  // instead of a dense [batchSize * outputVolume] grid, so memory and time
+  // scale with the number of active sites instead of the spatial volume.
+  // the generated indices and indice pairs are identical to the grid version.
+  template <typename Index, unsigned NDim>
+  Index getIndicePairsConvHash(tv::TensorView<const Index> indicesIn,
+                               std::vector<Index> &indicesOut,
+                               std::unordered_map<int64_t, Index> &table,
+                               std::vector<std::vector<Index>> &indicePairs,
+                               const Index *kernelSize, const Index *stride,
+                               const Index *padding, const Index *dilation,
+                               const Index *outSpatialShape, bool transpose)
+  {
+    Index numAct = 0;
+    auto numActIn = indicesIn.dim(0);
+    Index batchIdx = 0;
+    Index kernelVolume = 1;
+#pragma unroll
+    for (int i = 0; i < NDim; ++i)
+    {
+      kernelVolume *= kernelSize[i];
+    }
+    Index numValidPoints = 0;
+    std::vector<Index> validPoints(kernelVolume * (NDim + 1));
+    Index *pointPtr = nullptr;
+    table.reserve(numActIn);
+    for (int j = 0; j < numActIn; ++j)
+    {
+      batchIdx = indicesIn(j, 0);
+      if (transpose)
+        numValidPoints = getValidOutPosTranspose<Index, NDim>(
+            indicesIn.data() + j * (NDim + 1) + 1, kernelSize, stride, padding,
+            dilation, outSpatialShape, validPoints.data());
+      else
+        numValidPoints = getValidOutPos<Index, NDim>(
+            indicesIn.data() + j * (NDim + 1) + 1, kernelSize, stride, padding,
+            dilation, outSpatialShape, validPoints.data());
+      for (Index i = 0; i < numValidPoints; ++i)
+      {
+        pointPtr = validPoints.data() + i * (NDim + 1);
+        auto offset = pointPtr[NDim];
+        auto index = getFlatIndex<Index, NDim>(pointPtr, batchIdx, outSpatialShape);
+        auto iter = table.emplace(index, numAct);
+        if (iter.second)
+        {
+          indicesOut.push_back(batchIdx);
+          indicesOut.insert(indicesOut.end(), pointPtr, pointPtr + NDim);
+          ++numAct;
+        }
+        indicePairs[offset].push_back(j);
+        indicePairs[offset].push_back(iter.first->second);
+      }
+    }
+    return numAct;
+  }
+
+  template <typename Index, unsigned NDim>
+  Index getIndicePairsSubMHash(tv::TensorView<const Index> indicesIn,
+                               std::unordered_map<int64_t, Index> &table,
+                               std::vector<std::vector<Index>> &indicePairs,
+                               const Index *const kernelSize,
+                               const Index *const stride, const Index *const padding,
+                               const Index *dilation, const Index *const outSpatialShape,
+                               bool half = false)
+  {
+    auto numActIn = indicesIn.dim(0);
+    Index kernelVolume = 1;
+#pragma unroll
+    for (int i = 0; i < NDim; ++i)
+    {
+      kernelVolume *= kernelSize[i];
+    }
+    Index numValidPoints = 0;
+    std::vector<Index> validPoints(kernelVolume * (NDim + 1));
+    Index *pointPtr = nullptr;
+    int64_t index = 0;
+    table.reserve(numActIn);
+    for (int j = 0; j < numActIn; ++j)
+    {
+      index = getFlatIndex<Index, NDim>(indicesIn.data() + j * (NDim + 1) + 1,
+                                        indicesIn(j, 0), outSpatialShape);
+      table[index] = j;
+    }
+    for (int j = 0; j < numActIn; ++j)
+    {
+      numValidPoints = getValidOutPos<Index, NDim>(
+          indicesIn.data() + j * (NDim + 1) + 1, kernelSize, stride, padding,
+          dilation, outSpatialShape, validPoints.data());
+
+      for (Index i = 0; i < numValidPoints; ++i)
+      {
+        pointPtr = validPoints.data() + i * (NDim + 1);
+        auto offset = pointPtr[NDim];
+        // the mirrored offsets of half rulebooks are not stored.
+        if (half && offset > kernelVolume / 2)
+        {
+          continue;
+        }
+        index = getFlatIndex<Index, NDim>(pointPtr, indicesIn(j, 0), outSpatialShape);
+        auto iter = table.find(index);
+        if (iter != table.end())
+        {
+          indicePairs[offset].push_back(j);
+          indicePairs[offset].push_back(iter->second);
+        }
+      }
+    }
+    return numActIn;
+  }
+
 } // namespace spconv
 
 #endif
\ No newline at end of file
@@ -14,7 +14,10 @@
 
 #ifndef SPARSE_CONV_INDICE_FUNCTOR_H_
 #define SPARSE_CONV_INDICE_FUNCTOR_H_
+#include <cstdint>
 #include <tensorview/tensorview.h>
+#include <unordered_map>
+#include <vector>
 
 namespace spconv
 {
@@ -47,13 +50,19 @@ namespace spconv
                 bool resetGrid = false);
         };
 
+        // cpu only. the cpu functors don't write a padded [kernelVolume, 2,
+        // numAct] rulebook: the coordinates of the output sites are appended
+        // to indicesOut and the interleaved (in, out) pairs of kernel offset k
+        // found by chunk c of the active sites to
+        // chunkPairs[c * kernelVolume + k], so the compact rulebook is
+        // written with its exact size, see writeChunkIndicePairs.
         template <typename Device, typename Index, typename IndexGrid, unsigned NDim>
         struct CreateConvIndicePairFunctor
         {
             Index operator()(
                 const Device &d, tv::TensorView<const Index> indicesIn,
-                tv::TensorView<Index> indicesOut, tv::TensorView<IndexGrid> gridsOut,
-                tv::TensorView<Index> indicePairs, tv::TensorView<Index> indiceNum,
+                std::vector<Index> &indicesOut, tv::TensorView<IndexGrid> gridsOut,
+                std::vector<std::vector<Index>> &chunkPairs,
                 const tv::SimpleVector<Index, NDim> kernelSize,
                 const tv::SimpleVector<Index, NDim> stride,
                 const tv::SimpleVector<Index, NDim> padding,
@@ -61,6 +70,11 @@ namespace spconv
                 const tv::SimpleVector<Index, NDim> outSpatialShape, bool transpose, bool resetGrid = false);
         };
 
+        // the gpu version writes a [kernelVolume, 2, numAct] rulebook padded
+        // with -1, the cpu version collects chunkPairs like
+        // CreateConvIndicePairFunctor. half: only generate the kernel offsets
+        // up to the center for half rulebooks (see getHalfKernelVolume). cpu
+        // only, the gpu version generates every offset.
         template <typename Device, typename Index, typename IndexGrid, unsigned NDim>
         struct CreateSubMIndicePairFunctor
         {
@@ -72,6 +86,45 @@ namespace spconv
                 const tv::SimpleVector<Index, NDim> padding,
                 const tv::SimpleVector<Index, NDim> dilation,
                 const tv::SimpleVector<Index, NDim> outSpatialShape, bool transpose, bool resetGrid = false);
+            Index operator()(
+                const Device &d, tv::TensorView<const Index> indicesIn, tv::TensorView<IndexGrid> gridsOut,
+                std::vector<std::vector<Index>> &chunkPairs,
+                const tv::SimpleVector<Index, NDim> kernelSize,
+                const tv::SimpleVector<Index, NDim> stride,
+                const tv::SimpleVector<Index, NDim> padding,
+                const tv::SimpleVector<Index, NDim> dilation,
+                const tv::SimpleVector<Index, NDim> outSpatialShape, bool transpose, bool resetGrid = false,
+                bool half = false);
+        };
+        // outputs like CreateConvIndicePairFunctor.
+        template <typename Device, typename Index, unsigned NDim>
+        struct CreateConvIndicePairHashFunctor
+        {
+            Index operator()(
+                const Device &d, tv::TensorView<const Index> indicesIn,
+                std::vector<Index> &indicesOut,
+                std::unordered_map<int64_t, Index> &table,
+                std::vector<std::vector<Index>> &chunkPairs,
+                const tv::SimpleVector<Index, NDim> kernelSize,
+                const tv::SimpleVector<Index, NDim> stride,
+                const tv::SimpleVector<Index, NDim> padding,
+                const tv::SimpleVector<Index, NDim> dilation,
+                const tv::SimpleVector<Index, NDim> outSpatialShape, bool transpose);
+        };
+
+        template <typename Device, typename Index, unsigned NDim>
+        struct CreateSubMIndicePairHashFunctor
+        {
+            Index operator()(
+                const Device &d, tv::TensorView<const Index> indicesIn,
+                std::unordered_map<int64_t, Index> &table,
+                std::vector<std::vector<Index>> &chunkPairs,
+                const tv::SimpleVector<Index, NDim> kernelSize,
+                const tv::SimpleVector<Index, NDim> stride,
+                const tv::SimpleVector<Index, NDim> padding,
+                const tv::SimpleVector<Index, NDim> dilation,
+                const tv::SimpleVector<Index, NDim> outSpatialShape, bool transpose,
+                bool half = false);
         };
     } // namespace functor
 } // namespace spconv
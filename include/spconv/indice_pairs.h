@@ -0,0 +1,260 @@
+// Copyright 2019 Yan Yan
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef SPARSE_CONV_INDICE_PAIRS_H_
+#define SPARSE_CONV_INDICE_PAIRS_H_
+
+#include <ATen/Parallel.h>
+#include <algorithm>
+#include <tensorview/tensorview.h>
+#include <torch/script.h>
+#include <vector>
+
+namespace spconv
+{
+  // indice pairs are stored in a compact layout: a flat int32 tensor of
+  // 2 * sum(indiceNum) elements. the pairs of kernel offset i are a contiguous
+  // [2, indiceNum[i]] block (input indices, then output indices) which starts
+  // at 2 * offsets[i], where offsets is the exclusive prefix sum of indiceNum.
+  // indiceNum is kept on cpu whatever the device of indicePairs: every conv
+  // and pool call needs the counts on the host, so they are copied once when
+  // the indice pairs are generated instead of once per call.
+
+  // {indicePairs, indiceNum} of the pairs collected by the cpu indice
+  // generation: chunkPairs[c * kernelVolume + k] holds the interleaved
+  // (in, out) pairs of kernel offset k found by chunk c of the active sites.
+  // the chunks are counted and prefix summed, then written in order straight
+  // into the compact buffer of 2 * sum(indiceNum) elements. only the first
+  // numOffsets kernel offsets are kept, see getHalfKernelVolume.
+  inline std::vector<torch::Tensor>
+  writeChunkIndicePairs(const std::vector<std::vector<int>> &chunkPairs,
+                        int64_t kernelVolume, int64_t numOffsets)
+  {
+    int64_t numChunks = chunkPairs.size() / kernelVolume;
+    auto indiceNum = torch::empty({numOffsets}, torch::dtype(torch::kInt32));
+    auto indiceNumData = indiceNum.data<int>();
+    std::vector<int64_t> offsets(numOffsets + 1, 0);
+    // chunkStart[c * numOffsets + k]: first pair of chunk c in offset k.
+    std::vector<int64_t> chunkStart(numChunks * numOffsets);
+    for (int64_t k = 0; k < numOffsets; ++k)
+    {
+      int64_t n = 0;
+      for (int64_t c = 0; c < numChunks; ++c)
+      {
+        chunkStart[c * numOffsets + k] = n;
+        n += chunkPairs[c * kernelVolume + k].size() / 2;
+      }
+      indiceNumData[k] = n;
+      offsets[k + 1] = offsets[k] + n;
+    }
+    auto indicePairs = torch::empty({2 * offsets.back()}, torch::dtype(torch::kInt32));
+    auto indicePairsData = indicePairs.data<int>();
+    at::parallel_for(0, numChunks * numOffsets, 1, [&](int64_t begin, int64_t end) {
+      for (int64_t i = begin; i < end; ++i)
+      {
+        auto k = i % numOffsets;
+        auto &pairs = chunkPairs[(i / numOffsets) * kernelVolume + k];
+        int *in = indicePairsData + 2 * offsets[k] + chunkStart[i];
+        int *out = in + indiceNumData[k];
+        for (size_t p = 0; p < pairs.size() / 2; ++p)
+        {
+          in[p] = pairs[2 * p];
+          out[p] = pairs[2 * p + 1];
+        }
+      }
+    });
+    return {indicePairs, indiceNum};
+  }
+
+  // convert [kernelVolume, 2, numAct] indice pairs padded with -1, which the
+  // gpu indice generation writes, to the compact layout.
+  inline torch::Tensor compactIndicePairs(torch::Tensor indicePairs,
+                                          torch::Tensor indiceNum)
+  {
+    auto numAct = indicePairs.size(2);
+    auto mask = torch::arange(numAct, indiceNum.options()).unsqueeze(0) <
+                indiceNum.unsqueeze(1);
+    return indicePairs.masked_select(mask.unsqueeze(1).expand_as(indicePairs));
+  }
+
+  // indiceNum must be a cpu tensor.
+  inline std::vector<int64_t> getIndicePairOffsets(torch::Tensor indiceNum)
+  {
+    auto kernelVolume = indiceNum.size(0);
+    auto indiceNumData = indiceNum.data<int>();
+    std::vector<int64_t> offsets(kernelVolume + 1, 0);
+    for (int i = 0; i < kernelVolume; ++i)
+    {
+      offsets[i + 1] = offsets[i] + indiceNumData[i];
+    }
+    return offsets;
+  }
+
+  // [2, indiceNum[i]] view of the indice pairs of kernel offset i.
+  template <typename Index>
+  tv::TensorView<const Index> getIndicePairsView(torch::Tensor indicePairs,
+                                                 const std::vector<int64_t> &offsets,
+                                                 int i)
+  {
+    TV_ASSERT_RT_ERR(indicePairs.dim() == 1, "indice pairs must be compact");
+    TV_ASSERT_RT_ERR(indicePairs.numel() == 2 * offsets.back(), "error");
+    return tv::TensorView<const Index>(indicePairs.data<Index>() + 2 * offsets[i],
+                                       2, offsets[i + 1] - offsets[i]);
+  }
+
+  // half subm rulebooks only keep the kernel offsets up to the center: for
+  // odd kernels the pairs of offset k are the pairs of the mirrored offset
+  // kernelVolume - 1 - k with inputs and outputs swapped. the conv ops detect
+  // them by indiceNum having fewer elements than the kernel volume.
+  inline int64_t getHalfKernelVolume(int64_t kernelVolume)
+  {
+    return kernelVolume / 2 + 1;
+  }
+
+  // {indicePairs, indiceNum} with every kernel offset of a half subm
+  // rulebook. indiceNum must be a cpu tensor.
+  inline std::vector<torch::Tensor> expandHalfIndicePairs(torch::Tensor indicePairs,
+                                                          torch::Tensor indiceNum,
+                                                          int64_t kernelVolume)
+  {
+    auto numHalf = indiceNum.size(0);
+    auto offsets = getIndicePairOffsets(indiceNum);
+    auto indiceNumData = indiceNum.data<int>();
+    auto resNum = torch::empty({kernelVolume}, indiceNum.options());
+    std::vector<torch::Tensor> blocks;
+    for (int64_t k = 0; k < kernelVolume; ++k)
+    {
+      auto src = k < numHalf ? k : kernelVolume - 1 - k;
+      int64_t n = indiceNumData[src];
+      auto block = indicePairs.narrow(0, 2 * offsets[src], 2 * n);
+      if (k >= numHalf)
+      {
+        block = block.view({2, n}).flip({0}).reshape({-1});
+      }
+      blocks.push_back(block);
+      resNum.data<int>()[k] = n;
+    }
+    return {torch::cat(blocks), resNum};
+  }
+
+  // output stationary algorithms process the outputs in tiles of
+  // kOutputTileSize rows.
+  constexpr int64_t kOutputTileSize = 512;
+
+  // tiled rulebook of the output stationary algorithms: the pairs sorted by
+  // (output tile, kernel offset) with a counting sort, so a tile finds the
+  // pairs of every offset without scanning other outputs. int32 tensor of
+  // numBins + 1 + 2 * numPairs elements, numBins = numTiles * kernelVolume:
+  // the bin offsets, the input indices, then the output indices. the pairs of
+  // tile t and offset k are [offsets[b], offsets[b + 1]), b = t *
+  // kernelVolume + k. offset k of a half subm rulebook is the mirrored offset
+  // with inputs and outputs swapped. indicePairs must be a cpu tensor.
+  inline torch::Tensor tileIndicePairs(torch::Tensor indicePairs, torch::Tensor indiceNum,
+                                       int64_t numActOut, int64_t kernelVolume,
+                                       int64_t _inverse)
+  {
+    bool inverse = _inverse != 0;
+    TV_ASSERT_INVALID_ARG(indicePairs.device().type() == torch::kCPU,
+                          "tiled indice pairs only support cpu");
+    indicePairs = indicePairs.contiguous();
+    indiceNum = indiceNum.to(torch::kCPU).contiguous();
+    auto numStored = indiceNum.size(0);
+    TV_ASSERT_INVALID_ARG(numStored == kernelVolume ||
+                              numStored == getHalfKernelVolume(kernelVolume),
+                          "indice pairs don't match the kernel size");
+    auto offsets = getIndicePairOffsets(indiceNum);
+    auto indiceNumData = indiceNum.data<int>();
+    auto pairsOf = [&](int64_t k, const int *&in, const int *&out) {
+      bool inv = inverse;
+      if (k >= numStored)
+      {
+        k = kernelVolume - 1 - k;
+        inv = !inv;
+      }
+      int64_t n = indiceNumData[k];
+      const int *block = indicePairs.data<int>() + 2 * offsets[k];
+      in = block + (inv ? n : 0);
+      out = block + (inv ? 0 : n);
+      return n;
+    };
+    int64_t numPairs = 0;
+    for (int64_t k = 0; k < kernelVolume; ++k)
+    {
+      const int *in, *out;
+      numPairs += pairsOf(k, in, out);
+    }
+    int64_t numTiles = (numActOut + kOutputTileSize - 1) / kOutputTileSize;
+    int64_t numBins = numTiles * kernelVolume;
+    auto res = torch::empty({numBins + 1 + 2 * numPairs}, torch::dtype(torch::kInt32));
+    int *binOffsets = res.data<int>();
+    int *tileIn = binOffsets + numBins + 1;
+    int *tileOut = tileIn + numPairs;
+    std::fill(binOffsets, binOffsets + numBins + 1, 0);
+    // the bins of different offsets are disjoint, so offsets are counted and
+    // placed in parallel.
+    at::parallel_for(0, kernelVolume, 1, [&](int64_t begin, int64_t end) {
+      for (int64_t k = begin; k < end; ++k)
+      {
+        const int *in, *out;
+        int64_t n = pairsOf(k, in, out);
+        for (int64_t j = 0; j < n; ++j)
+        {
+          ++binOffsets[(out[j] / kOutputTileSize) * kernelVolume + k + 1];
+        }
+      }
+    });
+    for (int64_t b = 0; b < numBins; ++b)
+    {
+      binOffsets[b + 1] += binOffsets[b];
+    }
+    std::vector<int> pos(binOffsets, binOffsets + numBins);
+    at::parallel_for(0, kernelVolume, 1, [&](int64_t begin, int64_t end) {
+      for (int64_t k = begin; k < end; ++k)
+      {
+        const int *in, *out;
+        int64_t n = pairsOf(k, in, out);
+        for (int64_t j = 0; j < n; ++j)
+        {
+          int p = pos[(out[j] / kOutputTileSize) * kernelVolume + k]++;
+          tileIn[p] = in[j];
+          tileOut[p] = out[j];
+        }
+      }
+    });
+    return res;
+  }
+
+  // {binOffsets, indicesIn, indicesOut} views of a tiled rulebook, see
+  // tileIndicePairs.
+  inline std::vector<tv::TensorView<const int>>
+  getTiledIndicePairsViews(torch::Tensor tiledPairs, int64_t numActOut,
+                           int64_t kernelVolume)
+  {
+    int64_t numTiles = (numActOut + kOutputTileSize - 1) / kOutputTileSize;
+    int64_t numBins = numTiles * kernelVolume;
+    int64_t numPairs = (tiledPairs.numel() - numBins - 1) / 2;
+    TV_ASSERT_INVALID_ARG(tiledPairs.dim() == 1 && tiledPairs.is_contiguous() &&
+                              tiledPairs.scalar_type() == torch::kInt32 &&
+                              tiledPairs.numel() == numBins + 1 + 2 * numPairs &&
+                              tiledPairs.data<int>()[numBins] == numPairs,
+                          "tiled indice pairs don't match the outputs and kernel size");
+    const int *data = tiledPairs.data<int>();
+    return {tv::TensorView<const int>(data, numBins + 1),
+            tv::TensorView<const int>(data + numBins + 1, numPairs),
+            tv::TensorView<const int>(data + numBins + 1 + numPairs, numPairs)};
+  }
+
+} // namespace spconv
+
+#endif
@@ -16,6 +16,7 @@
 #define SPARSE_POOL_OP_H_
 
 #include <cuda_runtime_api.h>
+#include <spconv/indice_pairs.h>
 #include <spconv/maxpool.h>
 #include <torch/script.h>
 #include <torch_utils.h>
@@ -28,9 +29,10 @@ namespace spconv
                               torch::Tensor indiceNum, int64_t numAct)
   {
     auto device = features.device().type();
-    auto kernelVolume = indicePairs.size(0);
+    auto kernelVolume = indiceNum.size(0);
     auto numInPlanes = features.size(1);
     auto indicePairNumCpu = indiceNum.to({torch::kCPU});
+    auto indicePairOffsets = getIndicePairOffsets(indicePairNumCpu);
     auto options =
         torch::TensorOptions().dtype(features.dtype()).device(features.device());
     torch::Tensor output = torch::zeros({numAct, numInPlanes}, options);
@@ -48,14 +50,14 @@ namespace spconv
         functor::SparseMaxPoolForwardFunctor<tv::CPU, T, int> forwardFtor;
         forwardFtor(tv::CPU(), tv::torch2tv<T>(output),
                     tv::torch2tv<const T>(features),
-                    tv::torch2tv<const int>(indicePairs).subview(i), nHot);
+                    getIndicePairsView<int>(indicePairs, indicePairOffsets, i), nHot);
       }
       else
       {
         functor::SparseMaxPoolForwardFunctor<tv::GPU, T, int> forwardFtor;
         forwardFtor(tv::TorchGPU(), tv::torch2tv<T>(output),
                     tv::torch2tv<const T>(features),
-                    tv::torch2tv<const int>(indicePairs).subview(i), nHot);
+                    getIndicePairsView<int>(indicePairs, indicePairOffsets, i), nHot);
         TV_CHECK_CUDA_ERR();
       }
       // totalTime += timer.report() / 1000.0;
@@ -70,13 +72,16 @@ namespace spconv
                                       torch::Tensor outGrad, torch::Tensor indicePairs,
                                       torch::Tensor indiceNum)
   {
+    // gradients of autograd may be expanded, the kernels index raw data.
+    outGrad = outGrad.contiguous();
     auto device = features.device().type();
     auto numInPlanes = features.size(1);
     auto indicePairNumCpu = indiceNum.to({torch::kCPU});
+    auto indicePairOffsets = getIndicePairOffsets(indicePairNumCpu);
     auto options =
         torch::TensorOptions().dtype(features.dtype()).device(features.device());
     torch::Tensor inputGrad = torch::zeros(features.sizes(), options);
-    auto kernelVolume = indicePairs.size(0);
+    auto kernelVolume = indiceNum.size(0);
     for (int i = 0; i < kernelVolume; ++i)
     {
       auto nHot = indicePairNumCpu.data<int>()[i];
@@ -90,7 +95,7 @@ namespace spconv
         backwardFtor(tv::CPU(), tv::torch2tv<const T>(outFeatures),
                      tv::torch2tv<const T>(features),
                      tv::torch2tv<const T>(outGrad), tv::torch2tv<T>(inputGrad),
-                     tv::torch2tv<const int>(indicePairs).subview(i), nHot);
+                     getIndicePairsView<int>(indicePairs, indicePairOffsets, i), nHot);
       }
       else
       {
@@ -98,7 +103,7 @@ namespace spconv
         backwardFtor(tv::TorchGPU(), tv::torch2tv<const T>(outFeatures),
                      tv::torch2tv<const T>(features),
                      tv::torch2tv<const T>(outGrad), tv::torch2tv<T>(inputGrad),
-                     tv::torch2tv<const int>(indicePairs).subview(i), nHot);
+                     getIndicePairsView<int>(indicePairs, indicePairOffsets, i), nHot);
         TV_CHECK_CUDA_ERR();
       }
     }
@@ -0,0 +1,48 @@
+// Copyright 2019 Yan Yan
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef SPARSE_CONV_QUANTIZED_FUNCTOR_H_
+#define SPARSE_CONV_QUANTIZED_FUNCTOR_H_
+#include <cstdint>
+#include <tensorview/tensorview.h>
+
+namespace spconv
+{
+  namespace functor
+  {
+    // int8 conv of uint8 features and int8 filters [kernelVolume,
+    // numInPlanes, numOutPlanes]. every output accumulates
+    // (features[in] - inputZeroPoint) * filters[k] of its pairs in int32 and
+    // is requantized once: out = clamp(round(y) + outputZeroPoint, 0, 255)
+    // with y = acc * multiplier + bias per output channel, negative y
+    // multiplied by negativeSlope (1 for identity, 0 for relu). the pairs are
+    // given by the views of a tiled rulebook, see tileIndicePairs. bias may
+    // be empty.
+    template <typename Device, typename Index>
+    struct SparseConvInt8Functor
+    {
+      void operator()(const Device &d, tv::TensorView<uint8_t> outFeatures,
+                      tv::TensorView<const uint8_t> features,
+                      tv::TensorView<const int8_t> filters, int inputZeroPoint,
+                      tv::TensorView<const Index> tileOffsets,
+                      tv::TensorView<const Index> tileIndicesIn,
+                      tv::TensorView<const Index> tileIndicesOut,
+                      tv::TensorView<const float> multiplier,
+                      tv::TensorView<const float> bias, int outputZeroPoint,
+                      float negativeSlope);
+    };
+  } // namespace functor
+} // namespace spconv
+
+#endif
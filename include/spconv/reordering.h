@@ -27,6 +27,7 @@ namespace spconv
                             tv::TensorView<const Index> indices, int size);
         };
 
+        // indices must be unique, the cpu version adds rows in parallel.
         template <typename Device, typename T, typename Index>
         struct SparseScatterAddFunctor
         {
@@ -16,26 +16,59 @@
 #define SPARSE_CONV_OP_H_
 
 #include <cuda_runtime_api.h>
+#include <spconv/depthwise.h>
+#include <spconv/fused_conv.h>
 #include <spconv/indice.h>
+#include <spconv/indice_pairs.h>
+#include <spconv/quantized_conv.h>
 #include <spconv/reordering.h>
 #include <torch/script.h>
 #include <torch_utils.h>
+#include <unordered_map>
 #include <utility/timer.h>
 
 namespace spconv
 {
+  // algorithms of indiceConv and indiceConvBackward, see spconv.ops.ConvAlgo.
+  enum ConvAlgo
+  {
+    // gather, gemm and scatter add through buffers for every kernel offset.
+    kConvAlgoNative = 0,
+    // cpu only. gather, gemm and scatter add fused in cache sized tiles.
+    kConvAlgoFused = 1,
+    // gather all kernel offsets into one buffer padded to the largest offset
+    // and run a single batched gemm.
+    kConvAlgoBatch = 2,
+    // cpu only. every output gathers its neighbors through the inverted
+    // rulebook and is written once. the backward uses kConvAlgoNative.
+    kConvAlgoOutputStationary = 3,
+  };
+
+  // activations applied by indiceConv after the accumulation, see
+  // spconv.ops.ConvActivation.
+  enum ConvActivation
+  {
+    kConvActIdentity = 0,
+    kConvActReLU = 1,
+    // actAlpha is the negative slope.
+    kConvActLeakyReLU = 2,
+  };
+
   // torch.jit's doc says only support int64, so we need to convert to int32.
+  // indiceNum is returned on cpu for all devices, see indice_pairs.h.
   template <unsigned NDim>
   std::vector<torch::Tensor>
   getIndicePair(torch::Tensor indices, int64_t batchSize,
                 std::vector<int64_t> outSpatialShape, std::vector<int64_t> spatialShape,
                 std::vector<int64_t> kernelSize, std::vector<int64_t> stride,
                 std::vector<int64_t> padding, std::vector<int64_t> dilation,
-                std::vector<int64_t> outPadding, int64_t _subM, int64_t _transpose)
+                std::vector<int64_t> outPadding, int64_t _subM, int64_t _transpose,
+                int64_t _half)
   {
     // auto timer = spconv::CudaContextTimer<>();
     bool subM = _subM != 0;
     bool transpose = _transpose != 0;
+    bool half = _half != 0;
     auto numAct = indices.size(0);
     auto coorDim = indices.size(1) - 1; // batchIdx + xyz
     TV_ASSERT_RT_ERR(NDim == coorDim, "error");
@@ -51,16 +84,13 @@ namespace spconv
       kernelVolume *= kernelSize[i];
     }
     TV_ASSERT_RT_ERR(kernelVolume <= 256, "error");
+    TV_ASSERT_INVALID_ARG(!half || (subM && kernelVolume % 2 == 1),
+                          "half indice pairs need subm conv with odd kernel size");
     auto outputVolume = outSpatialShape[0];
     for (int i = 1; i < outSpatialShape.size(); ++i)
     {
       outputVolume *= outSpatialShape[i];
     }
-    torch::Tensor indicePairs =
-        torch::full({kernelVolume, 2, numAct}, -1,
-                    torch::dtype(torch::kInt32).device(indices.device()));
-    torch::Tensor indiceNum = torch::zeros(
-        {kernelVolume}, torch::dtype(torch::kInt32).device(indices.device()));
     torch::Tensor gridOut =
         torch::full({batchSize * outputVolume}, -1,
                     torch::dtype(torch::kInt32).device(indices.device()));
@@ -71,9 +101,6 @@ namespace spconv
     tv::SimpleVector<int, NDim> stride32;
     tv::SimpleVector<int, NDim> padding32;
     tv::SimpleVector<int, NDim> dilation32;
-    auto indicePairUnique =
-        torch::full({indicePairs.numel() / 2 + 1}, std::numeric_limits<int>::max(),
-                    torch::dtype(torch::kInt32).device(indices.device()));
     for (int i = 0; i < NDim; ++i)
     {
       outSpatialShape32.push_back(outSpatialShape[i]);
@@ -91,67 +118,86 @@ namespace spconv
         dilation32.push_back(dilation[i]);
       }
     }
-    if (subM)
+    if (indices.device().type() == torch::kCPU)
     {
-      if (indices.device().type() == torch::kCPU)
+      // the cpu generation collects the pairs and output indices first, so
+      // the compact indice pairs and the output indices get their exact size.
+      std::vector<std::vector<int>> chunkPairs;
+      if (subM)
       {
         auto getIndicePairFtor =
             functor::CreateSubMIndicePairFunctor<tv::CPU, int, int, NDim>();
-        numActOut = getIndicePairFtor(
-            tv::CPU(), tv::torch2tv<const int>(indices), tv::torch2tv<int>(gridOut),
-            tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum), kernelSize32,
-            stride32, padding32, dilation32, outSpatialShape32, transpose);
+        getIndicePairFtor(tv::CPU(), tv::torch2tv<const int>(indices),
+                          tv::torch2tv<int>(gridOut), chunkPairs, kernelSize32, stride32,
+                          padding32, dilation32, outSpatialShape32, transpose, false, half);
+        auto res = writeChunkIndicePairs(
+            chunkPairs, kernelVolume, half ? getHalfKernelVolume(kernelVolume) : kernelVolume);
+        return {indices, res[0], res[1]};
       }
-      else
-      {
-        auto getIndicePairFtor =
-            functor::CreateSubMIndicePairFunctor<tv::GPU, int, int, NDim>();
-        numActOut = getIndicePairFtor(
-            tv::TorchGPU(), tv::torch2tv<const int>(indices), tv::torch2tv<int>(gridOut),
-            tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum), kernelSize32,
-            stride32, padding32, dilation32, outSpatialShape32, transpose);
-      }
-      return {indices, indicePairs, indiceNum};
+      std::vector<int> outIndsData;
+      auto getIndicePairFtor = functor::CreateConvIndicePairFunctor<tv::CPU, int, int, NDim>();
+      numActOut = getIndicePairFtor(
+          tv::CPU(), tv::torch2tv<const int>(indices), outIndsData,
+          tv::torch2tv<int>(gridOut), chunkPairs, kernelSize32,
+          stride32, padding32, dilation32, outSpatialShape32, transpose, false);
+      auto outInds = torch::empty({numActOut, coorDim + 1}, torch::dtype(torch::kInt32));
+      std::copy(outIndsData.begin(), outIndsData.end(), outInds.data<int>());
+      auto res = writeChunkIndicePairs(chunkPairs, kernelVolume, kernelVolume);
+      return {outInds, res[0], res[1]};
     }
-    else
+    // the gpu generation writes [kernelVolume, 2, numAct] indice pairs padded
+    // with -1 which are compacted afterwards.
+    torch::Tensor indicePairs =
+        torch::full({kernelVolume, 2, numAct}, -1,
+                    torch::dtype(torch::kInt32).device(indices.device()));
+    torch::Tensor indiceNum = torch::zeros(
+        {kernelVolume}, torch::dtype(torch::kInt32).device(indices.device()));
+    if (subM)
     {
-      torch::Tensor outInds =
-          torch::zeros({numAct * kernelVolume, coorDim + 1},
-                       torch::dtype(torch::kInt32).device(indices.device()));
-      if (indices.device().type() == torch::kCPU)
+      auto getIndicePairFtor =
+          functor::CreateSubMIndicePairFunctor<tv::GPU, int, int, NDim>();
+      numActOut = getIndicePairFtor(
+          tv::TorchGPU(), tv::torch2tv<const int>(indices), tv::torch2tv<int>(gridOut),
+          tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum), kernelSize32,
+          stride32, padding32, dilation32, outSpatialShape32, transpose);
+      if (half)
       {
-        auto getIndicePairFtor = functor::CreateConvIndicePairFunctor<tv::CPU, int, int, NDim>();
-        numActOut = getIndicePairFtor(
-            tv::CPU(), tv::torch2tv<const int>(indices),
-            tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
-            tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum), kernelSize32,
-            stride32, padding32, dilation32, outSpatialShape32, transpose);
+        // the gpu generates every offset.
+        indicePairs = indicePairs.slice(0, 0, getHalfKernelVolume(kernelVolume));
+        indiceNum = indiceNum.slice(0, 0, getHalfKernelVolume(kernelVolume));
       }
-      else
-      {
-        auto getIndicePairFtorP1 =
-            functor::CreateConvIndicePairFunctorP1<tv::GPU, int, int, NDim>();
-        auto getIndicePairFtorP2 =
-            functor::CreateConvIndicePairFunctorP2<tv::GPU, int, int, NDim>();
-        numActOut =
-            getIndicePairFtorP1(tv::TorchGPU(), tv::torch2tv<const int>(indices),
-                                tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
-                                tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum),
-                                tv::torch2tv<int>(indicePairUnique), kernelSize32, stride32,
-                                padding32, dilation32, outSpatialShape32, transpose);
-        if (numActOut > 0)
-        {
-          auto res = torch::_unique(indicePairUnique);
-          indicePairUnique = std::get<0>(res);
-          numActOut = getIndicePairFtorP2(
-              tv::TorchGPU(), tv::torch2tv<const int>(indices),
-              tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
-              tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum),
-              tv::torch2tv<int>(indicePairUnique), outSpatialShape32, transpose);
-        }
-      }
-      return {outInds.slice(0, 0, numActOut), indicePairs, indiceNum};
+      return {indices, compactIndicePairs(indicePairs, indiceNum), indiceNum.cpu()};
+    }
+    auto indicePairUnique =
+        torch::full({indicePairs.numel() / 2 + 1}, std::numeric_limits<int>::max(),
+                    torch::dtype(torch::kInt32).device(indices.device()));
+    auto getIndicePairFtorP1 =
+        functor::CreateConvIndicePairFunctorP1<tv::GPU, int, int, NDim>();
+    auto getIndicePairFtorP2 =
+        functor::CreateConvIndicePairFunctorP2<tv::GPU, int, int, NDim>();
+    // the output indices are allocated with their exact size once the
+    // unique output sites are known.
+    auto outInds = torch::empty({0, coorDim + 1},
+                                torch::dtype(torch::kInt32).device(indices.device()));
+    numActOut =
+        getIndicePairFtorP1(tv::TorchGPU(), tv::torch2tv<const int>(indices),
+                            tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
+                            tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum),
+                            tv::torch2tv<int>(indicePairUnique), kernelSize32, stride32,
+                            padding32, dilation32, outSpatialShape32, transpose);
+    if (numActOut > 0)
+    {
+      auto res = torch::_unique(indicePairUnique);
+      indicePairUnique = std::get<0>(res);
+      outInds = torch::zeros({indicePairUnique.size(0) - 1, coorDim + 1},
+                             torch::dtype(torch::kInt32).device(indices.device()));
+      numActOut = getIndicePairFtorP2(
+          tv::TorchGPU(), tv::torch2tv<const int>(indices),
+          tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
+          tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum),
+          tv::torch2tv<int>(indicePairUnique), outSpatialShape32, transpose);
     }
+    return {outInds, compactIndicePairs(indicePairs, indiceNum), indiceNum.cpu()};
   }
 
   template <unsigned NDim>
@@ -160,11 +206,13 @@ namespace spconv
                        std::vector<int64_t> outSpatialShape, std::vector<int64_t> spatialShape,
                        std::vector<int64_t> kernelSize, std::vector<int64_t> stride,
                        std::vector<int64_t> padding, std::vector<int64_t> dilation,
-                       std::vector<int64_t> outPadding, int64_t _subM, int64_t _transpose)
+                       std::vector<int64_t> outPadding, int64_t _subM, int64_t _transpose,
+                       int64_t _half)
   {
     // auto timer = spconv::CudaContextTimer<>();
     bool subM = _subM != 0;
     bool transpose = _transpose != 0;
+    bool half = _half != 0;
     auto numAct = indices.size(0);
     auto coorDim = indices.size(1) - 1; // batchIdx + xyz
     TV_ASSERT_RT_ERR(NDim == coorDim, "error");
@@ -180,17 +228,14 @@ namespace spconv
       kernelVolume *= kernelSize[i];
     }
     TV_ASSERT_RT_ERR(kernelVolume <= 256, "error");
+    TV_ASSERT_INVALID_ARG(!half || (subM && kernelVolume % 2 == 1),
+                          "half indice pairs need subm conv with odd kernel size");
     auto outputVolume = outSpatialShape[0];
     for (int i = 1; i < outSpatialShape.size(); ++i)
     {
       outputVolume *= outSpatialShape[i];
     }
     TV_ASSERT_INVALID_ARG(gridOut.numel() >= outputVolume * batchSize, "error");
-    torch::Tensor indicePairs =
-        torch::full({kernelVolume, 2, numAct}, -1,
-                    torch::dtype(torch::kInt32).device(indices.device()));
-    torch::Tensor indiceNum = torch::zeros(
-        {kernelVolume}, torch::dtype(torch::kInt32).device(indices.device()));
     // std::cout << "full time " << timer.report() / 1000.0 << std::endl;
     int64_t numActOut = -1;
     tv::SimpleVector<int, NDim> outSpatialShape32;
@@ -198,9 +243,6 @@ namespace spconv
     tv::SimpleVector<int, NDim> stride32;
     tv::SimpleVector<int, NDim> padding32;
     tv::SimpleVector<int, NDim> dilation32;
-    auto indicePairUnique =
-        torch::full({indicePairs.numel() / 2 + 1}, std::numeric_limits<int>::max(),
-                    torch::dtype(torch::kInt32).device(indices.device()));
     for (int i = 0; i < NDim; ++i)
     {
       outSpatialShape32.push_back(outSpatialShape[i]);
@@ -218,86 +260,492 @@ namespace spconv
         dilation32.push_back(dilation[i]);
       }
     }
-    if (subM)
+    if (indices.device().type() == torch::kCPU)
     {
-      if (indices.device().type() == torch::kCPU)
+      // the cpu generation collects the pairs and output indices first, so
+      // the compact indice pairs and the output indices get their exact size.
+      std::vector<std::vector<int>> chunkPairs;
+      if (subM)
       {
         auto getIndicePairFtor =
             functor::CreateSubMIndicePairFunctor<tv::CPU, int, int, NDim>();
-        numActOut = getIndicePairFtor(
-            tv::CPU(), tv::torch2tv<const int>(indices), tv::torch2tv<int>(gridOut),
-            tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum), kernelSize32,
-            stride32, padding32, dilation32, outSpatialShape32, transpose);
-        gridOut.fill_(-1);
+        getIndicePairFtor(tv::CPU(), tv::torch2tv<const int>(indices),
+                          tv::torch2tv<int>(gridOut), chunkPairs, kernelSize32, stride32,
+                          padding32, dilation32, outSpatialShape32, transpose, true, half);
+        auto res = writeChunkIndicePairs(
+            chunkPairs, kernelVolume, half ? getHalfKernelVolume(kernelVolume) : kernelVolume);
+        return {indices, res[0], res[1]};
+      }
+      std::vector<int> outIndsData;
+      auto getIndicePairFtor = functor::CreateConvIndicePairFunctor<tv::CPU, int, int, NDim>();
+      numActOut = getIndicePairFtor(
+          tv::CPU(), tv::torch2tv<const int>(indices), outIndsData,
+          tv::torch2tv<int>(gridOut), chunkPairs, kernelSize32,
+          stride32, padding32, dilation32, outSpatialShape32, transpose, true);
+      auto outInds = torch::empty({numActOut, coorDim + 1}, torch::dtype(torch::kInt32));
+      std::copy(outIndsData.begin(), outIndsData.end(), outInds.data<int>());
+      auto res = writeChunkIndicePairs(chunkPairs, kernelVolume, kernelVolume);
+      return {outInds, res[0], res[1]};
+    }
+    // the gpu generation writes [kernelVolume, 2, numAct] indice pairs padded
+    // with -1 which are compacted afterwards.
+    torch::Tensor indicePairs =
+        torch::full({kernelVolume, 2, numAct}, -1,
+                    torch::dtype(torch::kInt32).device(indices.device()));
+    torch::Tensor indiceNum = torch::zeros(
+        {kernelVolume}, torch::dtype(torch::kInt32).device(indices.device()));
+    if (subM)
+    {
+      auto getIndicePairFtor =
+          functor::CreateSubMIndicePairFunctor<tv::GPU, int, int, NDim>();
+      numActOut = getIndicePairFtor(
+          tv::TorchGPU(), tv::torch2tv<const int>(indices), tv::torch2tv<int>(gridOut),
+          tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum), kernelSize32,
+          stride32, padding32, dilation32, outSpatialShape32, transpose, true);
+      if (half)
+      {
+        // the gpu generates every offset.
+        indicePairs = indicePairs.slice(0, 0, getHalfKernelVolume(kernelVolume));
+        indiceNum = indiceNum.slice(0, 0, getHalfKernelVolume(kernelVolume));
+      }
+      return {indices, compactIndicePairs(indicePairs, indiceNum), indiceNum.cpu()};
+    }
+    auto indicePairUnique =
+        torch::full({indicePairs.numel() / 2 + 1}, std::numeric_limits<int>::max(),
+                    torch::dtype(torch::kInt32).device(indices.device()));
+    auto getIndicePairFtorP1 =
+        functor::CreateConvIndicePairFunctorP1<tv::GPU, int, int, NDim>();
+    auto getIndicePairFtorP2 =
+        functor::CreateConvIndicePairFunctorP2<tv::GPU, int, int, NDim>();
+    // the output indices are allocated with their exact size once the
+    // unique output sites are known.
+    auto outInds = torch::empty({0, coorDim + 1},
+                                torch::dtype(torch::kInt32).device(indices.device()));
+    numActOut =
+        getIndicePairFtorP1(tv::TorchGPU(), tv::torch2tv<const int>(indices),
+                            tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
+                            tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum),
+                            tv::torch2tv<int>(indicePairUnique), kernelSize32, stride32,
+                            padding32, dilation32, outSpatialShape32, transpose);
+    if (numActOut > 0)
+    {
+      auto res = torch::_unique(indicePairUnique);
+      indicePairUnique = std::get<0>(res);
+      outInds = torch::zeros({indicePairUnique.size(0) - 1, coorDim + 1},
+                             torch::dtype(torch::kInt32).device(indices.device()));
+      numActOut = getIndicePairFtorP2(
+          tv::TorchGPU(), tv::torch2tv<const int>(indices),
+          tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
+          tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum),
+          tv::torch2tv<int>(indicePairUnique), outSpatialShape32, transpose, true);
+    }
+    return {outInds, compactIndicePairs(indicePairs, indiceNum), indiceNum.cpu()};
+  }
+
+  // same as getIndicePair but the output sites are tracked by a hash table
+  // instead of a dense grid, which is much cheaper when the spatial volume is
+  // large compared to the number of active sites. only support cpu.
+  template <unsigned NDim>
+  std::vector<torch::Tensor>
+  getIndicePairHash(torch::Tensor indices, int64_t batchSize,
+                    std::vector<int64_t> outSpatialShape, std::vector<int64_t> spatialShape,
+                    std::vector<int64_t> kernelSize, std::vector<int64_t> stride,
+                    std::vector<int64_t> padding, std::vector<int64_t> dilation,
+                    std::vector<int64_t> outPadding, int64_t _subM, int64_t _transpose,
+                    int64_t _half)
+  {
+    bool subM = _subM != 0;
+    bool transpose = _transpose != 0;
+    bool half = _half != 0;
+    auto coorDim = indices.size(1) - 1; // batchIdx + xyz
+    TV_ASSERT_INVALID_ARG(indices.device().type() == torch::kCPU,
+                          "hash indice pairs only support cpu");
+    TV_ASSERT_RT_ERR(NDim == coorDim, "error");
+    TV_ASSERT_RT_ERR(kernelSize.size() == coorDim, "error");
+    TV_ASSERT_RT_ERR(outSpatialShape.size() == coorDim, "error");
+    TV_ASSERT_RT_ERR(stride.size() == coorDim, "error");
+    TV_ASSERT_RT_ERR(padding.size() == coorDim, "error");
+    TV_ASSERT_RT_ERR(outPadding.size() == coorDim, "error");
+    TV_ASSERT_RT_ERR(dilation.size() == coorDim, "error");
+    auto kernelVolume = kernelSize[0];
+    for (int i = 1; i < kernelSize.size(); ++i)
+    {
+      kernelVolume *= kernelSize[i];
+    }
+    TV_ASSERT_RT_ERR(kernelVolume <= 256, "error");
+    TV_ASSERT_INVALID_ARG(!half || (subM && kernelVolume % 2 == 1),
+                          "half indice pairs need subm conv with odd kernel size");
+    std::unordered_map<int64_t, int> table;
+    int64_t numActOut = -1;
+    tv::SimpleVector<int, NDim> outSpatialShape32;
+    tv::SimpleVector<int, NDim> kernelSize32;
+    tv::SimpleVector<int, NDim> stride32;
+    tv::SimpleVector<int, NDim> padding32;
+    tv::SimpleVector<int, NDim> dilation32;
+    for (int i = 0; i < NDim; ++i)
+    {
+      outSpatialShape32.push_back(outSpatialShape[i]);
+      kernelSize32.push_back(kernelSize[i]);
+      if (subM)
+      {
+        stride32.push_back(1);
+        padding32.push_back(kernelSize[i] / 2);
+        dilation32.push_back(dilation[i]);
       }
       else
       {
-        auto getIndicePairFtor =
-            functor::CreateSubMIndicePairFunctor<tv::GPU, int, int, NDim>();
-        numActOut = getIndicePairFtor(
-            tv::TorchGPU(), tv::torch2tv<const int>(indices), tv::torch2tv<int>(gridOut),
-            tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum), kernelSize32,
-            stride32, padding32, dilation32, outSpatialShape32, transpose, true);
+        stride32.push_back(stride[i]);
+        padding32.push_back(padding[i]);
+        dilation32.push_back(dilation[i]);
       }
-      return {indices, indicePairs, indiceNum};
+    }
+    std::vector<std::vector<int>> chunkPairs;
+    if (subM)
+    {
+      auto getIndicePairFtor =
+          functor::CreateSubMIndicePairHashFunctor<tv::CPU, int, NDim>();
+      getIndicePairFtor(tv::CPU(), tv::torch2tv<const int>(indices), table, chunkPairs,
+                        kernelSize32, stride32, padding32, dilation32, outSpatialShape32,
+                        transpose, half);
+      auto res = writeChunkIndicePairs(
+          chunkPairs, kernelVolume, half ? getHalfKernelVolume(kernelVolume) : kernelVolume);
+      return {indices, res[0], res[1]};
+    }
+    std::vector<int> outIndsData;
+    auto getIndicePairFtor =
+        functor::CreateConvIndicePairHashFunctor<tv::CPU, int, NDim>();
+    numActOut = getIndicePairFtor(
+        tv::CPU(), tv::torch2tv<const int>(indices), outIndsData, table, chunkPairs,
+        kernelSize32, stride32, padding32, dilation32, outSpatialShape32, transpose);
+    auto outInds = torch::empty({numActOut, coorDim + 1}, torch::dtype(torch::kInt32));
+    std::copy(outIndsData.begin(), outIndsData.end(), outInds.data<int>());
+    auto res = writeChunkIndicePairs(chunkPairs, kernelVolume, kernelVolume);
+    return {outInds, res[0], res[1]};
+  }
+
+  // [rows, cols[i]] buffers carved out of workspace, a 1d tensor which is
+  // grown with resize_ so that the caller keeps its storage for later calls.
+  // the contents of the buffers are undefined.
+  inline std::vector<torch::Tensor>
+  getWorkspaceBuffers(torch::Tensor workspace, torch::TensorOptions options,
+                      int64_t rows, std::vector<int64_t> cols)
+  {
+    TV_ASSERT_INVALID_ARG(workspace.dim() == 1 && workspace.is_contiguous(),
+                          "workspace must be a contiguous 1d tensor");
+    TV_ASSERT_INVALID_ARG(workspace.dtype() == options.dtype() &&
+                              workspace.device() == options.device(),
+                          "workspace must have the dtype and device of features");
+    int64_t numel = 0;
+    for (auto c : cols)
+    {
+      numel += rows * c;
+    }
+    if (workspace.numel() < numel)
+    {
+      workspace.resize_({numel});
+    }
+    std::vector<torch::Tensor> res;
+    int64_t start = 0;
+    for (auto c : cols)
+    {
+      res.push_back(workspace.narrow(0, start, rows * c).view({rows, c}));
+      start += rows * c;
+    }
+    return res;
+  }
+
+  // buffer[:size] = features[indices[:size]] on the device of features.
+  template <typename T>
+  void gatherRows(torch::Tensor buffer, torch::Tensor features,
+                  tv::TensorView<const int> indices, int size)
+  {
+    if (features.device().type() == torch::kCPU)
+    {
+      functor::SparseGatherFunctor<tv::CPU, T, int> gatherFtor;
+      gatherFtor(tv::CPU(), tv::torch2tv<T>(buffer),
+                 tv::torch2tv<const T>(features), indices, size);
     }
     else
     {
-      torch::Tensor outInds =
-          torch::zeros({numAct * kernelVolume, coorDim + 1},
-                       torch::dtype(torch::kInt32).device(indices.device()));
-      if (indices.device().type() == torch::kCPU)
+      functor::SparseGatherFunctor<tv::GPU, T, int> gatherFtor;
+      gatherFtor(tv::TorchGPU(), tv::torch2tv<T>(buffer),
+                 tv::torch2tv<const T>(features), indices, size);
+      TV_CHECK_CUDA_ERR();
+    }
+  }
+
+  // output[indices[:size]] += buffer[:size] on the device of output.
+  template <typename T>
+  void scatterAddRows(torch::Tensor output, torch::Tensor buffer,
+                      tv::TensorView<const int> indices, int size)
+  {
+    if (output.device().type() == torch::kCPU)
+    {
+      functor::SparseScatterAddFunctor<tv::CPU, T, int> scatterFtor;
+      scatterFtor(tv::CPU(), tv::torch2tv<T>(output),
+                  tv::torch2tv<const T>(buffer), indices, size, true);
+    }
+    else
+    {
+      functor::SparseScatterAddFunctor<tv::GPU, T, int> scatterFtor;
+      scatterFtor(tv::TorchGPU(), tv::torch2tv<T>(output),
+                  tv::torch2tv<const T>(buffer), indices, size, true);
+      TV_CHECK_CUDA_ERR();
+    }
+  }
+
+  // kernel offsets used by the batched algorithm and their max number of
+  // pairs. the center offset of subm conv is skipped.
+  inline std::pair<std::vector<int64_t>, int>
+  getBatchOffsets(torch::Tensor indicePairNumCpu, bool subM, int centerOffset)
+  {
+    std::vector<int64_t> batchOffsets;
+    int maxSize = 0;
+    auto indicePairNum = indicePairNumCpu.data<int>();
+    for (int i = 0; i < indicePairNumCpu.size(0); ++i)
+    {
+      if (indicePairNum[i] <= 0 || (subM && i == centerOffset))
       {
-        auto getIndicePairFtor = functor::CreateConvIndicePairFunctor<tv::CPU, int, int, NDim>();
-        numActOut = getIndicePairFtor(
-            tv::CPU(), tv::torch2tv<const int>(indices),
-            tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
-            tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum), kernelSize32,
-            stride32, padding32, dilation32, outSpatialShape32, transpose, true);
-        gridOut.fill_(-1);
+        continue;
       }
-      else
+      batchOffsets.push_back(i);
+      maxSize = std::max(maxSize, indicePairNum[i]);
+    }
+    return {batchOffsets, maxSize};
+  }
+
+  // output += conv of all non-center offsets with one batched gemm. rows past
+  // the size of an offset are padding and never scattered.
+  template <typename T>
+  void indiceConvBatch(torch::Tensor output, torch::Tensor features,
+                       torch::Tensor filters, torch::Tensor indicePairs,
+                       torch::Tensor indicePairNumCpu,
+                       const std::vector<int64_t> &indicePairOffsets,
+                       bool inverse, bool subM, int centerOffset)
+  {
+    auto batch = getBatchOffsets(indicePairNumCpu, subM, centerOffset);
+    auto &batchOffsets = batch.first;
+    int64_t numBatch = batchOffsets.size();
+    if (numBatch == 0)
+    {
+      return;
+    }
+    auto numInPlanes = features.size(1);
+    auto numOutPlanes = output.size(1);
+    auto options = features.options();
+    auto inputBuffer = torch::empty({numBatch, batch.second, numInPlanes}, options);
+    auto outputBuffer = torch::empty({numBatch, batch.second, numOutPlanes}, options);
+    for (int64_t j = 0; j < numBatch; ++j)
+    {
+      int i = batchOffsets[j];
+      gatherRows<T>(inputBuffer[j], features,
+                    getIndicePairsView<int>(indicePairs, indicePairOffsets, i).subview(inverse),
+                    indicePairNumCpu.data<int>()[i]);
+    }
+    auto batchIndex = torch::tensor(batchOffsets, torch::kInt64).to(features.device());
+    torch::bmm_out(outputBuffer, inputBuffer, filters.index_select(0, batchIndex));
+    for (int64_t j = 0; j < numBatch; ++j)
+    {
+      int i = batchOffsets[j];
+      scatterAddRows<T>(output, outputBuffer[j],
+                        getIndicePairsView<int>(indicePairs, indicePairOffsets, i).subview(!inverse),
+                        indicePairNumCpu.data<int>()[i]);
+    }
+  }
+
+  // backward of indiceConvBatch. the padding rows are zero here because they
+  // are reduced into the filter gradient. only the gradients whose flag is set
+  // are computed.
+  template <typename T>
+  void indiceConvBackwardBatch(torch::Tensor inputGrad, torch::Tensor filtersGrad,
+                               torch::Tensor features, torch::Tensor filters,
+                               torch::Tensor outGrad, torch::Tensor indicePairs,
+                               torch::Tensor indicePairNumCpu,
+                               const std::vector<int64_t> &indicePairOffsets,
+                               bool inverse, bool subM, int centerOffset,
+                               bool computeInputGrad, bool computeFilterGrad)
+  {
+    auto batch = getBatchOffsets(indicePairNumCpu, subM, centerOffset);
+    auto &batchOffsets = batch.first;
+    int64_t numBatch = batchOffsets.size();
+    if (numBatch == 0)
+    {
+      return;
+    }
+    auto numInPlanes = features.size(1);
+    auto numOutPlanes = outGrad.size(1);
+    auto options = features.options();
+    auto inputBuffer = torch::zeros({numBatch, batch.second, numInPlanes}, options);
+    auto outputBuffer = torch::zeros({numBatch, batch.second, numOutPlanes}, options);
+    for (int64_t j = 0; j < numBatch; ++j)
+    {
+      int i = batchOffsets[j];
+      auto pairs = getIndicePairsView<int>(indicePairs, indicePairOffsets, i);
+      int nHot = indicePairNumCpu.data<int>()[i];
+      if (computeFilterGrad)
       {
-        auto getIndicePairFtorP1 =
-            functor::CreateConvIndicePairFunctorP1<tv::GPU, int, int, NDim>();
-        auto getIndicePairFtorP2 =
-            functor::CreateConvIndicePairFunctorP2<tv::GPU, int, int, NDim>();
-        numActOut =
-            getIndicePairFtorP1(tv::TorchGPU(), tv::torch2tv<const int>(indices),
-                                tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
-                                tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum),
-                                tv::torch2tv<int>(indicePairUnique), kernelSize32, stride32,
-                                padding32, dilation32, outSpatialShape32, transpose);
-        if (numActOut > 0)
-        {
-          auto res = torch::_unique(indicePairUnique);
-          indicePairUnique = std::get<0>(res);
-          numActOut = getIndicePairFtorP2(
-              tv::TorchGPU(), tv::torch2tv<const int>(indices),
-              tv::torch2tv<int>(outInds), tv::torch2tv<int>(gridOut),
-              tv::torch2tv<int>(indicePairs), tv::torch2tv<int>(indiceNum),
-              tv::torch2tv<int>(indicePairUnique), outSpatialShape32, transpose, true);
-        }
+        gatherRows<T>(inputBuffer[j], features, pairs.subview(inverse), nHot);
       }
-      return {outInds.slice(0, 0, numActOut), indicePairs, indiceNum};
+      gatherRows<T>(outputBuffer[j], outGrad, pairs.subview(!inverse), nHot);
+    }
+    auto batchIndex = torch::tensor(batchOffsets, torch::kInt64).to(features.device());
+    if (computeFilterGrad)
+    {
+      filtersGrad.index_copy_(0, batchIndex,
+                              torch::bmm(inputBuffer.transpose(1, 2), outputBuffer));
+    }
+    if (!computeInputGrad)
+    {
+      return;
+    }
+    torch::bmm_out(inputBuffer, outputBuffer,
+                   filters.index_select(0, batchIndex).transpose(1, 2));
+    for (int64_t j = 0; j < numBatch; ++j)
+    {
+      int i = batchOffsets[j];
+      scatterAddRows<T>(inputGrad, inputBuffer[j],
+                        getIndicePairsView<int>(indicePairs, indicePairOffsets, i).subview(inverse),
+                        indicePairNumCpu.data<int>()[i]);
+    }
+  }
+
+  // grouped filters are [numInPlanes / groups, numOutPlanes]: the output
+  // planes of group g only see the input planes of group g. depthwise filters
+  // ([1, numPlanes], groups == numPlanes) are applied elementwise.
+  inline bool isDepthwiseFilter(torch::Tensor filter, int64_t groups)
+  {
+    return filter.size(0) == 1 && filter.size(1) == groups;
+  }
+
+  // out = in * filter.
+  inline void groupedMmOut(torch::Tensor out, torch::Tensor in, torch::Tensor filter,
+                           int64_t groups)
+  {
+    if (groups == 1)
+    {
+      torch::mm_out(out, in, filter);
+      return;
+    }
+    if (isDepthwiseFilter(filter, groups))
+    {
+      torch::mul_out(out, in, filter);
+      return;
+    }
+    auto n = in.size(0);
+    auto res = torch::bmm(in.view({n, groups, -1}).transpose(0, 1),
+                          filter.view({filter.size(0), groups, -1}).transpose(0, 1));
+    out.copy_(res.transpose(0, 1).reshape({n, -1}));
+  }
+
+  // filterGrad = in^T * outGrad.
+  inline void groupedFilterGradOut(torch::Tensor filterGrad, torch::Tensor in,
+                                   torch::Tensor outGrad, int64_t groups)
+  {
+    if (groups == 1)
+    {
+      torch::mm_out(filterGrad, in.t(), outGrad);
+      return;
+    }
+    if (isDepthwiseFilter(filterGrad, groups))
+    {
+      torch::sum_out(filterGrad, in * outGrad, {0}, true);
+      return;
+    }
+    auto n = in.size(0);
+    auto res = torch::bmm(in.view({n, groups, -1}).permute({1, 2, 0}),
+                          outGrad.view({n, groups, -1}).transpose(0, 1));
+    filterGrad.copy_(res.transpose(0, 1).reshape({filterGrad.size(0), -1}));
+  }
+
+  // inGrad = outGrad * filter^T.
+  inline void groupedInputGradOut(torch::Tensor inGrad, torch::Tensor outGrad,
+                                  torch::Tensor filter, int64_t groups)
+  {
+    if (groups == 1)
+    {
+      torch::mm_out(inGrad, outGrad, filter.t());
+      return;
+    }
+    if (isDepthwiseFilter(filter, groups))
+    {
+      torch::mul_out(inGrad, outGrad, filter);
+      return;
+    }
+    auto n = outGrad.size(0);
+    auto res = torch::bmm(outGrad.view({n, groups, -1}).transpose(0, 1),
+                          filter.view({filter.size(0), groups, -1}).permute({1, 2, 0}));
+    inGrad.copy_(res.transpose(0, 1).reshape({n, -1}));
+  }
+
+  // number of groups of filters [*kernelSize, numInPlanes / groups,
+  // numOutPlanes]. grouped conv only supports the native algorithm.
+  inline int64_t getConvGroups(torch::Tensor features, torch::Tensor filters, int64_t algo)
+  {
+    auto ndim = filters.dim() - 2;
+    auto numInPlanes = features.size(1);
+    auto numOutPlanes = filters.size(ndim + 1);
+    auto groups = numInPlanes / filters.size(ndim);
+    TV_ASSERT_INVALID_ARG(groups * filters.size(ndim) == numInPlanes &&
+                              numOutPlanes % groups == 0,
+                          "channels must be divisible by groups");
+    TV_ASSERT_INVALID_ARG(groups == 1 || algo == kConvAlgoNative,
+                          "grouped conv only supports the native algorithm");
+    return groups;
+  }
+
+  inline void applyConvActivation(torch::Tensor output, int64_t act, double actAlpha)
+  {
+    if (act == kConvActReLU)
+    {
+      output.relu_();
+    }
+    else if (act == kConvActLeakyReLU)
+    {
+      torch::leaky_relu_(output, actAlpha);
     }
   }
 
+  // bias (empty for none) and the activation act are applied to the output in
+  // the same call: bias initializes the accumulation (or is added by the gemm
+  // of the subm center), the activation is applied in place at the end.
+  // tiledPairs is the tiled rulebook of kConvAlgoOutputStationary (see
+  // tileIndicePairs), built here if empty.
   template <typename T>
   torch::Tensor indiceConv(torch::Tensor features, torch::Tensor filters,
                            torch::Tensor indicePairs, torch::Tensor indiceNum,
-                           int64_t numActOut, int64_t _inverse, int64_t _subM)
+                           int64_t numActOut, int64_t _inverse, int64_t _subM,
+                           int64_t algo, torch::Tensor bias, int64_t act,
+                           double actAlpha, torch::Tensor workspace,
+                           torch::Tensor tiledPairs)
   {
     bool subM = _subM != 0;
     bool inverse = _inverse != 0;
     auto device = features.device().type();
+    TV_ASSERT_INVALID_ARG(algo >= kConvAlgoNative && algo <= kConvAlgoOutputStationary,
+                          "unknown conv algorithm");
+    TV_ASSERT_INVALID_ARG(algo != kConvAlgoFused || device == torch::kCPU,
+                          "fused conv algorithm only supports cpu");
+    TV_ASSERT_INVALID_ARG(algo != kConvAlgoOutputStationary || device == torch::kCPU,
+                          "output stationary conv algorithm only supports cpu");
+    TV_ASSERT_INVALID_ARG(act >= kConvActIdentity && act <= kConvActLeakyReLU,
+                          "unknown conv activation");
     auto ndim = filters.dim() - 2;
-    auto kernelVolume = indicePairs.size(0);
+    // indiceNum has fewer offsets than the filters for half subm rulebooks.
+    auto kernelVolume = filters.numel() / (filters.size(ndim) * filters.size(ndim + 1));
+    bool half = indiceNum.size(0) != kernelVolume;
+    TV_ASSERT_INVALID_ARG(!half || (subM && indiceNum.size(0) == getHalfKernelVolume(kernelVolume)),
+                          "indice pairs don't match the kernel size");
     auto numInPlanes = features.size(1);
     auto numOutPlanes = filters.size(ndim + 1);
+    auto groups = getConvGroups(features, filters, algo);
+    bool depthwise = groups == numInPlanes && groups == numOutPlanes;
+    bool hasBias = bias.numel() > 0;
+    TV_ASSERT_INVALID_ARG(!hasBias || bias.numel() == numOutPlanes,
+                          "bias must have out channels elements");
     auto indicePairNumCpu = indiceNum.to({torch::kCPU});
+    auto indicePairOffsets = getIndicePairOffsets(indicePairNumCpu);
     auto indicePairMaxSizeIter = std::max_element(
-        indicePairNumCpu.data<int>(), indicePairNumCpu.data<int>() + kernelVolume);
+        indicePairNumCpu.data<int>(), indicePairNumCpu.data<int>() + indicePairNumCpu.numel());
     int indicePairMaxOffset = indicePairMaxSizeIter - indicePairNumCpu.data<int>();
     int indicePairMaxSize = *indicePairMaxSizeIter;
 
@@ -315,26 +763,116 @@ namespace spconv
     // auto indicePairOptions =
     //     torch::TensorOptions().dtype(torch::kInt64).device(indicePairs.device());
 
-    torch::Tensor output = torch::zeros({numActOut, numOutPlanes}, options);
-    torch::Tensor inputBuffer = torch::zeros({indicePairMaxSize, numInPlanes}, options);
-    torch::Tensor outputBuffer =
-        torch::zeros({indicePairMaxSize, numOutPlanes}, options);
-    filters = filters.view({-1, numInPlanes, numOutPlanes});
+    if (algo == kConvAlgoOutputStationary)
+    {
+      if (tiledPairs.numel() == 0)
+      {
+        tiledPairs = tileIndicePairs(indicePairs, indicePairNumCpu, numActOut,
+                                     kernelVolume, inverse);
+      }
+      auto tiled = getTiledIndicePairsViews(tiledPairs, numActOut, kernelVolume);
+      torch::Tensor output = torch::empty({numActOut, numOutPlanes}, options);
+      if (hasBias)
+      {
+        bias = bias.contiguous();
+      }
+      functor::SparseConvOutputStationaryFunctor<tv::CPU, T, int> ftor;
+      ftor(tv::CPU(), tv::torch2tv<T>(output), tv::torch2tv<const T>(features.contiguous()),
+           tv::torch2tv<const T>(filters.contiguous()), tiled[0], tiled[1], tiled[2],
+           hasBias ? tv::torch2tv<const T>(bias) : tv::TensorView<const T>());
+      applyConvActivation(output, act, actAlpha);
+      return output;
+    }
+    if (half && algo == kConvAlgoBatch)
+    {
+      // the batched gemm indexes every kernel offset of the rulebook.
+      auto expanded = expandHalfIndicePairs(indicePairs, indicePairNumCpu, kernelVolume);
+      indicePairs = expanded[0];
+      indicePairNumCpu = expanded[1];
+      indicePairOffsets = getIndicePairOffsets(indicePairNumCpu);
+      half = false;
+    }
+    // the center offset of subm conv overwrites every output row.
+    torch::Tensor output;
+    if (subM)
+    {
+      output = torch::empty({numActOut, numOutPlanes}, options);
+    }
+    else if (hasBias)
+    {
+      output = bias.view({1, numOutPlanes}).expand({numActOut, numOutPlanes}).contiguous();
+    }
+    else
+    {
+      output = torch::zeros({numActOut, numOutPlanes}, options);
+    }
+    // the fused and batched algorithms don't use these buffers.
+    int bufferSize = algo == kConvAlgoNative ? indicePairMaxSize : 0;
+    auto buffers = getWorkspaceBuffers(workspace, options, bufferSize,
+                                       {numInPlanes, numOutPlanes});
+    torch::Tensor inputBuffer = buffers[0];
+    torch::Tensor outputBuffer = buffers[1];
+    filters = filters.view({-1, numInPlanes / groups, numOutPlanes});
     if (subM)
     { // the center index of subm conv don't need gather and scatter
       // add.
-      torch::mm_out(output, features, filters[indicePairMaxOffset]);
+      if (hasBias && groups == 1)
+      {
+        torch::addmm_out(output, bias, features, filters[indicePairMaxOffset]);
+      }
+      else
+      {
+        groupedMmOut(output, features, filters[indicePairMaxOffset], groups);
+        if (hasBias)
+        {
+          output.add_(bias);
+        }
+      }
+    }
+    if (algo == kConvAlgoBatch)
+    {
+      indiceConvBatch<T>(output, features, filters, indicePairs, indicePairNumCpu,
+                         indicePairOffsets, inverse, subM, indicePairMaxOffset);
+      applyConvActivation(output, act, actAlpha);
+      return output;
     }
     double totalGatherTime = 0;
     double totalGEMMTime = 0;
     double totalSAddTime = 0;
     for (int i = 0; i < kernelVolume; ++i)
     {
-      auto nHot = indicePairNumCpu.data<int>()[i];
+      // offset i of a half subm rulebook is stored as the mirrored offset
+      // with inputs and outputs swapped.
+      int pairIdx = i;
+      bool inv = inverse;
+      if (half && i >= indicePairNumCpu.size(0))
+      {
+        pairIdx = kernelVolume - 1 - i;
+        inv = !inverse;
+      }
+      auto nHot = indicePairNumCpu.data<int>()[pairIdx];
       if (nHot <= 0 || (subM && i == indicePairMaxOffset))
       {
         continue;
       }
+      if (depthwise && device == torch::kCPU)
+      {
+        auto pairs = getIndicePairsView<int>(indicePairs, indicePairOffsets, pairIdx);
+        functor::SparseDepthwiseConvFunctor<tv::CPU, T, int> depthwiseFtor;
+        depthwiseFtor(tv::CPU(), tv::torch2tv<T>(output), tv::torch2tv<const T>(features),
+                      tv::torch2tv<const T>(filters[i]), pairs.subview(inv),
+                      pairs.subview(!inv), nHot);
+        continue;
+      }
+      if (algo == kConvAlgoFused)
+      {
+        auto pairs = getIndicePairsView<int>(indicePairs, indicePairOffsets, pairIdx);
+        functor::SparseConvFusedFunctor<tv::CPU, T, int> fusedFtor;
+        fusedFtor(tv::CPU(), tv::torch2tv<T>(output), tv::torch2tv<const T>(features),
+                  tv::torch2tv<const T>(filters[i]), pairs.subview(inv),
+                  pairs.subview(!inv), nHot);
+        continue;
+      }
       // auto timer = spconv::CudaContextTimer<>();
       auto outputBufferBlob =
           torch::from_blob(outputBuffer.data<T>(), {nHot, numOutPlanes}, options);
@@ -346,14 +884,14 @@ namespace spconv
         functor::SparseGatherFunctor<tv::CPU, T, int> gatherFtor;
         gatherFtor(tv::CPU(), tv::torch2tv<T>(inputBuffer),
                    tv::torch2tv<const T>(features),
-                   tv::torch2tv<const int>(indicePairs).subview(i, inverse), nHot);
+                   getIndicePairsView<int>(indicePairs, indicePairOffsets, pairIdx).subview(inv), nHot);
       }
       else
       {
         functor::SparseGatherFunctor<tv::GPU, T, int> gatherFtor;
         gatherFtor(tv::TorchGPU(), tv::torch2tv<T>(inputBuffer),
                    tv::torch2tv<const T>(features),
-                   tv::torch2tv<const int>(indicePairs).subview(i, inverse), nHot);
+                   getIndicePairsView<int>(indicePairs, indicePairOffsets, pairIdx).subview(inv), nHot);
         TV_CHECK_CUDA_ERR();
         /* slower than SparseGatherFunctor, may due to int->long conversion
         auto indicePairLong = indicePairs[i][inverse].to(torch::kInt64);
@@ -363,7 +901,7 @@ namespace spconv
         indicePairBlob);*/
       }
       // totalGatherTime += timer.report() / 1000.0;
-      torch::mm_out(outputBufferBlob, inputBufferBlob, filters[i]);
+      groupedMmOut(outputBufferBlob, inputBufferBlob, filters[i], groups);
       // totalGEMMTime += timer.report() / 1000.0;
 
       if (device == torch::kCPU)
@@ -371,7 +909,7 @@ namespace spconv
         functor::SparseScatterAddFunctor<tv::CPU, T, int> scatterFtor;
         scatterFtor(tv::CPU(), tv::torch2tv<T>(output),
                     tv::torch2tv<const T>(outputBuffer),
-                    tv::torch2tv<const int>(indicePairs).subview(i, !inverse), nHot,
+                    getIndicePairsView<int>(indicePairs, indicePairOffsets, pairIdx).subview(!inv), nHot,
                     true);
       }
       else
@@ -379,7 +917,7 @@ namespace spconv
         functor::SparseScatterAddFunctor<tv::GPU, T, int> scatterFtor;
         scatterFtor(tv::TorchGPU(), tv::torch2tv<T>(output),
                     tv::torch2tv<const T>(outputBuffer),
-                    tv::torch2tv<const int>(indicePairs).subview(i, !inverse), nHot,
+                    getIndicePairsView<int>(indicePairs, indicePairOffsets, pairIdx).subview(!inv), nHot,
                     true);
         TV_CHECK_CUDA_ERR();
       }
@@ -388,238 +926,258 @@ namespace spconv
     // std::cout << "gather time " << totalGatherTime << std::endl;
     // std::cout << "gemm time " << totalGEMMTime << std::endl;
     // std::cout << "scatteradd time " << totalSAddTime << std::endl;
+    applyConvActivation(output, act, actAlpha);
     return output;
   }
 
+  // only the gradients whose compute flag is set are computed, the others are
+  // returned as empty tensors.
   template <typename T>
   std::vector<torch::Tensor>
   indiceConvBackward(torch::Tensor features, torch::Tensor filters,
                      torch::Tensor outGrad, torch::Tensor indicePairs, torch::Tensor indiceNum,
-                     int64_t _inverse, int64_t _subM)
+                     int64_t _inverse, int64_t _subM, int64_t _computeInputGrad,
+                     int64_t _computeFilterGrad, int64_t algo, torch::Tensor workspace)
   {
     bool subM = _subM != 0;
     bool inverse = _inverse != 0;
+    bool computeInputGrad = _computeInputGrad != 0;
+    bool computeFilterGrad = _computeFilterGrad != 0;
 
     auto device = features.device().type();
+    TV_ASSERT_INVALID_ARG(algo >= kConvAlgoNative && algo <= kConvAlgoOutputStationary,
+                          "unknown conv algorithm");
+    TV_ASSERT_INVALID_ARG(algo != kConvAlgoFused || device == torch::kCPU,
+                          "fused conv algorithm only supports cpu");
+    TV_ASSERT_INVALID_ARG(algo != kConvAlgoOutputStationary || device == torch::kCPU,
+                          "output stationary conv algorithm only supports cpu");
+    if (algo == kConvAlgoOutputStationary)
+    {
+      algo = kConvAlgoNative;
+    }
+    // gradients of autograd may be expanded, the kernels index raw data.
+    outGrad = outGrad.contiguous();
     auto ndim = filters.dim() - 2;
-    auto kernelVolume = indicePairs.size(0);
+    // indiceNum has fewer offsets than the filters for half subm rulebooks.
+    auto kernelVolume = filters.numel() / (filters.size(ndim) * filters.size(ndim + 1));
+    bool half = indiceNum.size(0) != kernelVolume;
+    TV_ASSERT_INVALID_ARG(!half || (subM && indiceNum.size(0) == getHalfKernelVolume(kernelVolume)),
+                          "indice pairs don't match the kernel size");
     auto numInPlanes = features.size(1);
     auto numOutPlanes = filters.size(ndim + 1);
+    auto groups = getConvGroups(features, filters, algo);
+    bool depthwise = groups == numInPlanes && groups == numOutPlanes;
     auto indicePairNumCpu = indiceNum.to({torch::kCPU});
+    auto indicePairOffsets = getIndicePairOffsets(indicePairNumCpu);
     auto indicePairMaxSizeIter = std::max_element(
-        indicePairNumCpu.data<int>(), indicePairNumCpu.data<int>() + kernelVolume);
+        indicePairNumCpu.data<int>(), indicePairNumCpu.data<int>() + indicePairNumCpu.numel());
     int indicePairMaxOffset = indicePairMaxSizeIter - indicePairNumCpu.data<int>();
     int indicePairMaxSize = *indicePairMaxSizeIter;
     auto options =
         torch::TensorOptions().dtype(features.dtype()).device(features.device());
     auto filterShape = filters.sizes();
-    torch::Tensor inputGrad = torch::zeros(features.sizes(), options);
-    torch::Tensor filtersGrad = torch::zeros(filterShape, options);
-    torch::Tensor inputBuffer = torch::zeros({indicePairMaxSize, numInPlanes}, options);
-    torch::Tensor outputBuffer =
-        torch::zeros({indicePairMaxSize, numOutPlanes}, options);
-
-    filters = filters.view({-1, numInPlanes, numOutPlanes});
-    filtersGrad = filtersGrad.view({-1, numInPlanes, numOutPlanes});
+    torch::Tensor inputGrad = torch::empty({0}, options);
+    torch::Tensor filtersGrad = torch::empty({0}, options);
+    if (computeInputGrad)
+    {
+      // the center offset of subm conv overwrites every input gradient row.
+      inputGrad = subM ? torch::empty(features.sizes(), options)
+                       : torch::zeros(features.sizes(), options);
+    }
+    if (computeFilterGrad)
+    {
+      // offsets without pairs are skipped, their filter gradient must be zero.
+      filtersGrad = torch::zeros(filterShape, options).view({-1, numInPlanes / groups, numOutPlanes});
+    }
+    if (!computeInputGrad && !computeFilterGrad)
+    {
+      return {inputGrad, filtersGrad};
+    }
+    int bufferSize = algo == kConvAlgoNative ? indicePairMaxSize : 0;
+    auto buffers = getWorkspaceBuffers(workspace, options, bufferSize,
+                                       {numInPlanes, numOutPlanes});
+    torch::Tensor inputBuffer = buffers[0];
+    torch::Tensor outputBuffer = buffers[1];
+
+    filters = filters.view({-1, numInPlanes / groups, numOutPlanes});
+    auto result = [&]() -> std::vector<torch::Tensor> {
+      return {inputGrad, computeFilterGrad ? filtersGrad.view(filterShape) : filtersGrad};
+    };
     if (subM)
     {
-      auto filterGradSub = filtersGrad[indicePairMaxOffset];
-      torch::mm_out(filterGradSub, features.t(), outGrad);
-      torch::mm_out(inputGrad, outGrad, filters[indicePairMaxOffset].t());
+      if (computeFilterGrad)
+      {
+        groupedFilterGradOut(filtersGrad[indicePairMaxOffset], features, outGrad, groups);
+      }
+      if (computeInputGrad)
+      {
+        groupedInputGradOut(inputGrad, outGrad, filters[indicePairMaxOffset], groups);
+      }
+    }
+    if (half && algo == kConvAlgoBatch)
+    {
+      // the batched gemm indexes every kernel offset of the rulebook.
+      auto expanded = expandHalfIndicePairs(indicePairs, indicePairNumCpu, kernelVolume);
+      indicePairs = expanded[0];
+      indicePairNumCpu = expanded[1];
+      indicePairOffsets = getIndicePairOffsets(indicePairNumCpu);
+      half = false;
+    }
+    if (algo == kConvAlgoBatch)
+    {
+      indiceConvBackwardBatch<T>(inputGrad, filtersGrad, features, filters, outGrad,
+                                 indicePairs, indicePairNumCpu, indicePairOffsets,
+                                 inverse, subM, indicePairMaxOffset,
+                                 computeInputGrad, computeFilterGrad);
+      return result();
     }
     for (int i = 0; i < kernelVolume; ++i)
     {
-      auto nHot = indicePairNumCpu.data<int>()[i];
+      // offset i of a half subm rulebook is stored as the mirrored offset
+      // with inputs and outputs swapped.
+      int pairIdx = i;
+      bool inv = inverse;
+      if (half && i >= indicePairNumCpu.size(0))
+      {
+        pairIdx = kernelVolume - 1 - i;
+        inv = !inverse;
+      }
+      auto nHot = indicePairNumCpu.data<int>()[pairIdx];
       if (nHot <= 0 || (subM && i == indicePairMaxOffset))
       {
         continue;
       }
-      if (device == torch::kCPU)
+      auto pairs = getIndicePairsView<int>(indicePairs, indicePairOffsets, pairIdx);
+      if (depthwise && device == torch::kCPU)
       {
-        functor::SparseGatherFunctor<tv::CPU, T, int> gatherFtor;
-        functor::SparseGatherFunctor<tv::CPU, T, int> gatherFtorOut;
-        gatherFtor(tv::CPU(), tv::torch2tv<T>(inputBuffer),
-                   tv::torch2tv<const T>(features),
-                   tv::torch2tv<const int>(indicePairs).subview(i, inverse), nHot);
-        gatherFtorOut(tv::CPU(), tv::torch2tv<T>(outputBuffer),
-                      tv::torch2tv<const T>(outGrad),
-                      tv::torch2tv<const int>(indicePairs).subview(i, !inverse), nHot);
+        if (computeFilterGrad)
+        {
+          functor::SparseDepthwiseFilterGradFunctor<tv::CPU, T, int> filterGradFtor;
+          filterGradFtor(tv::CPU(), tv::torch2tv<T>(filtersGrad[i]),
+                         tv::torch2tv<const T>(features), tv::torch2tv<const T>(outGrad),
+                         pairs.subview(inv), pairs.subview(!inv), nHot);
+        }
+        if (computeInputGrad)
+        {
+          functor::SparseDepthwiseConvFunctor<tv::CPU, T, int> depthwiseFtor;
+          depthwiseFtor(tv::CPU(), tv::torch2tv<T>(inputGrad), tv::torch2tv<const T>(outGrad),
+                        tv::torch2tv<const T>(filters[i]), pairs.subview(!inv),
+                        pairs.subview(inv), nHot);
+        }
+        continue;
       }
-      else
+      if (algo == kConvAlgoFused)
       {
-        functor::SparseGatherFunctor<tv::GPU, T, int> gatherFtor;
-        functor::SparseGatherFunctor<tv::GPU, T, int> gatherFtorOut;
-        gatherFtor(tv::TorchGPU(), tv::torch2tv<T>(inputBuffer),
-                   tv::torch2tv<const T>(features),
-                   tv::torch2tv<const int>(indicePairs).subview(i, inverse), nHot);
-        TV_CHECK_CUDA_ERR();
-        gatherFtorOut(tv::TorchGPU(), tv::torch2tv<T>(outputBuffer),
-                      tv::torch2tv<const T>(outGrad),
-                      tv::torch2tv<const int>(indicePairs).subview(i, !inverse), nHot);
-        TV_CHECK_CUDA_ERR();
+        if (computeFilterGrad)
+        {
+          functor::SparseConvFilterGradFusedFunctor<tv::CPU, T, int> filterGradFtor;
+          filterGradFtor(tv::CPU(), tv::torch2tv<T>(filtersGrad[i]),
+                         tv::torch2tv<const T>(features), tv::torch2tv<const T>(outGrad),
+                         pairs.subview(inv), pairs.subview(!inv), nHot);
+        }
+        if (computeInputGrad)
+        {
+          functor::SparseConvFusedFunctor<tv::CPU, T, int> fusedFtor;
+          fusedFtor(tv::CPU(), tv::torch2tv<T>(inputGrad), tv::torch2tv<const T>(outGrad),
+                    tv::torch2tv<const T>(filters[i].t().contiguous()),
+                    pairs.subview(!inv), pairs.subview(inv), nHot);
+        }
+        continue;
       }
-      auto filterGradSub = filtersGrad[i];
       auto outputBufferBlob =
           torch::from_blob(outputBuffer.data<T>(), {nHot, numOutPlanes}, options);
       auto inputBufferBlob =
           torch::from_blob(inputBuffer.data<T>(), {nHot, numInPlanes}, options);
-
-      torch::mm_out(filterGradSub, inputBufferBlob.t(), outputBufferBlob);
-      torch::mm_out(inputBufferBlob, outputBufferBlob, filters[i].t());
-      if (device == torch::kCPU)
+      gatherRows<T>(outputBuffer, outGrad, pairs.subview(!inv), nHot);
+      if (computeFilterGrad)
       {
-        functor::SparseScatterAddFunctor<tv::CPU, T, int> scatterFtor;
-        scatterFtor(tv::CPU(), tv::torch2tv<T>(inputGrad),
-                    tv::torch2tv<const T>(inputBuffer),
-                    tv::torch2tv<const int>(indicePairs).subview(i, inverse), nHot);
+        gatherRows<T>(inputBuffer, features, pairs.subview(inv), nHot);
+        groupedFilterGradOut(filtersGrad[i], inputBufferBlob, outputBufferBlob, groups);
       }
-      else
+      if (computeInputGrad)
       {
-        functor::SparseScatterAddFunctor<tv::GPU, T, int> scatterFtor;
-        scatterFtor(tv::TorchGPU(), tv::torch2tv<T>(inputGrad),
-                    tv::torch2tv<const T>(inputBuffer),
-                    tv::torch2tv<const int>(indicePairs).subview(i, inverse), nHot);
-        TV_CHECK_CUDA_ERR();
+        groupedInputGradOut(inputBufferBlob, outputBufferBlob, filters[i], groups);
+        scatterAddRows<T>(inputGrad, inputBuffer, pairs.subview(inv), nHot);
       }
     }
-    return {inputGrad, filtersGrad.view(filterShape)};
+    return result();
   }
 
-  template <typename T>
-  torch::Tensor indiceConvDevelopDontUse(torch::Tensor features, torch::Tensor filters,
-                                         torch::Tensor indicePairs, torch::Tensor indiceNum,
-                                         int64_t numActOut, int64_t _inverse, int64_t _subM)
+  // cpu only inference conv of torch.quint8 features (per tensor affine) and
+  // int8 filters (symmetric). products are accumulated in int32 and
+  // requantized once per output to a torch.quint8 tensor of outputScale and
+  // outputZeroPoint:
+  // out = clamp(round(act(acc * multiplier + bias)) + outputZeroPoint, 0, 255)
+  // where multiplier (per output channel) and bias are already divided by
+  // outputScale. tiledPairs is the tiled rulebook (see tileIndicePairs), built
+  // here if empty.
+  inline torch::Tensor indiceConvInt8(torch::Tensor features, torch::Tensor filters,
+                                      torch::Tensor indicePairs, torch::Tensor indiceNum,
+                                      int64_t numActOut, int64_t _inverse, int64_t _subM,
+                                      torch::Tensor multiplier, torch::Tensor bias,
+                                      double outputScale, int64_t outputZeroPoint,
+                                      int64_t act, double actAlpha, torch::Tensor tiledPairs)
   {
     bool subM = _subM != 0;
     bool inverse = _inverse != 0;
-
-    auto device = features.device().type();
+    TV_ASSERT_INVALID_ARG(features.device().type() == torch::kCPU,
+                          "int8 conv only supports cpu");
+    TV_ASSERT_INVALID_ARG(features.scalar_type() == torch::kQUInt8 &&
+                              features.qscheme() == torch::kPerTensorAffine,
+                          "features must be per tensor quantized quint8");
+    TV_ASSERT_INVALID_ARG(act >= kConvActIdentity && act <= kConvActLeakyReLU,
+                          "unknown conv activation");
     auto ndim = filters.dim() - 2;
-    auto kernelVolume = indicePairs.size(0);
+    auto kernelVolume = filters.numel() / (filters.size(ndim) * filters.size(ndim + 1));
+    bool half = indiceNum.size(0) != kernelVolume;
+    TV_ASSERT_INVALID_ARG(!half || (subM && indiceNum.size(0) == getHalfKernelVolume(kernelVolume)),
+                          "indice pairs don't match the kernel size");
     auto numInPlanes = features.size(1);
     auto numOutPlanes = filters.size(ndim + 1);
-    auto indicePairNumCpu = indiceNum.to({torch::kCPU});
-    auto totalActsTen = indicePairNumCpu.sum();
-    auto totalActs = indicePairNumCpu.data<int>()[0];
-    auto indicePairMaxSizeIter = std::max_element(
-        indicePairNumCpu.data<int>(), indicePairNumCpu.data<int>() + kernelVolume);
-    int indicePairMaxOffset = indicePairMaxSizeIter - indicePairNumCpu.data<int>();
-    int indicePairMaxSize = *indicePairMaxSizeIter;
-    std::vector<int> indicePairNumVec(indicePairNumCpu.data<int>(),
-                                      indicePairNumCpu.data<int>() + kernelVolume);
-    indicePairNumVec.erase(indicePairNumVec.begin() + indicePairMaxOffset);
-    int subRuleMaxSize = *std::max_element(indicePairNumVec.begin(), indicePairNumVec.end());
-    if (subM)
+    TV_ASSERT_INVALID_ARG(filters.size(ndim) == numInPlanes,
+                          "int8 conv doesn't support groups");
+    TV_ASSERT_INVALID_ARG(multiplier.numel() == numOutPlanes,
+                          "multiplier must have out channels elements");
+    TV_ASSERT_INVALID_ARG(bias.numel() == 0 || bias.numel() == numOutPlanes,
+                          "bias must have out channels elements");
+    features = features.contiguous();
+    // the uint8 values of the quantized tensor, without the copy of int_repr.
+    tv::TensorView<const uint8_t> featuresView(
+        reinterpret_cast<const uint8_t *>(features.data_ptr<c10::quint8>()),
+        features.size(0), numInPlanes);
+    filters = filters.contiguous().view({-1, numInPlanes, numOutPlanes});
+    auto indicePairNumCpu = indiceNum.to({torch::kCPU}).contiguous();
+    float negativeSlope = 1.0f;
+    if (act == kConvActReLU)
     {
-      indicePairMaxSize = subRuleMaxSize;
+      negativeSlope = 0.0f;
     }
-    auto timer = spconv::CudaContextTimer<>();
-    auto options =
-        torch::TensorOptions().dtype(features.dtype()).device(features.device());
-    // auto indicePairOptions =
-    //     torch::TensorOptions().dtype(torch::kInt64).device(indicePairs.device());
-
-    torch::Tensor output = torch::zeros({numActOut, numOutPlanes}, options);
-    torch::Tensor inputBuffer =
-        torch::zeros({kernelVolume, indicePairMaxSize, numInPlanes}, options);
-    torch::Tensor outputBuffer =
-        torch::zeros({kernelVolume, indicePairMaxSize, numOutPlanes}, options);
-    filters = filters.view({-1, numInPlanes, numOutPlanes});
-    std::cout << "create time " << timer.report() / 1000.0 << std::endl;
-    if (subM)
-    { // the center index of subm conv don't need gather and scatter
-      // add.
-      torch::mm_out(output, features, filters[indicePairMaxOffset]);
-    }
-    double totalGatherTime = 0;
-    double totalGEMMTime = 0;
-    double totalSAddTime = 0;
-    // auto timer = spconv::CudaContextTimer<>();
-    for (int i = 0; i < kernelVolume; ++i)
+    else if (act == kConvActLeakyReLU)
     {
-      auto nHot = indicePairNumCpu.data<int>()[i];
-      if (nHot <= 0 || (subM && i == indicePairMaxOffset))
-      {
-        continue;
-      }
-      //
-      auto outputBufferBlob = torch::from_blob(outputBuffer[i].data<T>(),
-                                               {nHot, numOutPlanes}, options);
-      auto inputBufferBlob = torch::from_blob(inputBuffer[i].data<T>(),
-                                              {nHot, numInPlanes}, options);
-      if (device == torch::kCPU)
-      {
-        functor::SparseGatherFunctor<tv::CPU, T, int> gatherFtor;
-        gatherFtor(tv::CPU(), tv::torch2tv<T>(inputBufferBlob),
-                   tv::torch2tv<const T>(features),
-                   tv::torch2tv<const int>(indicePairs).subview(i, inverse), nHot);
-      }
-      else
-      {
-        functor::SparseGatherFunctor<tv::GPU, T, int> gatherFtor;
-        gatherFtor(tv::TorchGPU(), tv::torch2tv<T>(inputBufferBlob),
-                   tv::torch2tv<const T>(features),
-                   tv::torch2tv<const int>(indicePairs).subview(i, inverse), nHot);
-        TV_CHECK_CUDA_ERR();
-      }
-      // }
-      // for (int i = 0; i < kernelVolume; ++i) {
-      // totalGatherTime += timer.report() / 1000.0;
-      // auto outputBufferBlob = torch::from_blob(outputBuffer[i].data<T>(),
-      // {nHot, numOutPlanes}, options);
+      negativeSlope = actAlpha;
     }
-    // totalGatherTime += timer.report() / 1000.0;
-    for (int i = 0; i < kernelVolume; ++i)
+    multiplier = multiplier.to(torch::kFloat32).contiguous();
+    if (bias.numel() > 0)
     {
-      auto nHot = indicePairNumCpu.data<int>()[i];
-      if (nHot <= 0 || (subM && i == indicePairMaxOffset))
-      {
-        continue;
-      }
-      auto outputBufferBlob = torch::from_blob(outputBuffer[i].data<T>(),
-                                               {nHot, numOutPlanes}, options);
-      auto inputBufferBlob = torch::from_blob(inputBuffer[i].data<T>(),
-                                              {nHot, numInPlanes}, options);
-
-      torch::mm_out(outputBufferBlob, inputBufferBlob, filters[i]);
+      bias = bias.to(torch::kFloat32).contiguous();
     }
-    // totalGEMMTime += timer.report() / 1000.0;
-    // totalGEMMTime += timer.report() / 1000.0;
-    for (int i = 0; i < kernelVolume; ++i)
+    auto output = at::_empty_affine_quantized({numActOut, numOutPlanes},
+                                              torch::TensorOptions().dtype(torch::kQUInt8),
+                                              outputScale, outputZeroPoint);
+    tv::TensorView<uint8_t> outputView(
+        reinterpret_cast<uint8_t *>(output.data_ptr<c10::quint8>()), numActOut, numOutPlanes);
+    if (tiledPairs.numel() == 0)
     {
-      auto nHot = indicePairNumCpu.data<int>()[i];
-      if (nHot <= 0 || (subM && i == indicePairMaxOffset))
-      {
-        continue;
-      }
-      auto outputBufferBlob = torch::from_blob(outputBuffer[i].data<T>(),
-                                               {nHot, numOutPlanes}, options);
-      auto inputBufferBlob = torch::from_blob(inputBuffer[i].data<T>(),
-                                              {nHot, numInPlanes}, options);
-
-      if (device == torch::kCPU)
-      {
-        functor::SparseScatterAddFunctor<tv::CPU, T, int> scatterFtor;
-        scatterFtor(tv::CPU(), tv::torch2tv<T>(output),
-                    tv::torch2tv<const T>(outputBufferBlob),
-                    tv::torch2tv<const int>(indicePairs).subview(i, !inverse), nHot,
-                    true);
-      }
-      else
-      {
-        functor::SparseScatterAddFunctor<tv::GPU, T, int> scatterFtor;
-        scatterFtor(tv::TorchGPU(), tv::torch2tv<T>(output),
-                    tv::torch2tv<const T>(outputBufferBlob),
-                    tv::torch2tv<const int>(indicePairs).subview(i, !inverse), nHot,
-                    true);
-        TV_CHECK_CUDA_ERR();
-      }
-      // totalSAddTime += timer.report() / 1000.0;
+      tiledPairs = tileIndicePairs(indicePairs, indicePairNumCpu, numActOut, kernelVolume,
+                                   inverse);
     }
-    // totalSAddTime += timer.report() / 1000.0;
-    // std::cout << "gather time " << totalGatherTime << std::endl;
-    // std::cout << "gemm time " << totalGEMMTime << std::endl;
-    // std::cout << "scatteradd time " << totalSAddTime << std::endl;
+    auto tiled = getTiledIndicePairsViews(tiledPairs, numActOut, kernelVolume);
+    functor::SparseConvInt8Functor<tv::CPU, int> ftor;
+    ftor(tv::CPU(), outputView, featuresView, tv::torch2tv<const int8_t>(filters),
+         features.q_zero_point(), tiled[0], tiled[1], tiled[2],
+         tv::torch2tv<const float>(multiplier),
+         bias.numel() > 0 ? tv::torch2tv<const float>(bias) : tv::TensorView<const float>(),
+         outputZeroPoint, negativeSlope);
     return output;
   }
 
@@ -48,6 +48,21 @@ template <typename T> void check_torch_dtype(const torch::Tensor &tensor) {
     TV_ASSERT_RT_ERR(val, "error");
     break;
   }
+  case at::ScalarType::BFloat16: {
+    auto val = std::is_same<std::remove_const_t<T>, at::BFloat16>::value;
+    TV_ASSERT_RT_ERR(val, "error");
+    break;
+  }
+  case at::ScalarType::Byte: {
+    auto val = std::is_same<std::remove_const_t<T>, uint8_t>::value;
+    TV_ASSERT_RT_ERR(val, "error");
+    break;
+  }
+  case at::ScalarType::Char: {
+    auto val = std::is_same<std::remove_const_t<T>, int8_t>::value;
+    TV_ASSERT_RT_ERR(val, "error");
+    break;
+  }
 
   default:
     TV_ASSERT_RT_ERR(false, "error");
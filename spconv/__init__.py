@@ -13,15 +13,27 @@
 # limitations under the License.
 
 from pathlib import Path
+import itertools
+import os
 import sys
 import numpy as np
 import torch
 #from spconv import utils
+from spconv.cache import IndicePairCache, get_indice_pair_cache, set_indice_pair_cache
+from spconv.incremental import get_indice_key_geometries, update_indice_dict
+from spconv.ordering import get_permutation, invert_permutation
+from spconv.workspace import Workspace, get_workspace, set_workspace
+from spconv.autotune import ConvAutotuner, get_autotuner, set_autotuner
 from spconv.conv import SparseConv2d, SparseConv3d, SubMConv2d, SubMConv3d
 from spconv.conv import SparseConvTranspose2d, SparseConvTranspose3d
 from spconv.conv import SparseInverseConv2d, SparseInverseConv3d
+from spconv.ops import ConvActivation, ConvAlgo
 from spconv.modules import SparseModule, SparseSequential
+from spconv.fusion import fuse_conv_bn, fuse_modules
 from spconv.pool import SparseMaxPool2d, SparseMaxPool3d
+from spconv.planner import IndicePairPlanner
+from spconv.quantization import QuantizedSparseConvolution, convert_quantization, prepare_quantization
+from spconv.precompute import get_layer_geometries, indice_dict_to, precompute_indice_dict
 
 if sys.platform == "linux" or sys.platform == "linux2":
     _LIB_PATH = str(Path(__file__).parent / "lib" / "libspconv.so")
@@ -45,12 +57,32 @@ def scatter_nd(indices, updates, shape):
     ret[slices] = updates.view(*output_shape)
     return ret
 
+_COORD_ID_COUNTER = itertools.count()
+
+def new_coord_id():
+    """return a new coordinate set id which is unique in this process.
+    """
+    return (os.getpid(), next(_COORD_ID_COUNTER))
+
 class SparseConvTensor(object):
-    def __init__(self, features, indices, spatial_shape, batch_size, grid=None):
+    def __init__(self, features, indices, spatial_shape, batch_size, grid=None,
+                 coord_id=None, indice_dict=None, order=None):
         """
         Args:
             grid: pre-allocated grid tensor. should be used when the volume of spatial shape
                 is very large.
+            coord_id: hashable id of the coordinate set (indices). tensors with equal
+                coord_id must have identical indices. layers without indice_key use it
+                to reuse indice pairs automatically. a new id is generated if not provided.
+            indice_dict: indice pairs of these indices generated before, e.g. by
+                spconv.incremental.update_indice_dict.
+            order: None or "morton". if "morton", features and indices are sorted
+                along a morton curve (per batch) for cache friendly gather and
+                scatter, and outputs of non-submanifold layers keep this order.
+                the original order of features is restored by
+                features[inverse_permutation]. an indice_dict must be generated
+                for the sorted indices, e.g. by precompute_indice_dict with the
+                same order.
         """
         self.features = features
         self.indices = indices 
@@ -58,8 +90,38 @@ class SparseConvTensor(object):
             self.indices.int()
         self.spatial_shape = spatial_shape
         self.batch_size = batch_size
-        self.indice_dict = {}
+        if indice_dict is None:
+            indice_dict = {}
+        self.indice_dict = indice_dict
         self.grid = grid
+        if coord_id is None:
+            coord_id = new_coord_id()
+        self.coord_id = coord_id
+        self.order = order
+        self.permutation = get_permutation(indices, spatial_shape, order)
+        if self.permutation is not None:
+            self.features = self.features[self.permutation]
+            self.indices = self.indices[self.permutation].contiguous()
+            self._check_indice_dict()
+
+    def _check_indice_dict(self):
+        # pairs of an indice_dict index the rows of the indices it was
+        # generated for, which must be the permuted ones.
+        checked = set()
+        for datas in self.indice_dict.values():
+            indices, coord_id = datas[1], datas[5]
+            if coord_id != self.coord_id or id(indices) in checked:
+                continue
+            checked.add(id(indices))
+            assert indices.shape == self.indices.shape and torch.equal(
+                indices.to(self.indices.device), self.indices), \
+                "indice_dict wasn't generated for the {} ordered indices".format(self.order)
+
+    @property
+    def inverse_permutation(self):
+        if self.permutation is None:
+            return None
+        return invert_permutation(self.permutation)
 
     @property
     def spatial_size(self):
@@ -0,0 +1,176 @@
+# Copyright 2019 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import math
+import time
+
+import numpy as np
+import torch
+from spconv import ops
+
+_ALGO_NAMES = {
+    ops.ConvAlgo.Native: "Native",
+    ops.ConvAlgo.Fused: "Fused",
+    ops.ConvAlgo.Batch: "Batch",
+    ops.ConvAlgo.OutputStationary: "OutputStationary",
+    ops.ConvAlgo.Dense: "Dense",
+}
+
+
+class ConvAutotuner(object):
+    """choose the fastest ConvAlgo for every SparseConvolution with
+    algo=ConvAlgo.Auto.
+
+    the first num_trials calls with a new key run every candidate algorithm
+    on the actual inputs (forward, plus backward when gradients are needed)
+    and the algorithm with the smallest median time is kept for the key. keys
+    are the layer shape and buckets of the rulebook size, density (mean
+    pairs per output) and occupancy of the input, so inputs with a similar
+    sparsity share the decision. layers which support it also try
+    ConvAlgo.Dense, which wins for highly occupied inputs.
+    decisions can be saved and loaded to skip tuning in deployment::
+
+        spconv.get_autotuner().save("algos.json")
+        ...
+        spconv.get_autotuner().load("algos.json")
+    """
+
+    def __init__(self, num_trials=3):
+        self.num_trials = num_trials
+        self.decisions = {}
+        self._timings = {}
+
+    def __len__(self):
+        return len(self.decisions)
+
+    def clear(self):
+        self.decisions.clear()
+        self._timings.clear()
+
+    @staticmethod
+    def make_key(conv, features, indice_pair_num, num_act_out, backward, occupancy=1.0):
+        num_pairs = max(int(indice_pair_num.sum()), 1)
+        size_bucket = int(round(math.log2(num_pairs)))
+        density_bucket = int(round(math.log2(max(num_pairs / max(num_act_out, 1), 1))))
+        occupancy_bucket = int(round(math.log2(max(occupancy, 1e-6))))
+        return (features.device.type, str(features.dtype).split(".")[-1], conv.in_channels,
+                conv.out_channels, tuple(conv.kernel_size), conv.groups, conv.subm,
+                conv.inverse, bool(backward), size_bucket, density_bucket,
+                occupancy_bucket)
+
+    @staticmethod
+    def candidates(conv, device, dense=False):
+        if conv.groups != 1:
+            algos = [ops.ConvAlgo.Native]
+        else:
+            algos = [ops.ConvAlgo.Native, ops.ConvAlgo.Batch]
+            if device.type == "cpu":
+                algos += [ops.ConvAlgo.Fused, ops.ConvAlgo.OutputStationary]
+        if dense:
+            algos.append(ops.ConvAlgo.Dense)
+        return algos
+
+    def select(self, conv, features, indice_pairs, indice_pair_num, num_act_out,
+               dense_conv=None, occupancy=1.0):
+        """the algorithm for this call of conv.
+
+        Args:
+            dense_conv: function (features, weight) -> output features of
+                ConvAlgo.Dense, None if the layer doesn't support it.
+            occupancy: occupancy of the input, see SparseConvTensor.sparity.
+        """
+        backward = torch.is_grad_enabled() and (features.requires_grad
+                                                or conv.weight.requires_grad)
+        key = self.make_key(conv, features, indice_pair_num, num_act_out, backward,
+                            occupancy)
+        algo = self.decisions.get(key)
+        if algo is not None:
+            return algo
+        timings = self._timings.setdefault(key, {})
+        with torch.no_grad():
+            for algo in self.candidates(conv, features.device, dense_conv is not None):
+                timings.setdefault(algo, []).append(
+                    self._benchmark(conv, algo, features, indice_pairs,
+                                    indice_pair_num, num_act_out, backward,
+                                    dense_conv))
+        best = min(timings, key=lambda a: np.median(timings[a]))
+        if len(timings[best]) >= self.num_trials:
+            self.decisions[key] = best
+            del self._timings[key]
+        return best
+
+    @staticmethod
+    def _benchmark(conv, algo, features, indice_pairs, indice_pair_num, num_act_out,
+                   backward, dense_conv=None):
+        inverse = conv.inverse and not conv.subm
+        weight = conv.weight.detach().to(features.dtype)
+        features = features.detach()
+        if features.is_cuda:
+            torch.cuda.synchronize(features.device)
+        t = time.time()
+        if algo == ops.ConvAlgo.Dense:
+            with torch.enable_grad():
+                features.requires_grad_(backward)
+                weight.requires_grad_(backward)
+                out = dense_conv(features, weight)
+                if backward:
+                    torch.autograd.grad(out, [features, weight], out)
+        else:
+            out = ops.indice_conv(features, weight, indice_pairs, indice_pair_num,
+                                  num_act_out, inverse, conv.subm, algo)
+            if backward:
+                ops.indice_conv_backward(features, weight, out, indice_pairs,
+                                         indice_pair_num, inverse, conv.subm, algo)
+        if features.is_cuda:
+            torch.cuda.synchronize(features.device)
+        return time.time() - t
+
+    def state_dict(self):
+        return {
+            "version": 2,
+            "decisions": [{"key": list(key), "algo": _ALGO_NAMES[algo]}
+                          for key, algo in self.decisions.items()],
+        }
+
+    def load_state_dict(self, state):
+        assert state["version"] == 2
+        for item in state["decisions"]:
+            key = tuple(tuple(v) if isinstance(v, list) else v for v in item["key"])
+            self.decisions[key] = getattr(ops.ConvAlgo, item["algo"])
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.state_dict(), f, indent=2)
+
+    def load(self, path):
+        with open(path, "r") as f:
+            self.load_state_dict(json.load(f))
+
+
+_autotuner = ConvAutotuner()
+
+
+def get_autotuner():
+    return _autotuner
+
+
+def set_autotuner(autotuner):
+    """set the global autotuner used by layers with algo=ConvAlgo.Auto.
+    returns the previous autotuner.
+    """
+    global _autotuner
+    prev = _autotuner
+    _autotuner = autotuner
+    return prev
@@ -0,0 +1,97 @@
+# Copyright 2019 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+_indice_pair_cache = None
+
+
+def get_indice_pair_cache():
+    return _indice_pair_cache
+
+
+def set_indice_pair_cache(cache):
+    """set the global cache consulted by ops.get_indice_pairs. use None to
+    disable caching. returns the previous cache.
+    """
+    global _indice_pair_cache
+    prev = _indice_pair_cache
+    _indice_pair_cache = cache
+    return prev
+
+
+def _tensors_nbytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class IndicePairCache(object):
+    """LRU cache of ops.get_indice_pairs results, bounded by the total size
+    of the cached tensors.
+
+    entries are keyed by a digest of the indices plus the layer geometry, so
+    inputs with identical coordinates (e.g. the same frame evaluated several
+    times) skip rulebook construction. cached tensors are returned as is and
+    must not be modified in place.
+    """
+
+    def __init__(self, max_bytes=2 ** 30):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(indices, *geometry):
+        """indices are copied to host for hashing. geometry must be hashable.
+        """
+        data = np.ascontiguousarray(indices.detach().cpu().numpy())
+        digest = hashlib.blake2b(data.tobytes(), digest_size=16).digest()
+        return (digest, tuple(indices.shape), str(indices.dtype),
+                str(indices.device)) + tuple(geometry)
+
+    def get(self, key):
+        res = self._entries.get(key)
+        if res is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return res
+
+    def put(self, key, value):
+        nbytes = _tensors_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self.nbytes -= _tensors_nbytes(self._entries.pop(key))
+        while self.nbytes + nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= _tensors_nbytes(evicted)
+        self._entries[key] = value
+        self.nbytes += nbytes
@@ -19,7 +19,7 @@ import numpy as np
 import spconv
 import spconv.functional as Fsp
 import torch
-from spconv import ops
+from spconv import autotune, ops
 from spconv.modules import SparseModule
 from torch import nn
 from torch.nn import init
@@ -63,9 +63,13 @@ class SparseConvolution(SparseModule):
                  output_padding=0,
                  transposed=False,
                  inverse=False,
-                 indice_key=None):
+                 indice_key=None,
+                 algo=ops.ConvAlgo.Native,
+                 half_rulebook=False,
+                 dense_threshold=None):
         super(SparseConvolution, self).__init__()
-        assert groups == 1
+        assert in_channels % groups == 0, "in_channels must be divisible by groups"
+        assert out_channels % groups == 0, "out_channels must be divisible by groups"
         if not isinstance(kernel_size, (list, tuple)):
             kernel_size = [kernel_size] * ndim
         if not isinstance(stride, (list, tuple)):
@@ -79,6 +83,9 @@ class SparseConvolution(SparseModule):
 
         for d, s in zip(dilation, stride):
             assert any([s == 1, d == 1]), "don't support this."
+        if half_rulebook:
+            assert subm and all(k % 2 == 1 for k in kernel_size), \
+                "half rulebook needs subm conv with odd kernel size"
 
         self.ndim = ndim
         self.in_channels = in_channels
@@ -94,15 +101,108 @@ class SparseConvolution(SparseModule):
         self.groups = groups
         self.subm = subm
         self.indice_key = indice_key
+        self.algo = algo
+        # only store the first half of the kernel offsets, see
+        # ops.get_indice_pairs.
+        self.half_rulebook = half_rulebook
+        # run the dense torch conv when the occupancy (SparseConvTensor.sparity)
+        # of the input is at least dense_threshold. None to disable.
+        self.dense_threshold = dense_threshold
+        # activation applied after the bias, see spconv.fusion.fuse_modules.
+        self.act = ops.ConvActivation.Identity
+        self.act_alpha = 0.0
 
         self.weight = Parameter(
-            torch.Tensor(*kernel_size, in_channels, out_channels))
+            torch.Tensor(*kernel_size, in_channels // groups, out_channels))
         if bias:
             self.bias = Parameter(torch.Tensor(out_channels))
         else:
             self.register_parameter('bias', None)
         self.reset_parameters()
 
+    def geometry_key(self):
+        """hashable description of everything except the input coordinates
+        that the indice pairs of this layer depend on.
+        """
+        return (tuple(self.kernel_size), tuple(self.stride), tuple(self.padding),
+                tuple(self.dilation), tuple(self.output_padding), self.subm,
+                self.transposed, self.half_rulebook)
+
+    def apply_activation(self, features):
+        if self.act == ops.ConvActivation.ReLU:
+            return torch.relu(features)
+        if self.act == ops.ConvActivation.LeakyReLU:
+            return nn.functional.leaky_relu(features, self.act_alpha)
+        return features
+
+    def fuse_bias_activation(self, features):
+        """whether bias and activation can be applied inside indice_conv, which
+        doesn't compute their gradients.
+        """
+        if not torch.is_grad_enabled():
+            return True
+        tensors = [features, self.weight]
+        if self.bias is not None:
+            tensors.append(self.bias)
+        return not any(t.requires_grad for t in tensors)
+
+    def supports_dense(self):
+        """whether ConvAlgo.Dense gives the same results as the sparse
+        algorithms.
+        """
+        if self.inverse:
+            return False
+        if self.subm:
+            # the center of subm kernels is k // 2.
+            return all(k % 2 == 1 for k in self.kernel_size)
+        if self.transposed:
+            # torch uses another output size for dilated transposed convs.
+            return all(d == 1 for d in self.dilation)
+        return True
+
+    def use_dense(self, input):
+        if self.algo == ops.ConvAlgo.Dense:
+            assert self.supports_dense(), "this layer doesn't support ConvAlgo.Dense"
+            return True
+        return (self.dense_threshold is not None and self.supports_dense()
+                and input.sparity >= self.dense_threshold)
+
+    def dense_conv(self, features, weight, input, outids):
+        """convolution of features (at input.indices) computed by the dense
+        torch conv and gathered at outids, without bias and activation.
+        """
+        ndim = self.ndim
+        g = self.groups
+        x = spconv.scatter_nd(input.indices.long(), features,
+                              [input.batch_size] + list(input.spatial_shape) +
+                              [features.shape[1]])
+        x = x.permute(0, ndim + 1, *range(1, ndim + 1))
+        kernel_dims = list(range(ndim))
+        if self.transposed:
+            # [*k, in // g, out] -> [in, out // g, *k]
+            w = weight.view(*self.kernel_size, self.in_channels // g, g,
+                            self.out_channels // g)
+            w = w.permute(ndim + 1, ndim, ndim + 2, *kernel_dims).reshape(
+                self.in_channels, self.out_channels // g, *self.kernel_size)
+            conv_func = getattr(nn.functional, "conv_transpose{}d".format(ndim))
+            out = conv_func(x, w, stride=self.stride, padding=self.padding,
+                            output_padding=self.output_padding, groups=g,
+                            dilation=self.dilation)
+        else:
+            # [*k, in // g, out] -> [out, in // g, *k]
+            w = weight.permute(ndim + 1, ndim, *kernel_dims)
+            if self.subm:
+                stride = 1
+                padding = [k // 2 * d for k, d in zip(self.kernel_size, self.dilation)]
+            else:
+                stride = self.stride
+                padding = self.padding
+            conv_func = getattr(nn.functional, "conv{}d".format(ndim))
+            out = conv_func(x, w, stride=stride, padding=padding,
+                            dilation=self.dilation, groups=g)
+        out = out.permute(0, *range(2, ndim + 2), 1)
+        return out[tuple(outids.long().t())]
+
     def reset_parameters(self):
         n = self.in_channels
         init.kaiming_uniform_(self.weight, a=math.sqrt(5))
@@ -111,13 +211,15 @@ class SparseConvolution(SparseModule):
             bound = 1 / math.sqrt(fan_in)
             init.uniform_(self.bias, -bound, bound)
 
-    def forward(self, input):
-        assert isinstance(input, spconv.SparseConvTensor)
-        features = input.features
-        device = features.device
+    def get_indice_pairs(self, input):
+        """indice pairs of this layer for input, taken from input.indice_dict or
+        generated and stored there.
+
+        Returns:
+            outids, indice_pairs, indice_pair_num, out_spatial_shape, out_coord_id
+        """
         indices = input.indices
         spatial_shape = input.spatial_shape
-        batch_size = input.batch_size
         if not self.subm:
             if self.transposed:
                 out_spatial_shape = ops.get_deconv_output_size(
@@ -128,49 +230,115 @@ class SparseConvolution(SparseModule):
 
         else:
             out_spatial_shape = spatial_shape
+        # indice pairs only depend on the input coordinates and the geometry of
+        # this layer, so layers without indice_key share them automatically.
+        auto_key = (input.coord_id, ) + self.geometry_key()
+        indice_key = self.indice_key
+        if indice_key is None:
+            indice_key = auto_key
+        datas = input.find_indice_pair(indice_key)
+        if self.inverse:
+            assert datas is not None and self.indice_key is not None
+            _, outids, indice_pairs, indice_pair_num, out_spatial_shape, out_coord_id = datas
+            assert indice_pair_num.shape[0] == np.prod(self.kernel_size), "inverse conv must have same kernel size as its couple conv"
+        else:
+            if datas is not None:
+                outids, _, indice_pairs, indice_pair_num, _, _ = datas
+            else:
+                outids, indice_pairs, indice_pair_num = ops.get_indice_pairs(
+                    indices, input.batch_size, spatial_shape, self.kernel_size,
+                    self.stride, self.padding, self.dilation, self.output_padding, self.subm, self.transposed, grid=input.grid,
+                    order=input.order, half=self.half_rulebook)
+                input.indice_dict[indice_key] = (outids, indices, indice_pairs, indice_pair_num, spatial_shape, input.coord_id)
+            out_coord_id = input.coord_id if self.subm else auto_key
+        return outids, indice_pairs, indice_pair_num, out_spatial_shape, out_coord_id
+
+    def forward(self, input):
+        assert isinstance(input, spconv.SparseConvTensor)
+        features = input.features
+        device = features.device
+        indices = input.indices
+        spatial_shape = input.spatial_shape
+        batch_size = input.batch_size
         # input.update_grid(out_spatial_shape)
         # t = time.time()
         if self.conv1x1:
-            input.features = torch.mm(
-                input.features,
-                self.weight.view(self.in_channels, self.out_channels))
+            if self.groups == 1:
+                input.features = torch.mm(
+                    input.features,
+                    self.weight.view(self.in_channels, self.out_channels))
+            else:
+                g = self.groups
+                weight = self.weight.view(self.in_channels // g, g, -1)
+                input.features = torch.bmm(
+                    features.view(-1, g, self.in_channels // g).transpose(0, 1),
+                    weight.transpose(0, 1)).transpose(0, 1).reshape(
+                        -1, self.out_channels)
             if self.bias is not None:
                 input.features += self.bias
+            input.features = self.apply_activation(input.features)
             return input
-        datas = input.find_indice_pair(self.indice_key)
-        if self.inverse:
-            assert datas is not None and self.indice_key is not None
-            _, outids, indice_pairs, indice_pair_num, out_spatial_shape = datas
-            assert indice_pairs.shape[0] == np.prod(self.kernel_size), "inverse conv must have same kernel size as its couple conv"
+        # torch.autocast runs convs in lower precision, the cast is recorded
+        # by autograd so the parameters get gradients in their own dtype.
+        features, weight, bias = Fsp.autocast_inputs(features, self.weight, self.bias)
+        dense = self.use_dense(input)
+        if dense and self.subm:
+            # the dense conv doesn't need indice pairs.
+            outids = indices
+            out_spatial_shape = spatial_shape
+            out_coord_id = input.coord_id
         else:
-            if self.indice_key is not None and datas is not None:
-                outids, _, indice_pairs, indice_pair_num, _ = datas
-            else:
-                outids, indice_pairs, indice_pair_num = ops.get_indice_pairs(
-                    indices, batch_size, spatial_shape, self.kernel_size,
-                    self.stride, self.padding, self.dilation, self.output_padding, self.subm, self.transposed, grid=input.grid)
-                input.indice_dict[self.indice_key] = (outids, indices, indice_pairs, indice_pair_num, spatial_shape)
-        if self.subm:
-            out_features = Fsp.indice_subm_conv(features, self.weight,
-                                              indice_pairs.to(device),
-                                              indice_pair_num,
-                                              outids.shape[0])
+            (outids, indice_pairs, indice_pair_num, out_spatial_shape,
+             out_coord_id) = self.get_indice_pairs(input)
+        algo = self.algo
+        if algo == ops.ConvAlgo.Auto and not dense:
+            autotuner = autotune.get_autotuner()
+            algo = ops.ConvAlgo.Native
+            if autotuner is not None:
+                dense_conv = None
+                if self.supports_dense():
+                    dense_conv = lambda f, w: self.dense_conv(f, w, input, outids)
+                algo = autotuner.select(self, features, indice_pairs.to(device),
+                                        indice_pair_num, outids.shape[0],
+                                        dense_conv, input.sparity)
+            dense = algo == ops.ConvAlgo.Dense
+        if dense:
+            out_features = self.dense_conv(features, weight, input, outids)
+            if bias is not None:
+                out_features = out_features + bias
+            out_features = self.apply_activation(out_features)
+        elif self.fuse_bias_activation(features):
+            out_features = ops.indice_conv(features, weight,
+                                           indice_pairs.to(device), indice_pair_num,
+                                           outids.shape[0],
+                                           self.inverse and not self.subm, self.subm,
+                                           algo, bias, self.act,
+                                           self.act_alpha)
         else:
-            if self.inverse:
+            if self.subm:
+                out_features = Fsp.indice_subm_conv(features, weight,
+                                                    indice_pairs.to(device),
+                                                    indice_pair_num,
+                                                    outids.shape[0], algo)
+            elif self.inverse:
                 out_features = Fsp.indice_inverse_conv(features,
-                                            self.weight, indice_pairs.to(device),
-                                            indice_pair_num, outids.shape[0])
+                                            weight, indice_pairs.to(device),
+                                            indice_pair_num, outids.shape[0],
+                                            algo)
             else:
                 out_features = Fsp.indice_conv(features,
-                                            self.weight, indice_pairs.to(device),
-                                            indice_pair_num, outids.shape[0])
-
-        if self.bias is not None:
-            out_features += self.bias
+                                            weight, indice_pairs.to(device),
+                                            indice_pair_num, outids.shape[0],
+                                            algo)
+            if bias is not None:
+                out_features += bias
+            out_features = self.apply_activation(out_features)
         out_tensor = spconv.SparseConvTensor(out_features, outids,
-                                             out_spatial_shape, batch_size)
+                                             out_spatial_shape, batch_size,
+                                             coord_id=out_coord_id)
         out_tensor.indice_dict = input.indice_dict
         out_tensor.grid = input.grid
+        out_tensor.order = input.order
         return out_tensor
 
 
@@ -184,7 +352,9 @@ class SparseConv2d(SparseConvolution):
                  dilation=1,
                  groups=1,
                  bias=True,
-                 indice_key=None):
+                 indice_key=None,
+                 algo=ops.ConvAlgo.Native,
+                 dense_threshold=None):
         super(SparseConv2d, self).__init__(
             2,
             in_channels,
@@ -195,7 +365,9 @@ class SparseConv2d(SparseConvolution):
             dilation,
             groups,
             bias,
-            indice_key=indice_key)
+            indice_key=indice_key,
+            algo=algo,
+            dense_threshold=dense_threshold)
 
 
 class SparseConv3d(SparseConvolution):
@@ -208,7 +380,9 @@ class SparseConv3d(SparseConvolution):
                  dilation=1,
                  groups=1,
                  bias=True,
-                 indice_key=None):
+                 indice_key=None,
+                 algo=ops.ConvAlgo.Native,
+                 dense_threshold=None):
         super(SparseConv3d, self).__init__(
             3,
             in_channels,
@@ -219,7 +393,9 @@ class SparseConv3d(SparseConvolution):
             dilation,
             groups,
             bias,
-            indice_key=indice_key)
+            indice_key=indice_key,
+            algo=algo,
+            dense_threshold=dense_threshold)
 
 class SparseConvTranspose2d(SparseConvolution):
     def __init__(self,
@@ -231,7 +407,9 @@ class SparseConvTranspose2d(SparseConvolution):
                  dilation=1,
                  groups=1,
                  bias=True,
-                 indice_key=None):
+                 indice_key=None,
+                 algo=ops.ConvAlgo.Native,
+                 dense_threshold=None):
         super(SparseConvTranspose2d, self).__init__(
             2,
             in_channels,
@@ -243,7 +421,9 @@ class SparseConvTranspose2d(SparseConvolution):
             groups,
             bias,
             transposed=True,
-            indice_key=indice_key)
+            indice_key=indice_key,
+            algo=algo,
+            dense_threshold=dense_threshold)
 
 
 class SparseConvTranspose3d(SparseConvolution):
@@ -256,8 +436,9 @@ class SparseConvTranspose3d(SparseConvolution):
                  dilation=1,
                  groups=1,
                  bias=True,
-                 
-                 indice_key=None):
+                 indice_key=None,
+                 algo=ops.ConvAlgo.Native,
+                 dense_threshold=None):
         super(SparseConvTranspose3d, self).__init__(
             3,
             in_channels,
@@ -269,7 +450,9 @@ class SparseConvTranspose3d(SparseConvolution):
             groups,
             bias,
             transposed=True,
-            indice_key=indice_key)
+            indice_key=indice_key,
+            algo=algo,
+            dense_threshold=dense_threshold)
 
 class SparseInverseConv2d(SparseConvolution):
     def __init__(self,
@@ -277,7 +460,8 @@ class SparseInverseConv2d(SparseConvolution):
                  out_channels,
                  kernel_size,
                  indice_key,
-                 bias=True):
+                 bias=True,
+                 algo=ops.ConvAlgo.Native):
         super(SparseInverseConv2d, self).__init__(
             2,
             in_channels,
@@ -285,7 +469,8 @@ class SparseInverseConv2d(SparseConvolution):
             kernel_size,
             bias=bias,
             inverse=True,
-            indice_key=indice_key)
+            indice_key=indice_key,
+            algo=algo)
 
 
 class SparseInverseConv3d(SparseConvolution):
@@ -294,7 +479,8 @@ class SparseInverseConv3d(SparseConvolution):
                  out_channels,
                  kernel_size,
                  indice_key,
-                 bias=True):
+                 bias=True,
+                 algo=ops.ConvAlgo.Native):
         super(SparseInverseConv3d, self).__init__(
             3,
             in_channels,
@@ -302,7 +488,8 @@ class SparseInverseConv3d(SparseConvolution):
             kernel_size,
             bias=bias,
             inverse=True,
-            indice_key=indice_key)
+            indice_key=indice_key,
+            algo=algo)
 
 
 class SubMConv2d(SparseConvolution):
@@ -315,7 +502,10 @@ class SubMConv2d(SparseConvolution):
                  dilation=1,
                  groups=1,
                  bias=True,
-                 indice_key=None):
+                 indice_key=None,
+                 algo=ops.ConvAlgo.Native,
+                 half_rulebook=False,
+                 dense_threshold=None):
         super(SubMConv2d, self).__init__(
             2,
             in_channels,
@@ -327,7 +517,10 @@ class SubMConv2d(SparseConvolution):
             groups,
             bias,
             True,
-            indice_key=indice_key)
+            indice_key=indice_key,
+            algo=algo,
+            half_rulebook=half_rulebook,
+            dense_threshold=dense_threshold)
 
 
 class SubMConv3d(SparseConvolution):
@@ -340,7 +533,10 @@ class SubMConv3d(SparseConvolution):
                  dilation=1,
                  groups=1,
                  bias=True,
-                 indice_key=None):
+                 indice_key=None,
+                 algo=ops.ConvAlgo.Native,
+                 half_rulebook=False,
+                 dense_threshold=None):
         super(SubMConv3d, self).__init__(
             3,
             in_channels,
@@ -352,4 +548,7 @@ class SubMConv3d(SparseConvolution):
             groups,
             bias,
             True,
-            indice_key=indice_key)
+            indice_key=indice_key,
+            algo=algo,
+            half_rulebook=half_rulebook,
+            dense_threshold=dense_threshold)
@@ -17,6 +17,42 @@ import spconv.ops as ops
 import torch
 from torch import nn
 from torch.autograd import Function
+from spconv.workspace import get_workspace
+
+
+def get_autocast_dtype(device):
+    """lower precision dtype of the torch.autocast enabled for device, None if
+    autocast is disabled.
+    """
+    device_type = torch.device(device).type
+    if device_type == "cuda":
+        if not torch.is_autocast_enabled():
+            return None
+        if hasattr(torch, "get_autocast_dtype"):
+            return torch.get_autocast_dtype(device_type)
+        return torch.get_autocast_gpu_dtype()
+    if device_type == "cpu":
+        if not torch.is_autocast_cpu_enabled():
+            return None
+        if hasattr(torch, "get_autocast_dtype"):
+            return torch.get_autocast_dtype(device_type)
+        return torch.get_autocast_cpu_dtype()
+    return None
+
+
+def autocast_inputs(*tensors):
+    """cast floating point tensors to the autocast dtype of their device, the
+    rule torch.autocast uses for conv: float64 tensors and None are kept.
+    sparse convs run in the dtype of their inputs otherwise.
+    """
+    res = []
+    for t in tensors:
+        if t is not None and t.is_floating_point() and t.dtype != torch.float64:
+            dtype = get_autocast_dtype(t.device)
+            if dtype is not None:
+                t = t.to(dtype)
+        res.append(t)
+    return res
 
 
 class SparseConvFunction(Function):
@@ -27,20 +63,26 @@ class SparseConvFunction(Function):
             filters,
             indice_pairs,
             indice_pair_num,
-            num_activate_out):
+            num_activate_out,
+            algo=ops.ConvAlgo.Native):
+        features, filters = autocast_inputs(features, filters)
         ctx.save_for_backward(
             indice_pairs,
             indice_pair_num,
             features,
             filters)
-        return ops.indice_conv(features, filters, indice_pairs, indice_pair_num, num_activate_out, False)
+        ctx.algo = algo
+        ctx.workspace = get_workspace()
+        return ops.indice_conv(features, filters, indice_pairs, indice_pair_num, num_activate_out, False, False, algo)
 
     @staticmethod
     def backward(ctx, grad_output):
         indice_pairs, indice_pair_num, features, filters = ctx.saved_tensors
-        input_bp, filters_bp = ops.indice_conv_backward(features, filters, grad_output, indice_pairs, indice_pair_num, False)
+        input_bp, filters_bp = ops.indice_conv_backward(
+            features, filters, grad_output, indice_pairs, indice_pair_num, False, False,
+            ctx.algo, *ctx.needs_input_grad[:2], workspace=ctx.workspace)
         
-        return input_bp, filters_bp, None, None, None
+        return input_bp, filters_bp, None, None, None, None
 
 class SparseInverseConvFunction(Function):
     @staticmethod
@@ -50,20 +92,26 @@ class SparseInverseConvFunction(Function):
             filters,
             indice_pairs,
             indice_pair_num,
-            num_activate_out):
+            num_activate_out,
+            algo=ops.ConvAlgo.Native):
+        features, filters = autocast_inputs(features, filters)
         ctx.save_for_backward(
             indice_pairs,
             indice_pair_num,
             features,
             filters)
-        return ops.indice_conv(features, filters, indice_pairs, indice_pair_num, num_activate_out, True, False)
+        ctx.algo = algo
+        ctx.workspace = get_workspace()
+        return ops.indice_conv(features, filters, indice_pairs, indice_pair_num, num_activate_out, True, False, algo)
 
     @staticmethod
     def backward(ctx, grad_output):
         indice_pairs, indice_pair_num, features, filters = ctx.saved_tensors
-        input_bp, filters_bp = ops.indice_conv_backward(features, filters, grad_output, indice_pairs, indice_pair_num, True, False)
+        input_bp, filters_bp = ops.indice_conv_backward(
+            features, filters, grad_output, indice_pairs, indice_pair_num, True, False,
+            ctx.algo, *ctx.needs_input_grad[:2], workspace=ctx.workspace)
         
-        return input_bp, filters_bp, None, None, None
+        return input_bp, filters_bp, None, None, None, None
 
 
 class SubMConvFunction(Function):
@@ -74,20 +122,26 @@ class SubMConvFunction(Function):
             filters,
             indice_pairs,
             indice_pair_num,
-            num_activate_out):
+            num_activate_out,
+            algo=ops.ConvAlgo.Native):
+        features, filters = autocast_inputs(features, filters)
         ctx.save_for_backward(
             indice_pairs,
             indice_pair_num,
             features,
             filters)
-        return ops.indice_conv(features, filters, indice_pairs, indice_pair_num, num_activate_out, False, True)
+        ctx.algo = algo
+        ctx.workspace = get_workspace()
+        return ops.indice_conv(features, filters, indice_pairs, indice_pair_num, num_activate_out, False, True, algo)
 
     @staticmethod
     def backward(ctx, grad_output):
         indice_pairs, indice_pair_num, features, filters = ctx.saved_tensors
-        input_bp, filters_bp = ops.indice_conv_backward(features, filters, grad_output, indice_pairs, indice_pair_num, False, True)
+        input_bp, filters_bp = ops.indice_conv_backward(
+            features, filters, grad_output, indice_pairs, indice_pair_num, False, True,
+            ctx.algo, *ctx.needs_input_grad[:2], workspace=ctx.workspace)
         
-        return input_bp, filters_bp, None, None, None
+        return input_bp, filters_bp, None, None, None, None
 
 
 class SparseMaxPoolFunction(Function):
@@ -0,0 +1,108 @@
+# Copyright 2019 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""inference fusion of conv -> BatchNorm1d -> activation blocks in
+SparseSequential::
+
+    net = spconv.fuse_modules(net.eval())
+    with torch.no_grad():
+        out = net(x)
+
+the BatchNorm is folded into the weight and bias of the conv and the
+activation is applied by indice_conv after the accumulation, so every block
+makes one pass over the features instead of three.
+"""
+
+import copy
+
+import torch
+from spconv import ops
+from spconv.conv import SparseConvolution
+from spconv.modules import SparseSequential
+from torch import nn
+from torch.nn.parameter import Parameter
+
+
+def fuse_conv_bn(conv, bn):
+    """fold the running statistics and affine parameters of bn into the weight
+    and bias of conv (in place). conv must not have an activation yet.
+    """
+    assert conv.act == ops.ConvActivation.Identity, "bn after activation can't be fused"
+    assert bn.num_features == conv.out_channels
+    assert bn.track_running_stats, "bn without running stats can't be fused"
+    with torch.no_grad():
+        scale = torch.rsqrt(bn.running_var + bn.eps)
+        if bn.affine:
+            scale = scale * bn.weight
+        bias = -bn.running_mean * scale
+        if conv.bias is not None:
+            bias = bias + conv.bias * scale
+        if bn.affine:
+            bias = bias + bn.bias
+        # output channels are the last dim of the weight.
+        conv.weight.mul_(scale.to(conv.weight.dtype))
+        bias = bias.to(conv.weight.dtype)
+        if conv.bias is None:
+            conv.bias = Parameter(bias)
+        else:
+            conv.bias.copy_(bias)
+    return conv
+
+
+def fuse_activation(conv, act):
+    """let conv apply act, returns False if act isn't supported.
+    """
+    if conv.act != ops.ConvActivation.Identity:
+        return False
+    if isinstance(act, nn.ReLU):
+        conv.act = ops.ConvActivation.ReLU
+    elif isinstance(act, nn.LeakyReLU):
+        conv.act = ops.ConvActivation.LeakyReLU
+        conv.act_alpha = act.negative_slope
+    else:
+        return False
+    return True
+
+
+def _fuse_sequential(seq):
+    names = list(seq._modules.keys())
+    i = 0
+    while i < len(names):
+        conv = seq._modules[names[i]]
+        i += 1
+        if not isinstance(conv, SparseConvolution):
+            continue
+        if i < len(names) and isinstance(seq._modules[names[i]], nn.BatchNorm1d):
+            fuse_conv_bn(conv, seq._modules[names[i]])
+            seq._modules[names[i]] = nn.Identity()
+            i += 1
+        if i < len(names) and fuse_activation(conv, seq._modules[names[i]]):
+            seq._modules[names[i]] = nn.Identity()
+            i += 1
+
+
+def fuse_modules(net, inplace=False):
+    """fuse every SparseConvolution -> [BatchNorm1d] -> [ReLU/LeakyReLU] of
+    all SparseSequential in net. fused modules are replaced by nn.Identity.
+    only for inference: the running statistics of the BatchNorm are used.
+
+    Args:
+        inplace: modify net instead of a copy.
+    """
+    assert not net.training, "fusion uses running statistics, call eval() first"
+    if not inplace:
+        net = copy.deepcopy(net)
+    for module in net.modules():
+        if isinstance(module, SparseSequential):
+            _fuse_sequential(module)
+    return net
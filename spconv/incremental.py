@@ -0,0 +1,275 @@
+# Copyright 2019 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""incremental update of indice pairs for consecutive frames which share
+most of their active sites.
+
+coordinates of an updated set are always ordered as the kept rows of the
+previous set (in their previous order) followed by the added rows, so the
+indices of kept sites are remapped by a prefix count and new sites get the
+indices after them.
+"""
+
+import itertools
+
+import torch
+from spconv import ops
+
+
+def get_indice_key_geometries(net):
+    """collect {indice_key: geometry} of all layers of net with an
+    indice_key, see update_indice_dict.
+    """
+    geometries = {}
+    for module in net.modules():
+        if getattr(module, "indice_key", None) is None:
+            continue
+        if getattr(module, "inverse", False):
+            # inverse convs reuse the pairs of their couple conv.
+            continue
+        geometries[module.indice_key] = module.geometry_key()
+    return geometries
+
+
+def _row_keys(*tensors):
+    """int64 keys of index rows, equal iff the rows are equal. rows must be
+    non-negative.
+    """
+    rows = torch.cat([t.long() for t in tensors])
+    if rows.shape[0] == 0:
+        return [t.new_zeros([0], dtype=torch.int64) for t in tensors]
+    extents = rows.max(0)[0] + 1
+    keys = rows[:, 0]
+    for i in range(1, rows.shape[1]):
+        keys = keys * extents[i] + rows[:, i]
+    return list(torch.split(keys, [t.shape[0] for t in tensors]))
+
+
+def _lookup(query, table):
+    """position of each query key in table, -1 if not found.
+    """
+    res = torch.full_like(query, -1)
+    if table.numel() == 0 or query.numel() == 0:
+        return res
+    sorted_table, order = torch.sort(table)
+    pos = torch.searchsorted(sorted_table, query).clamp_(max=table.numel() - 1)
+    found = sorted_table[pos] == query
+    res[found] = order[pos[found]]
+    return res
+
+
+def _split_indice_pairs(indice_pairs, indice_pair_num):
+    nums = indice_pair_num.cpu().tolist()
+    blocks = torch.split(indice_pairs, [2 * n for n in nums])
+    return [b.view(2, n) for b, n in zip(blocks, nums)]
+
+
+def _concat_indice_pairs(blocks, indice_pair_num):
+    """blocks: per kernel offset list of [2, n] pair tensors.
+    """
+    blocks = [torch.cat(bs, dim=1).int() for bs in blocks]
+    nums = [b.shape[1] for b in blocks]
+    indice_pairs = torch.cat([b.reshape(-1) for b in blocks])
+    indice_pair_num = torch.tensor(nums, dtype=torch.int32,
+                                   device=indice_pair_num.device)
+    return indice_pairs, indice_pair_num
+
+
+class _CoordUpdate(object):
+    """new coordinates = prev[keep] followed by added.
+    """
+
+    def __init__(self, prev, keep, added):
+        self.keep = keep
+        self.added = added
+        self.num_kept = int(keep.sum())
+        self.coords = torch.cat([prev[keep], added.to(prev.dtype)]).contiguous()
+        self.remap = torch.full([prev.shape[0]], -1, dtype=torch.int64,
+                                device=prev.device)
+        self.remap[keep] = torch.arange(self.num_kept, device=prev.device)
+
+    @property
+    def unchanged(self):
+        return self.added.shape[0] == 0 and self.num_kept == self.keep.shape[0]
+
+
+def _subm_neighbor_deltas(ksize, dilation):
+    # an input site j and an output site o of a subm conv are paired iff
+    # o - j is one of these deltas (or j - o, for the other direction).
+    axes = [[d * (k // 2 - i) for i in range(k)] for k, d in zip(ksize, dilation)]
+    deltas = set()
+    for delta in itertools.product(*axes):
+        deltas.add(delta)
+        deltas.add(tuple(-v for v in delta))
+    return sorted(deltas)
+
+
+def _update_subm(update, indice_pairs, indice_pair_num, batch_size,
+                 spatial_shape, geometry):
+    ksize, stride, padding, dilation, out_padding, subm, transposed, half = geometry
+    blocks = []
+    # pairs between two kept sites are unchanged.
+    for b in _split_indice_pairs(indice_pairs, indice_pair_num):
+        b = update.remap[b.long()]
+        blocks.append([b[:, (b >= 0).all(0)]])
+    added = update.added
+    if added.shape[0] == 0:
+        return _concat_indice_pairs(blocks, indice_pair_num)
+    # every new pair has an added site on one side and an added site or a kept
+    # neighbor of an added site on the other side, so they are generated from
+    # this subset only.
+    device = update.coords.device
+    deltas = torch.tensor(_subm_neighbor_deltas(ksize, dilation),
+                          dtype=torch.int64, device=device)
+    added_l = added.long()
+    cand = added_l[:, None, 1:] + deltas[None]
+    batch = added_l[:, None, :1].expand(-1, deltas.shape[0], -1)
+    cand = torch.cat([batch, cand], dim=2).view(-1, added.shape[1])
+    shape_t = torch.tensor(list(spatial_shape), dtype=torch.int64, device=device)
+    valid = ((cand[:, 1:] >= 0) & (cand[:, 1:] < shape_t)).all(1)
+    kept_coords = update.coords[:update.num_kept]
+    cand_keys, kept_keys = _row_keys(cand[valid], kept_coords)
+    neighbors = _lookup(cand_keys, kept_keys)
+    neighbors = torch.unique(neighbors[neighbors >= 0])
+    sub_idx = torch.cat([
+        neighbors,
+        torch.arange(update.num_kept, update.coords.shape[0], device=device)
+    ])
+    _, sub_pairs, sub_pair_num = ops.get_indice_pairs(
+        update.coords[sub_idx].contiguous(), batch_size, spatial_shape, ksize,
+        stride, padding, dilation, out_padding, subm, transposed, half=half)
+    for i, b in enumerate(_split_indice_pairs(sub_pairs, sub_pair_num)):
+        b = sub_idx[b.long()]
+        blocks[i].append(b[:, (b >= update.num_kept).any(0)])
+    return _concat_indice_pairs(blocks, indice_pair_num)
+
+
+def _update_conv(update, outids, indice_pairs, indice_pair_num, batch_size,
+                 spatial_shape, geometry):
+    ksize, stride, padding, dilation, out_padding, subm, transposed, half = geometry
+    device = outids.device
+    num_out = outids.shape[0]
+    old_blocks = []
+    alive = torch.zeros([num_out], dtype=torch.bool, device=device)
+    # the pairs of an input site don't depend on other input sites, so the
+    # pairs of kept sites are unchanged.
+    for b in _split_indice_pairs(indice_pairs, indice_pair_num):
+        inds = update.remap[b[0].long()]
+        valid = inds >= 0
+        outs = b[1].long()[valid]
+        alive[outs] = True
+        old_blocks.append((inds[valid], outs))
+    added = update.added
+    if added.shape[0] > 0:
+        added_outids, added_pairs, added_pair_num = ops.get_indice_pairs(
+            added.contiguous(), batch_size, spatial_shape, ksize, stride,
+            padding, dilation, out_padding, subm, transposed)
+        added_keys, old_keys = _row_keys(added_outids, outids)
+        found = _lookup(added_keys, old_keys)
+        alive[found[found >= 0]] = True
+    out_remap = torch.full([num_out], -1, dtype=torch.int64, device=device)
+    num_alive = int(alive.sum())
+    out_remap[alive] = torch.arange(num_alive, device=device)
+    blocks = [[torch.stack([inds, out_remap[outs]])] for inds, outs in old_blocks]
+    if added.shape[0] > 0:
+        new_out = found < 0
+        added_remap = torch.where(
+            new_out,
+            num_alive + torch.cumsum(new_out.long(), 0) - 1,
+            out_remap[found.clamp(min=0)])
+        for i, b in enumerate(_split_indice_pairs(added_pairs, added_pair_num)):
+            b = b.long()
+            blocks[i].append(torch.stack(
+                [b[0] + update.num_kept, added_remap[b[1]]]))
+        added_out = added_outids[new_out]
+    else:
+        added_out = outids[:0]
+    indice_pairs, indice_pair_num = _concat_indice_pairs(blocks, indice_pair_num)
+    return _CoordUpdate(outids, alive, added_out), indice_pairs, indice_pair_num
+
+
+def _entry_geometry(key, coord_id, geometries):
+    if geometries is not None and key in geometries:
+        return geometries[key]
+    # automatic keys are (coord_id, ) + geometry, see SparseConvolution.
+    if isinstance(key, tuple) and len(key) == 9 and key[0] == coord_id:
+        return key[1:]
+    raise ValueError("geometry of indice_key {} is unknown, provide it in "
+                     "geometries".format(key))
+
+
+def update_indice_dict(indice_dict, coord_id, indices, added, removed,
+                       batch_size, geometries=None):
+    """update the indice pairs of the previous frame for a new frame instead
+    of regenerating them.
+
+    Args:
+        indice_dict: indice_dict of a SparseConvTensor of the previous frame.
+        coord_id: coord_id of the input SparseConvTensor of the previous frame.
+        indices: [N, ndim + 1] indices of the previous frame.
+        added: [M, ndim + 1] indices of the new active sites.
+        removed: [R, ndim + 1] indices of the previous sites that are not
+            active anymore.
+        geometries: {indice_key: geometry} for entries with user provided
+            indice_key, see get_indice_key_geometries. automatic keys already
+            contain their geometry.
+
+    Returns:
+        new_indices: indices of the new frame, kept rows of indices in their
+            previous order followed by added. features of the new frame must be
+            ordered accordingly.
+        new_indice_dict: indice_dict for a SparseConvTensor with new_indices and
+            the same coord_id. indice_dict isn't modified.
+    """
+    added = added.to(indices.device).int()
+    removed = removed.to(indices.device)
+    removed_keys, prev_keys, added_keys = _row_keys(removed, indices, added)
+    keep = torch.ones([indices.shape[0]], dtype=torch.bool, device=indices.device)
+    found = _lookup(removed_keys, prev_keys)
+    keep[found[found >= 0]] = False
+    if (_lookup(added_keys, prev_keys[keep]) >= 0).any():
+        raise ValueError("added indices must not be active in the new frame already")
+    updates = {coord_id: _CoordUpdate(indices, keep, added)}
+    queue = [coord_id]
+    new_indice_dict = dict(indice_dict)
+    while queue:
+        in_coord_id = queue.pop(0)
+        update = updates[in_coord_id]
+        for key, datas in indice_dict.items():
+            outids, _, indice_pairs, indice_pair_num, spatial_shape, entry_coord_id = datas
+            if entry_coord_id != in_coord_id:
+                continue
+            geometry = _entry_geometry(key, in_coord_id, geometries)
+            subm = geometry[5]
+            if update.unchanged:
+                out_update = _CoordUpdate(
+                    outids, outids.new_ones([outids.shape[0]], dtype=torch.bool),
+                    outids[:0])
+            elif subm:
+                indice_pairs, indice_pair_num = _update_subm(
+                    update, indice_pairs, indice_pair_num, batch_size,
+                    spatial_shape, geometry)
+                outids = update.coords
+            else:
+                out_update, indice_pairs, indice_pair_num = _update_conv(
+                    update, outids, indice_pairs, indice_pair_num, batch_size,
+                    spatial_shape, geometry)
+                outids = out_update.coords
+            new_indice_dict[key] = (outids, update.coords, indice_pairs,
+                                    indice_pair_num, spatial_shape, in_coord_id)
+            if not subm:
+                out_coord_id = (in_coord_id, ) + tuple(geometry)
+                if out_coord_id not in updates:
+                    updates[out_coord_id] = out_update
+                    queue.append(out_coord_id)
+    return updates[coord_id].coords, new_indice_dict
@@ -12,8 +12,48 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
 import spconv
 import torch
+from spconv.cache import get_indice_pair_cache
+from spconv.ordering import get_permutation, permute_indice_pairs_output
+from spconv.workspace import get_workspace_buffer
+
+class ConvAlgo(object):
+    """algorithms of indice_conv and indice_conv_backward.
+    """
+    # gather, gemm and scatter add through buffers for every kernel offset.
+    Native = 0
+    # cpu only. gather, gemm and scatter add fused in cache sized tiles,
+    # without intermediate buffers.
+    Fused = 1
+    # gather all kernel offsets into one buffer padded to the largest offset
+    # and run a single batched matmul. fastest for small channels, uses
+    # num_offsets * max_pairs * channels memory.
+    Batch = 2
+    # cpu only. the outputs are computed in cache sized tiles which gather
+    # their neighbors through a tiled rulebook (see get_tiled_indice_pairs),
+    # the backward uses Native.
+    OutputStationary = 3
+    # layers only: chosen per layer and input by spconv.autotune.
+    Auto = -1
+    # layers only: scatter the input to a dense tensor, run the dense torch
+    # convolution and gather the outputs. see SparseConvolution.dense_threshold.
+    Dense = -2
+
+
+class ConvActivation(object):
+    """activations applied by indice_conv after the bias.
+    """
+    Identity = 0
+    ReLU = 1
+    # act_alpha is the negative slope.
+    LeakyReLU = 2
+
+
+# when the dense output grid (batch_size * output volume) of a cpu indice
+# generation exceeds this many cells, a hash table is used instead of the grid.
+HASH_INDICE_PAIRS_MIN_VOLUME = 2 ** 24
 
 
 def get_conv_output_size(input_size, kernel_size, stride, padding, dilation):
@@ -52,7 +92,44 @@ def get_indice_pairs(indices,
              out_padding=0,
              subm=False,
              transpose=False,
-             grid=None):
+             grid=None,
+             use_hash=None,
+             order=None,
+             half=False):
+    """
+    Returns:
+        outids: [num_act_out, ndim + 1] int32 tensor of output indices.
+        indice_pairs: int32 tensor of 2 * indice_pair_num.sum() elements in
+            compact layout: the pairs of kernel offset i are a contiguous
+            [2, indice_pair_num[i]] block (input indices, then output indices)
+            that follows the blocks of offsets 0..i-1.
+        indice_pair_num: [kernel_volume] int32 cpu tensor, number of pairs of
+            each kernel offset. kept on cpu for all devices so that conv and
+            pool calls don't copy it to the host.
+
+    on cpu the indice pairs and outids are written with their exact size. the
+    gpu kernels still fill a [kernel_volume, 2, num_act] buffer padded with -1
+    (and outids of a non-submanifold conv are sized after a unique pass),
+    which is compacted before it's returned, so peak gpu memory during the
+    generation isn't reduced.
+
+    Args:
+        grid: pre-allocated grid tensor, see SparseConvTensor.
+        use_hash: track output sites by a hash table instead of a dense
+            [batch_size * output volume] grid. only supported on cpu. if None,
+            the hash table is used on cpu when the dense grid would have more
+            than HASH_INDICE_PAIRS_MIN_VOLUME cells and no grid is given.
+        order: order of the output indices of non-submanifold convs, see
+            SparseConvTensor.
+        half: only keep the kernel offsets 0..kernel_volume // 2 of a
+            submanifold conv with odd kernel size. the pairs of offset
+            kernel_volume - 1 - i are the pairs of offset i with inputs and
+            outputs swapped, indice_conv derives them. indice_pair_num has
+            kernel_volume // 2 + 1 elements.
+
+    if an IndicePairCache is installed by spconv.set_indice_pair_cache, results
+    are looked up in and stored to it.
+    """
     ndim = indices.shape[1] - 1
     if not isinstance(ksize, (list, tuple)):
         ksize = [ksize] * ndim
@@ -78,7 +155,48 @@ def get_indice_pairs(indices,
 
     else:
         out_shape = spatial_shape
-    if grid is None:
+    cache = get_indice_pair_cache()
+    if cache is not None:
+        key = cache.make_key(indices, batch_size, tuple(spatial_shape),
+                             tuple(ksize), tuple(stride), tuple(padding),
+                             tuple(dilation), tuple(out_padding), bool(subm),
+                             bool(transpose), order, bool(half))
+        res = cache.get(key)
+        if res is not None:
+            return res
+    res = _get_indice_pairs(indices, batch_size, out_shape, spatial_shape, ksize,
+                            stride, padding, dilation, out_padding, subm,
+                            transpose, grid, use_hash, half)
+    if order is not None and not subm:
+        outids, indice_pairs, indice_pair_num = res
+        perm = get_permutation(outids, out_shape, order)
+        res = (outids[perm].contiguous(),
+               permute_indice_pairs_output(indice_pairs, indice_pair_num, perm),
+               indice_pair_num)
+    if cache is not None:
+        cache.put(key, res)
+    return res
+
+
+def _get_indice_pairs(indices, batch_size, out_shape, spatial_shape, ksize,
+                      stride, padding, dilation, out_padding, subm, transpose,
+                      grid, use_hash, half=False):
+    ndim = indices.shape[1] - 1
+    if use_hash is None:
+        use_hash = (grid is None and indices.device.type == "cpu" and
+                    batch_size * np.prod(out_shape) > HASH_INDICE_PAIRS_MIN_VOLUME)
+    if use_hash:
+        assert grid is None, "hash indice pairs don't use pre-allocated grid"
+        if ndim == 2:
+            get_indice_pairs_func = torch.ops.spconv.get_indice_pairs_hash_2d
+        elif ndim == 3:
+            get_indice_pairs_func = torch.ops.spconv.get_indice_pairs_hash_3d
+        else:
+            raise NotImplementedError
+        return get_indice_pairs_func(indices, batch_size, out_shape, spatial_shape, ksize,
+                            stride, padding, dilation, out_padding, int(subm), int(transpose),
+                            int(half))
+    elif grid is None:
         if ndim == 2:
             get_indice_pairs_func = torch.ops.spconv.get_indice_pairs_2d
         elif ndim == 3:
@@ -86,7 +204,8 @@ def get_indice_pairs(indices,
         else:
             raise NotImplementedError
         return get_indice_pairs_func(indices, batch_size, out_shape, spatial_shape, ksize,
-                            stride, padding, dilation, out_padding, int(subm), int(transpose))
+                            stride, padding, dilation, out_padding, int(subm), int(transpose),
+                            int(half))
     else:
         if ndim == 2:
             get_indice_pairs_func = torch.ops.spconv.get_indice_pairs_grid_2d
@@ -95,8 +214,37 @@ def get_indice_pairs(indices,
         else:
             raise NotImplementedError
         return get_indice_pairs_func(indices, grid, batch_size, out_shape, spatial_shape, ksize,
-                            stride, padding, dilation, out_padding, int(subm), int(transpose))
+                            stride, padding, dilation, out_padding, int(subm), int(transpose),
+                            int(half))
+
+
+
+def get_tiled_indice_pairs(indice_pairs, indice_pair_num, num_activate_out,
+                           kernel_volume, inverse=False):
+    """tiled rulebook of ConvAlgo.OutputStationary and indice_conv_int8: the
+    indice pairs sorted by (output tile, kernel offset), see tileIndicePairs in
+    indice_pairs.h.
 
+    it's built once and cached on the indice_pairs tensor, so it lives as long
+    as the rulebook and layers which share a rulebook share it too. it takes
+    about as much memory as the indice pairs.
+    """
+    cache = getattr(indice_pairs, "_spconv_tiled_pairs", None)
+    if cache is None:
+        cache = {}
+        indice_pairs._spconv_tiled_pairs = cache
+    key = (int(num_activate_out), int(kernel_volume), bool(inverse))
+    if key not in cache:
+        cache[key] = torch.ops.spconv.tile_indice_pairs(indice_pairs, indice_pair_num,
+                                                        num_activate_out, kernel_volume,
+                                                        int(inverse))
+    return cache[key]
+
+
+def _autocast_disabled(tensor):
+    """the kernels call torch ops which must run in the dtype of the inputs.
+    """
+    return torch.autocast(tensor.device.type, enabled=False)
 
 
 def indice_conv(features,
@@ -105,17 +253,37 @@ def indice_conv(features,
               indice_pair_num,
               num_activate_out,
               inverse=False,
-              subm=False):
+              subm=False,
+              algo=ConvAlgo.Native,
+              bias=None,
+              act=ConvActivation.Identity,
+              act_alpha=0.0):
+    """bias and act are applied to the output inside the op (no gradient),
+    see ConvActivation.
+    """
+    assert features.dtype == filters.dtype, \
+        "features and filters must have the same dtype, see functional.autocast_inputs"
     if filters.dtype == torch.float32:
-        return torch.ops.spconv.indice_conv_fp32(features, filters, indice_pairs,
-                                               indice_pair_num, num_activate_out,
-                                               int(inverse), int(subm))
+        func = torch.ops.spconv.indice_conv_fp32
     elif filters.dtype == torch.half:
-        return torch.ops.spconv.indice_conv_half(features, filters, indice_pairs,
-                                               indice_pair_num, num_activate_out,
-                                               int(inverse), int(subm))
+        func = torch.ops.spconv.indice_conv_half
+    elif filters.dtype == torch.bfloat16:
+        func = torch.ops.spconv.indice_conv_bf16
+    elif filters.dtype == torch.float64:
+        func = torch.ops.spconv.indice_conv_fp64
     else:
         raise NotImplementedError
+    if bias is None:
+        bias = filters.new_empty([0])
+    tiled_pairs = indice_pairs.new_empty([0])
+    if algo == ConvAlgo.OutputStationary:
+        kernel_volume = filters.numel() // (filters.shape[-2] * filters.shape[-1])
+        tiled_pairs = get_tiled_indice_pairs(indice_pairs, indice_pair_num, num_activate_out,
+                                             kernel_volume, inverse)
+    with _autocast_disabled(features):
+        return func(features, filters, indice_pairs, indice_pair_num, num_activate_out,
+                    int(inverse), int(subm), algo, bias, act, float(act_alpha),
+                    get_workspace_buffer(features), tiled_pairs)
 
 
 def indice_conv_backward(features,
@@ -124,15 +292,71 @@ def indice_conv_backward(features,
                        indice_pairs,
                        indice_pair_num,
                        inverse=False,
-                       subm=False):
+                       subm=False,
+                       algo=ConvAlgo.Native,
+                       input_grad=True,
+                       filter_grad=True,
+                       workspace=None):
+    """workspace is the Workspace of the buffers, the workspace of the calling
+    thread by default. the backward functions pass the workspace of the
+    forward, autograd may run them in another thread.
+
+    Returns:
+        input_bp, filters_bp: None if the respective flag is False.
+    """
     if filters.dtype == torch.float32:
-        return torch.ops.spconv.indice_conv_backward_fp32(
-            features, filters, out_bp, indice_pairs, indice_pair_num, int(inverse), int(subm))
+        func = torch.ops.spconv.indice_conv_backward_fp32
     elif filters.dtype == torch.half:
-        return torch.ops.spconv.indice_conv_backward_half(
-            features, filters, out_bp, indice_pairs, indice_pair_num, int(inverse), int(subm))
+        func = torch.ops.spconv.indice_conv_backward_half
+    elif filters.dtype == torch.bfloat16:
+        func = torch.ops.spconv.indice_conv_backward_bf16
+    elif filters.dtype == torch.float64:
+        func = torch.ops.spconv.indice_conv_backward_fp64
     else:
         raise NotImplementedError
+    with _autocast_disabled(features):
+        input_bp, filters_bp = func(features, filters, out_bp, indice_pairs,
+                                    indice_pair_num, int(inverse), int(subm),
+                                    int(input_grad), int(filter_grad), algo,
+                                    get_workspace_buffer(features, workspace))
+    return (input_bp if input_grad else None, filters_bp if filter_grad else None)
+
+
+def indice_conv_int8(features,
+                     filters,
+                     indice_pairs,
+                     indice_pair_num,
+                     num_activate_out,
+                     multiplier,
+                     output_scale,
+                     output_zero_point,
+                     inverse=False,
+                     subm=False,
+                     bias=None,
+                     act=ConvActivation.Identity,
+                     act_alpha=0.0):
+    """cpu only inference conv of torch.quint8 features (per tensor) and int8
+    filters, returns torch.quint8 features of output_scale and
+    output_zero_point:
+
+        out = clamp(round(act(acc * multiplier + bias)) + output_zero_point, 0, 255)
+
+    where acc is the int32 conv of the integer features minus their zero
+    point and filters. multiplier ([out_channels], input_scale * filter_scale /
+    output_scale) and bias (float, already divided by output_scale) are per
+    output channel.
+    """
+    assert features.dtype == torch.quint8 and filters.dtype == torch.int8
+    if bias is None:
+        bias = multiplier.new_empty([0])
+    kernel_volume = filters.numel() // (filters.shape[-2] * filters.shape[-1])
+    tiled_pairs = get_tiled_indice_pairs(indice_pairs, indice_pair_num, num_activate_out,
+                                         kernel_volume, inverse)
+    return torch.ops.spconv.indice_conv_int8(features, filters, indice_pairs,
+                                             indice_pair_num, num_activate_out,
+                                             int(inverse), int(subm), multiplier, bias,
+                                             float(output_scale), int(output_zero_point),
+                                             act, float(act_alpha), tiled_pairs)
 
 
 def indice_maxpool(features, indice_pairs, indice_pair_num, num_activate_out):
@@ -142,6 +366,12 @@ def indice_maxpool(features, indice_pairs, indice_pair_num, num_activate_out):
     elif features.dtype == torch.half:
         return torch.ops.spconv.indice_maxpool_half(features, indice_pairs, indice_pair_num,
                                                   num_activate_out)
+    elif features.dtype == torch.bfloat16:
+        return torch.ops.spconv.indice_maxpool_bf16(features, indice_pairs, indice_pair_num,
+                                                  num_activate_out)
+    elif features.dtype == torch.float64:
+        return torch.ops.spconv.indice_maxpool_fp64(features, indice_pairs, indice_pair_num,
+                                                  num_activate_out)
     else:
         raise NotImplementedError
 
@@ -153,5 +383,11 @@ def indice_maxpool_backward(features, out_features, out_bp, indice_pairs, indice
     elif features.dtype == torch.half:
         return torch.ops.spconv.indice_maxpool_backward_half(
             features, out_features, out_bp, indice_pairs, indice_pair_num)
+    elif features.dtype == torch.bfloat16:
+        return torch.ops.spconv.indice_maxpool_backward_bf16(
+            features, out_features, out_bp, indice_pairs, indice_pair_num)
+    elif features.dtype == torch.float64:
+        return torch.ops.spconv.indice_maxpool_backward_fp64(
+            features, out_features, out_bp, indice_pairs, indice_pair_num)
     else:
         raise NotImplementedError
@@ -0,0 +1,68 @@
+# Copyright 2019 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""space filling curve ordering of active sites. sites which are close in
+space get close indices, so the gathers and scatter-adds driven by the
+indice pairs access features mostly sequentially.
+"""
+
+import torch
+
+ORDERS = (None, "morton")
+
+
+def morton_codes(indices, spatial_shape):
+    """morton (z-order) codes of the spatial part of [N, ndim + 1] indices.
+    """
+    ndim = indices.shape[1] - 1
+    bits = max(int(s) - 1 for s in spatial_shape).bit_length()
+    assert bits * ndim <= 63, "spatial shape is too large for morton codes"
+    coors = indices[:, 1:].long()
+    codes = torch.zeros([indices.shape[0]], dtype=torch.int64, device=indices.device)
+    for b in range(bits):
+        for i in range(ndim):
+            codes |= ((coors[:, i] >> b) & 1) << (b * ndim + ndim - 1 - i)
+    return codes
+
+
+def get_permutation(indices, spatial_shape, order):
+    """permutation which sorts indices by batch and then by order. returns
+    None if order is None.
+    """
+    assert order in ORDERS, "unknown order {}".format(order)
+    if order is None:
+        return None
+    codes = morton_codes(indices, spatial_shape)
+    perm = torch.sort(codes)[1]
+    perm = perm[torch.sort(indices[perm, 0], stable=True)[1]]
+    return perm
+
+
+def invert_permutation(perm):
+    inv = torch.empty_like(perm)
+    inv[perm] = torch.arange(perm.shape[0], dtype=perm.dtype, device=perm.device)
+    return inv
+
+
+def permute_indice_pairs_output(indice_pairs, indice_pair_num, perm):
+    """update compact indice pairs after the output sites are permuted, i.e.
+    new output i is old output perm[i].
+    """
+    inv = invert_permutation(perm).int()
+    num = indice_pair_num.to(indice_pairs.device).long()
+    # the second row of the [2, num[i]] block of each offset holds outputs.
+    is_out = torch.arange(2, device=indice_pairs.device).repeat(num.shape[0])
+    is_out = torch.repeat_interleave(is_out, num.repeat_interleave(2)).bool()
+    res = indice_pairs.clone()
+    res[is_out] = inv[indice_pairs[is_out].long()]
+    return res
@@ -0,0 +1,158 @@
+# Copyright 2019 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import spconv
+from spconv import ops
+from spconv.conv import SparseConvolution
+from spconv.ordering import get_permutation
+from spconv.pool import SparseMaxPool
+
+
+def get_layer_geometries(net):
+    """[(indice_key, geometry, inverse)] of all layers of net which use indice
+    pairs, in registration order. the order must match the forward order.
+    """
+    layers = []
+    for module in net.modules():
+        if isinstance(module, SparseConvolution):
+            if module.conv1x1:
+                continue
+            layers.append((module.indice_key, module.geometry_key(), module.inverse))
+        elif isinstance(module, SparseMaxPool):
+            layers.append((None, module.geometry_key(), False))
+    return layers
+
+
+def get_output_spatial_shape(spatial_shape, geometry):
+    ksize, stride, padding, dilation, out_padding, subm, transposed, half = geometry
+    if subm:
+        return spatial_shape
+    if transposed:
+        return ops.get_deconv_output_size(spatial_shape, ksize, stride, padding,
+                                          dilation, out_padding)
+    return ops.get_conv_output_size(spatial_shape, ksize, stride, padding, dilation)
+
+
+class IndicePairPlanner(object):
+    """network-wide plan of all indice pairs.
+
+    the layers are walked once at construction to derive the coordinate
+    pyramid (the coordinate sets produced by non-submanifold layers) and every
+    distinct (coordinate set, geometry) rulebook, deduplicated in the same way
+    as the forward of the layers. build then generates the whole indice_dict
+    level by level: rulebooks of one level only depend on coordinates of that
+    level, so they are generated concurrently when num_workers > 1.
+
+    Args:
+        net: module or the result of get_layer_geometries.
+    """
+
+    def __init__(self, net):
+        if isinstance(net, (list, tuple)):
+            layers = net
+        else:
+            layers = get_layer_geometries(net)
+        # coordinate sets: [(parent set, geometry, level)], 0 is the input.
+        self.coord_sets = [(None, None, 0)]
+        # rulebooks: [(indice_key, input coordinate set, geometry, output set)].
+        # indice_key is None for automatic keys.
+        self.rulebooks = []
+        coord_set_map = {}
+        keys = {}
+        current = 0
+        for indice_key, geometry, inverse in layers:
+            geometry = tuple(geometry)
+            if inverse:
+                # back to the input coordinates of the couple conv.
+                current = self.rulebooks[keys[indice_key]][1]
+                continue
+            key = indice_key
+            if key is None:
+                key = (current, ) + geometry
+            if key not in keys:
+                subm = geometry[5]
+                out = current
+                if not subm:
+                    out = coord_set_map.get((current, ) + geometry)
+                    if out is None:
+                        out = len(self.coord_sets)
+                        self.coord_sets.append(
+                            (current, geometry, self.coord_sets[current][2] + 1))
+                        coord_set_map[(current, ) + geometry] = out
+                keys[key] = len(self.rulebooks)
+                self.rulebooks.append((indice_key, current, geometry, out))
+            current = self.rulebooks[keys[key]][3]
+        self.num_levels = max(level for _, _, level in self.coord_sets) + 1
+        self.timings = {}
+
+    def build(self, indices, batch_size, spatial_shape, coord_id=None,
+              num_workers=1, order=None):
+        """generate all indice pairs of the plan for indices.
+
+        Args:
+            coord_id: coord_id of the input tensor. a new one is generated if None.
+            num_workers: number of rulebooks of a level generated concurrently.
+            order: order of the input tensor, see SparseConvTensor. indices are
+                permuted as the constructor permutes them and the outputs of
+                non-submanifold layers get the order of the forward.
+
+        Returns:
+            coord_id, indice_dict: arguments for SparseConvTensor, which must
+            be given the same order. the entries of the input coordinate set
+            hold the permuted indices. the time spent on each rulebook (in ms)
+            is kept in timings.
+        """
+        if coord_id is None:
+            coord_id = spconv.new_coord_id()
+        perm = get_permutation(indices, spatial_shape, order)
+        if perm is not None:
+            indices = indices[perm].contiguous()
+        # (indices, spatial_shape, coord_id) of each coordinate set.
+        coords = {0: (indices, spatial_shape, coord_id)}
+        indice_dict = {}
+        self.timings = {}
+
+        def generate(rulebook):
+            indice_key, coord_set, geometry, out = rulebook
+            indices, spatial_shape, coord_id = coords[coord_set]
+            ksize, stride, padding, dilation, out_padding, subm, transposed, half = geometry
+            t = time.time()
+            outids, indice_pairs, indice_pair_num = ops.get_indice_pairs(
+                indices, batch_size, spatial_shape, ksize, stride, padding,
+                dilation, out_padding, subm, transposed, order=order, half=half)
+            if indice_key is None:
+                indice_key = (coord_id, ) + geometry
+            datas = (outids, indices, indice_pairs, indice_pair_num,
+                     spatial_shape, coord_id)
+            return indice_key, datas, (time.time() - t) * 1000
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for level in range(self.num_levels):
+                rulebooks = [
+                    r for r in self.rulebooks if self.coord_sets[r[1]][2] == level
+                ]
+                for rulebook, (indice_key, datas, ms) in zip(
+                        rulebooks, executor.map(generate, rulebooks)):
+                    indice_dict[indice_key] = datas
+                    self.timings[indice_key] = ms
+                    out = rulebook[3]
+                    if out not in coords and out != rulebook[1]:
+                        geometry = rulebook[2]
+                        coords[out] = (datas[0],
+                                       get_output_spatial_shape(datas[4], geometry),
+                                       (datas[5], ) + geometry)
+        return coord_id, indice_dict
@@ -52,6 +52,15 @@ class SparseMaxPool(SparseModule):
         self.subm = subm
         self.dilation = dilation
 
+    def geometry_key(self):
+        """hashable description of everything except the input coordinates
+        that the indice pairs of this layer depend on. equal to the key of a
+        convolution with the same geometry.
+        """
+        ndim = len(self.kernel_size)
+        return (tuple(self.kernel_size), tuple(self.stride), tuple(self.padding),
+                tuple(self.dilation), (0, ) * ndim, self.subm, False, False)
+
     def forward(self, input):
         assert isinstance(input, spconv.SparseConvTensor)
         features = input.features
@@ -64,16 +73,28 @@ class SparseMaxPool(SparseModule):
                 spatial_shape, self.kernel_size, self.stride, self.padding, self.dilation)
         else:
             out_spatial_shape = spatial_shape
-        outids, indice_pairs, indice_pairs_num = ops.get_indice_pairs(
-            indices, batch_size, spatial_shape, self.kernel_size,
-            self.stride, self.padding, self.dilation, 0, self.subm)
-        
+        # same indice pairs as a convolution with equal geometry, so they are
+        # shared with convolutions through the automatic key.
+        indice_key = (input.coord_id, ) + self.geometry_key()
+        datas = input.find_indice_pair(indice_key)
+        if datas is not None:
+            outids, _, indice_pairs, indice_pairs_num, _, _ = datas
+        else:
+            outids, indice_pairs, indice_pairs_num = ops.get_indice_pairs(
+                indices, batch_size, spatial_shape, self.kernel_size,
+                self.stride, self.padding, self.dilation, 0, self.subm,
+                order=input.order)
+            input.indice_dict[indice_key] = (outids, indices, indice_pairs, indice_pairs_num, spatial_shape, input.coord_id)
+        out_coord_id = input.coord_id if self.subm else indice_key
+
         out_features = Fsp.indice_maxpool(features, indice_pairs.to(device),
-                                        indice_pairs_num.to(device), outids.shape[0])
+                                        indice_pairs_num, outids.shape[0])
         out_tensor = spconv.SparseConvTensor(out_features, outids,
-                                             out_spatial_shape, batch_size)
+                                             out_spatial_shape, batch_size,
+                                             coord_id=out_coord_id)
         out_tensor.indice_dict = input.indice_dict
         out_tensor.grid = input.grid
+        out_tensor.order = input.order
         return out_tensor
 
 
@@ -0,0 +1,64 @@
+# Copyright 2019 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""build the indice_dict of a network outside of its forward, e.g. in the
+collate_fn of DataLoader workers, so the main process starts with the conv
+math immediately::
+
+    planner = spconv.IndicePairPlanner(net)
+
+    def collate_fn(samples):
+        ...
+        coord_id, indice_dict = spconv.precompute_indice_dict(
+            indices, batch_size, spatial_shape, planner, order=order)
+        return features, indices, coord_id, indice_dict
+
+    # main process
+    x = spconv.SparseConvTensor(features, indices, spatial_shape, batch_size,
+                                coord_id=coord_id, indice_dict=indice_dict,
+                                order=order)
+    out = net(x)
+"""
+
+from spconv.planner import IndicePairPlanner, get_layer_geometries
+
+
+def precompute_indice_dict(indices, batch_size, spatial_shape, layers,
+                           coord_id=None, order=None):
+    """generate the indice pairs of layers for indices in the same way as the
+    forward of the layers does.
+
+    Args:
+        layers: see get_layer_geometries, or an IndicePairPlanner.
+        coord_id: coord_id of the input tensor. a new one is generated if None.
+        order: order of the input tensor, see IndicePairPlanner.build.
+
+    Returns:
+        coord_id, indice_dict: arguments for SparseConvTensor, which must be
+        given the same order.
+    """
+    if not isinstance(layers, IndicePairPlanner):
+        layers = IndicePairPlanner(layers)
+    return layers.build(indices, batch_size, spatial_shape, coord_id, order=order)
+
+
+def indice_dict_to(indice_dict, device):
+    """move all tensors of indice_dict to device, e.g. after precomputing on
+    cpu for a model on gpu. indice_pair_num stays on cpu.
+    """
+    res = {}
+    for key, datas in indice_dict.items():
+        outids, indices, indice_pairs, indice_pair_num, spatial_shape, coord_id = datas
+        res[key] = (outids.to(device), indices.to(device), indice_pairs.to(device),
+                    indice_pair_num.cpu(), spatial_shape, coord_id)
+    return res
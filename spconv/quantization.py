@@ -0,0 +1,203 @@
+# Copyright 2019 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""post-training int8 quantization of SparseConvolution for cpu inference::
+
+    net = spconv.prepare_quantization(spconv.fuse_modules(net.eval()))
+    with torch.no_grad():
+        for x in calibration_inputs:
+            net(x)
+    net = spconv.convert_quantization(net)
+    with torch.no_grad():
+        out = net(x)
+
+prepare_quantization attaches observers which record the range of the input
+and output features of every conv during calibration. convert_quantization
+replaces the convs by QuantizedSparseConvolution: filters are int8 (symmetric,
+per output channel), features are uint8 (asymmetric, per tensor) and products
+are accumulated in int32, see ops.indice_conv_int8. features passed between
+consecutive quantized convs of a SparseSequential stay quantized (torch.quint8
+tensors), other modules get float features.
+"""
+
+import copy
+
+import spconv
+import torch
+from spconv import ops
+from spconv.conv import SparseConvolution
+from spconv.modules import SparseModule, SparseSequential
+from torch import nn
+from torch.ao.quantization import MinMaxObserver
+
+# attributes of SparseConvolution copied by QuantizedSparseConvolution.
+_CONV_ATTRS = ("ndim", "in_channels", "out_channels", "kernel_size", "conv1x1",
+               "stride", "padding", "dilation", "transposed", "inverse",
+               "output_padding", "groups", "subm", "indice_key", "algo",
+               "half_rulebook", "dense_threshold", "act", "act_alpha")
+
+
+def _observe_input(module, args):
+    features = args[0].features
+    if not features.is_quantized:
+        module.input_observer(features.detach().float())
+
+
+def _observe_output(module, args, output):
+    module.output_observer(output.features.detach().float())
+
+
+def _default_observer():
+    return MinMaxObserver(dtype=torch.quint8, qscheme=torch.per_tensor_affine)
+
+
+def supports_quantization(conv):
+    return isinstance(conv, SparseConvolution) and conv.groups == 1
+
+
+def prepare_quantization(net, inplace=False, observer=None):
+    """attach input and output observers to every SparseConvolution of net
+    which supports quantization (groups == 1). run the returned net on
+    calibration inputs, then call convert_quantization.
+
+    Args:
+        inplace: modify net instead of a copy.
+        observer: function returning a torch.ao.quantization observer of
+            torch.quint8, MinMaxObserver if None.
+    """
+    if observer is None:
+        observer = _default_observer
+    if not inplace:
+        net = copy.deepcopy(net)
+    for module in net.modules():
+        if supports_quantization(module) and not hasattr(module, "output_observer"):
+            module.input_observer = observer()
+            module.output_observer = observer()
+            module.register_forward_pre_hook(_observe_input)
+            module.register_forward_hook(_observe_output)
+    return net
+
+
+def _qparams(observer, name):
+    assert bool(observer.min_val <= observer.max_val), \
+        "{} of a conv wasn't observed, run the prepared net on calibration inputs".format(name)
+    scale, zero_point = observer.calculate_qparams()
+    return float(scale), int(zero_point)
+
+
+class QuantizedSparseConvolution(SparseConvolution):
+    """int8 version of a calibrated SparseConvolution, see
+    convert_quantization. cpu and inference only.
+
+    the input may be float (quantized with the observed input range) or
+    quantized by the previous conv. the output is quantized with the observed
+    output range, and returned as float if dequantize is True.
+    """
+
+    def __init__(self, conv, input_qparams, output_qparams, dequantize=True):
+        SparseModule.__init__(self)
+        assert conv.groups == 1, "quantized conv doesn't support groups"
+        for name in _CONV_ATTRS:
+            setattr(self, name, getattr(conv, name))
+        self.dequantize = dequantize
+        weight = conv.weight.detach().float()
+        # symmetric per output channel, output channels are the last dim.
+        weight_scale = weight.abs().reshape(-1, self.out_channels).amax(0) / 127
+        weight_scale = weight_scale.clamp(min=1e-8)
+        self.register_buffer(
+            "weight", torch.round(weight / weight_scale).clamp(-127, 127).to(torch.int8))
+        self.register_buffer("weight_scale", weight_scale)
+        bias = None
+        if conv.bias is not None:
+            bias = conv.bias.detach().float()
+        self.register_buffer("bias", bias)
+        self.register_buffer("input_scale", torch.tensor(input_qparams[0]))
+        self.register_buffer("input_zero_point", torch.tensor(input_qparams[1]))
+        self.register_buffer("output_scale", torch.tensor(output_qparams[0]))
+        self.register_buffer("output_zero_point", torch.tensor(output_qparams[1]))
+
+    @classmethod
+    def from_float(cls, conv, dequantize=True):
+        """convert a SparseConvolution calibrated by prepare_quantization.
+        """
+        return cls(conv, _qparams(conv.input_observer, "input"),
+                   _qparams(conv.output_observer, "output"), dequantize)
+
+    def forward(self, input):
+        assert isinstance(input, spconv.SparseConvTensor)
+        features = input.features
+        assert features.device.type == "cpu", "quantized conv only supports cpu"
+        if not features.is_quantized:
+            features = torch.quantize_per_tensor(features.float(), float(self.input_scale),
+                                                 int(self.input_zero_point), torch.quint8)
+        output_scale = float(self.output_scale)
+        if self.conv1x1:
+            # every input is its own output.
+            num = features.shape[0]
+            outids = input.indices
+            indice_pairs = torch.arange(num, dtype=torch.int32).repeat(2)
+            indice_pair_num = torch.tensor([num], dtype=torch.int32)
+            out_spatial_shape = input.spatial_shape
+            out_coord_id = input.coord_id
+        else:
+            (outids, indice_pairs, indice_pair_num, out_spatial_shape,
+             out_coord_id) = self.get_indice_pairs(input)
+        multiplier = self.weight_scale * (features.q_scale() / output_scale)
+        bias = None
+        if self.bias is not None:
+            bias = self.bias / output_scale
+        out_features = ops.indice_conv_int8(features, self.weight, indice_pairs.cpu(),
+                                            indice_pair_num, outids.shape[0],
+                                            multiplier, output_scale,
+                                            self.output_zero_point,
+                                            self.inverse and not self.subm, self.subm,
+                                            bias, self.act, self.act_alpha)
+        if self.dequantize:
+            out_features = out_features.dequantize()
+        out_tensor = spconv.SparseConvTensor(out_features, outids,
+                                             out_spatial_shape, input.batch_size,
+                                             coord_id=out_coord_id)
+        out_tensor.indice_dict = input.indice_dict
+        out_tensor.grid = input.grid
+        out_tensor.order = input.order
+        return out_tensor
+
+
+def _set_dequantize(seq):
+    # keep the output quantized if the next module (ignoring the nn.Identity
+    # left by fuse_modules) is a quantized conv.
+    modules = [m for m in seq._modules.values() if not isinstance(m, nn.Identity)]
+    for module, next_module in zip(modules, modules[1:]):
+        if isinstance(module, QuantizedSparseConvolution):
+            module.dequantize = not isinstance(next_module, QuantizedSparseConvolution)
+
+
+def convert_quantization(net, inplace=False):
+    """replace every SparseConvolution of net prepared by prepare_quantization
+    by a QuantizedSparseConvolution. the outputs of the net are float.
+
+    Args:
+        inplace: modify net instead of a copy.
+    """
+    if not inplace:
+        net = copy.deepcopy(net)
+    if hasattr(net, "output_observer"):
+        return QuantizedSparseConvolution.from_float(net)
+    for module in list(net.modules()):
+        for name, child in module._modules.items():
+            if hasattr(child, "output_observer") and supports_quantization(child):
+                module._modules[name] = QuantizedSparseConvolution.from_float(child)
+    for module in net.modules():
+        if isinstance(module, SparseSequential):
+            _set_dequantize(module)
+    return net
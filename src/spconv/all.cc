@@ -22,12 +22,24 @@ TORCH_LIBRARY(spconv, m) {
     m.def("get_indice_pairs_3d", &spconv::getIndicePair<3>);
     m.def("get_indice_pairs_grid_2d", &spconv::getIndicePairPreGrid<2>);
     m.def("get_indice_pairs_grid_3d", &spconv::getIndicePairPreGrid<3>);
+    m.def("get_indice_pairs_hash_2d", &spconv::getIndicePairHash<2>);
+    m.def("get_indice_pairs_hash_3d", &spconv::getIndicePairHash<3>);
+    m.def("tile_indice_pairs", &spconv::tileIndicePairs);
     m.def("indice_conv_fp32", &spconv::indiceConv<float>);
     m.def("indice_conv_backward_fp32", &spconv::indiceConvBackward<float>);
     m.def("indice_conv_half", &spconv::indiceConv<at::Half>);
     m.def("indice_conv_backward_half", &spconv::indiceConvBackward<at::Half>);
+    m.def("indice_conv_bf16", &spconv::indiceConv<at::BFloat16>);
+    m.def("indice_conv_backward_bf16", &spconv::indiceConvBackward<at::BFloat16>);
+    m.def("indice_conv_fp64", &spconv::indiceConv<double>);
+    m.def("indice_conv_backward_fp64", &spconv::indiceConvBackward<double>);
+    m.def("indice_conv_int8", &spconv::indiceConvInt8);
     m.def("indice_maxpool_fp32", &spconv::indiceMaxPool<float>);
     m.def("indice_maxpool_backward_fp32", &spconv::indiceMaxPoolBackward<float>);
     m.def("indice_maxpool_half", &spconv::indiceMaxPool<at::Half>);
     m.def("indice_maxpool_backward_half", &spconv::indiceMaxPoolBackward<at::Half>);
+    m.def("indice_maxpool_bf16", &spconv::indiceMaxPool<at::BFloat16>);
+    m.def("indice_maxpool_backward_bf16", &spconv::indiceMaxPoolBackward<at::BFloat16>);
+    m.def("indice_maxpool_fp64", &spconv::indiceMaxPool<double>);
+    m.def("indice_maxpool_backward_fp64", &spconv::indiceMaxPoolBackward<double>);
 }
@@ -0,0 +1,115 @@
+// Copyright 2019 Yan Yan
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#include <ATen/Parallel.h>
+#include <algorithm>
+#include <spconv/depthwise.h>
+#include <torch/script.h>
+#include <type_traits>
+#include <vector>
+
+namespace spconv
+{
+  namespace functor
+  {
+    template <typename T, typename Index>
+    struct SparseDepthwiseConvFunctor<tv::CPU, T, Index>
+    {
+      void operator()(const tv::CPU &d, tv::TensorView<T> outFeatures,
+                      tv::TensorView<const T> features, tv::TensorView<const T> filter,
+                      tv::TensorView<const Index> indicesIn,
+                      tv::TensorView<const Index> indicesOut, int size)
+      {
+        int64_t numPlanes = features.dim(1);
+        const T *w = filter.data();
+        int64_t grainSize = std::max<int64_t>(1, at::internal::GRAIN_SIZE / numPlanes);
+        // output indices of one kernel offset are unique.
+        at::parallel_for(0, size, grainSize, [&](int64_t begin, int64_t end) {
+          for (int64_t i = begin; i < end; ++i)
+          {
+            const T *__restrict__ in = features.data() + indicesIn[i] * numPlanes;
+            T *__restrict__ out = outFeatures.data() + indicesOut[i] * numPlanes;
+            for (int64_t c = 0; c < numPlanes; ++c)
+            {
+              out[c] += in[c] * w[c];
+            }
+          }
+        });
+      }
+    };
+
+    template <typename T, typename Index>
+    struct SparseDepthwiseFilterGradFunctor<tv::CPU, T, Index>
+    {
+      void operator()(const tv::CPU &d, tv::TensorView<T> filterGrad,
+                      tv::TensorView<const T> features, tv::TensorView<const T> outGrad,
+                      tv::TensorView<const Index> indicesIn,
+                      tv::TensorView<const Index> indicesOut, int size)
+      {
+        int64_t numPlanes = features.dim(1);
+        int64_t grainSize = std::max<int64_t>(1, at::internal::GRAIN_SIZE / numPlanes);
+        // every chunk accumulates into its own buffer, the buffers are summed
+        // in chunk order so the result doesn't depend on scheduling.
+        int64_t numChunks = std::max<int64_t>(
+            1, std::min<int64_t>((size + grainSize - 1) / grainSize, at::get_num_threads()));
+        int64_t chunkSize = (size + numChunks - 1) / numChunks;
+        // half and bfloat16 are accumulated in float.
+        using Acc = typename std::conditional<sizeof(T) == 2, float, T>::type;
+        std::vector<std::vector<Acc>> partials(numChunks);
+        at::parallel_for(0, numChunks, 1, [&](int64_t begin, int64_t end) {
+          for (int64_t chunk = begin; chunk < end; ++chunk)
+          {
+            auto &partial = partials[chunk];
+            partial.assign(numPlanes, 0);
+            int64_t rowEnd = std::min<int64_t>(size, (chunk + 1) * chunkSize);
+            for (int64_t i = chunk * chunkSize; i < rowEnd; ++i)
+            {
+              const T *in = features.data() + indicesIn[i] * numPlanes;
+              const T *g = outGrad.data() + indicesOut[i] * numPlanes;
+              for (int64_t c = 0; c < numPlanes; ++c)
+              {
+                partial[c] += Acc(in[c]) * Acc(g[c]);
+              }
+            }
+          }
+        });
+        T *grad = filterGrad.data();
+        for (auto &partial : partials)
+        {
+          for (int64_t c = 0; c < numPlanes; ++c)
+          {
+            grad[c] = Acc(grad[c]) + partial[c];
+          }
+        }
+      }
+    };
+  } // namespace functor
+
+#define DECLARE_CPU_SPECS_T_INDEX(T, Index)                                    \
+  template struct functor::SparseDepthwiseConvFunctor<tv::CPU, T, Index>; \
+  template struct functor::SparseDepthwiseFilterGradFunctor<tv::CPU, T, Index>;
+
+#define DECLARE_CPU_SPECS(T)         \
+  DECLARE_CPU_SPECS_T_INDEX(T, int); \
+  DECLARE_CPU_SPECS_T_INDEX(T, long);
+
+  DECLARE_CPU_SPECS(float);
+  DECLARE_CPU_SPECS(double);
+  DECLARE_CPU_SPECS(at::Half);
+  DECLARE_CPU_SPECS(at::BFloat16);
+
+#undef DECLARE_CPU_SPECS
+#undef DECLARE_CPU_SPECS_T_INDEX
+
+} // namespace spconv
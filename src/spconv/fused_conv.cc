@@ -0,0 +1,404 @@
+// Copyright 2019 Yan Yan
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#include <ATen/Parallel.h>
+#include <algorithm>
+#include <cstring>
+#include <spconv/fused_conv.h>
+#include <spconv/indice_pairs.h>
+#include <torch/script.h>
+#include <vector>
+
+#if defined(__GNUC__) && defined(__x86_64__)
+#include <immintrin.h>
+#define SPCONV_OUTPUT_STATIONARY_AVX512
+#endif
+
+namespace spconv
+{
+  // pairs are processed in tiles of kFusedTileSize rows: the rows of a tile
+  // are gathered into a small per-thread buffer which stays in cache, multiplied
+  // by the filter and scattered back, so no buffer of the whole kernel offset
+  // is materialized and the tiles of one offset run in parallel.
+  constexpr int64_t kFusedTileSize = 128;
+
+  // products of kernel offsets with fewer pairs than kOutputStationaryMinGemmRows
+  // in a tile are computed by fmaRows where available, a gemm call costs
+  // more. the subm center fills whole tiles and uses the gemm.
+  constexpr int64_t kOutputStationaryMinGemmRows = 64;
+
+  namespace
+  {
+    // out[r] += in[r] * w for rows given by pointers. used by the output
+    // stationary kernel, whose kernel offsets only have a few rows per tile
+    // on sparse inputs. returns false if there is no vectorized version for T
+    // or the cpu, then the caller uses a gemm.
+    template <typename T>
+    bool fmaRows(T *const *outRows, const T *const *inRows, const T *w, int64_t nRows,
+                 int64_t numInPlanes, int64_t numOutPlanes)
+    {
+      return false;
+    }
+
+#ifdef SPCONV_OUTPUT_STATIONARY_AVX512
+    bool hasAvx512()
+    {
+      static bool res = __builtin_cpu_supports("avx512f");
+      return res;
+    }
+
+    // out[r][col:] += in[r] * w[:, col:] for NB (1 to 4) blocks of 16 output
+    // channels, the last block is masked by lastMask. 2 rows of NB blocks are
+    // accumulated in separate variables (not arrays) to stay in registers,
+    // every filter row is loaded once for both.
+    template <int NB>
+    __attribute__((target("avx512f"))) void
+    fmaRowsBlock(float *const *outRows, int64_t col, __mmask16 lastMask,
+                 const float *const *inRows, const float *w, int64_t nRows,
+                 int64_t numInPlanes, int64_t numOutPlanes)
+    {
+      const __mmask16 m0 = NB == 1 ? lastMask : 0xFFFF;
+      const __mmask16 m1 = NB == 2 ? lastMask : 0xFFFF;
+      const __mmask16 m2 = NB == 3 ? lastMask : 0xFFFF;
+      const __mmask16 m3 = NB == 4 ? lastMask : 0xFFFF;
+      for (int64_t r = 0; r < nRows; r += 2)
+      {
+        // an odd last row is computed twice and stored once.
+        bool pair = r + 1 < nRows;
+        const float *x0 = inRows[r];
+        const float *x1 = pair ? inRows[r + 1] : x0;
+        float *o0 = outRows[r] + col;
+        float *o1 = (pair ? outRows[r + 1] : outRows[r]) + col;
+        __m512 zero = _mm512_setzero_ps();
+        __m512 a00 = _mm512_maskz_loadu_ps(m0, o0);
+        __m512 a01 = NB > 1 ? _mm512_maskz_loadu_ps(m1, o0 + 16) : zero;
+        __m512 a02 = NB > 2 ? _mm512_maskz_loadu_ps(m2, o0 + 32) : zero;
+        __m512 a03 = NB > 3 ? _mm512_maskz_loadu_ps(m3, o0 + 48) : zero;
+        __m512 a10 = _mm512_maskz_loadu_ps(m0, o1);
+        __m512 a11 = NB > 1 ? _mm512_maskz_loadu_ps(m1, o1 + 16) : zero;
+        __m512 a12 = NB > 2 ? _mm512_maskz_loadu_ps(m2, o1 + 32) : zero;
+        __m512 a13 = NB > 3 ? _mm512_maskz_loadu_ps(m3, o1 + 48) : zero;
+        const float *wRow = w + col;
+        for (int64_t ci = 0; ci < numInPlanes; ++ci, wRow += numOutPlanes)
+        {
+          __m512 b0 = _mm512_set1_ps(x0[ci]);
+          __m512 b1 = _mm512_set1_ps(x1[ci]);
+          __m512 w0 = _mm512_maskz_loadu_ps(m0, wRow);
+          a00 = _mm512_fmadd_ps(b0, w0, a00);
+          a10 = _mm512_fmadd_ps(b1, w0, a10);
+          if (NB > 1)
+          {
+            __m512 w1 = _mm512_maskz_loadu_ps(m1, wRow + 16);
+            a01 = _mm512_fmadd_ps(b0, w1, a01);
+            a11 = _mm512_fmadd_ps(b1, w1, a11);
+          }
+          if (NB > 2)
+          {
+            __m512 w2 = _mm512_maskz_loadu_ps(m2, wRow + 32);
+            a02 = _mm512_fmadd_ps(b0, w2, a02);
+            a12 = _mm512_fmadd_ps(b1, w2, a12);
+          }
+          if (NB > 3)
+          {
+            __m512 w3 = _mm512_maskz_loadu_ps(m3, wRow + 48);
+            a03 = _mm512_fmadd_ps(b0, w3, a03);
+            a13 = _mm512_fmadd_ps(b1, w3, a13);
+          }
+        }
+        _mm512_mask_storeu_ps(o0, m0, a00);
+        if (NB > 1)
+          _mm512_mask_storeu_ps(o0 + 16, m1, a01);
+        if (NB > 2)
+          _mm512_mask_storeu_ps(o0 + 32, m2, a02);
+        if (NB > 3)
+          _mm512_mask_storeu_ps(o0 + 48, m3, a03);
+        if (pair)
+        {
+          _mm512_mask_storeu_ps(o1, m0, a10);
+          if (NB > 1)
+            _mm512_mask_storeu_ps(o1 + 16, m1, a11);
+          if (NB > 2)
+            _mm512_mask_storeu_ps(o1 + 32, m2, a12);
+          if (NB > 3)
+            _mm512_mask_storeu_ps(o1 + 48, m3, a13);
+        }
+      }
+    }
+
+    template <>
+    bool fmaRows<float>(float *const *outRows, const float *const *inRows, const float *w,
+                        int64_t nRows, int64_t numInPlanes, int64_t numOutPlanes)
+    {
+      if (!hasAvx512())
+      {
+        return false;
+      }
+      // 4 blocks of 16 outputs and 2 rows keep 8 accumulators in registers.
+      int64_t c = 0;
+      for (; c + 64 <= numOutPlanes; c += 64)
+      {
+        fmaRowsBlock<4>(outRows, c, 0xFFFF, inRows, w, nRows, numInPlanes, numOutPlanes);
+      }
+      int64_t rem = numOutPlanes - c;
+      __mmask16 lastMask = rem % 16 == 0 ? 0xFFFF : (1 << (rem % 16)) - 1;
+      switch ((rem + 15) / 16)
+      {
+      case 1:
+        fmaRowsBlock<1>(outRows, c, lastMask, inRows, w, nRows, numInPlanes, numOutPlanes);
+        break;
+      case 2:
+        fmaRowsBlock<2>(outRows, c, lastMask, inRows, w, nRows, numInPlanes, numOutPlanes);
+        break;
+      case 3:
+        fmaRowsBlock<3>(outRows, c, lastMask, inRows, w, nRows, numInPlanes, numOutPlanes);
+        break;
+      case 4:
+        fmaRowsBlock<4>(outRows, c, lastMask, inRows, w, nRows, numInPlanes, numOutPlanes);
+        break;
+      default:
+        break;
+      }
+      return true;
+    }
+#endif
+  } // namespace
+
+  namespace functor
+  {
+    template <typename T, typename Index>
+    struct SparseConvFusedFunctor<tv::CPU, T, Index>
+    {
+      void operator()(const tv::CPU &d, tv::TensorView<T> outFeatures,
+                      tv::TensorView<const T> features, tv::TensorView<const T> filter,
+                      tv::TensorView<const Index> indicesIn,
+                      tv::TensorView<const Index> indicesOut, int size)
+      {
+        int64_t numInPlanes = features.dim(1);
+        int64_t numOutPlanes = outFeatures.dim(1);
+        auto options = torch::TensorOptions().dtype(torch::CppTypeToScalarType<T>::value);
+        auto filterTensor = torch::from_blob(const_cast<T *>(filter.data()),
+                                             {numInPlanes, numOutPlanes}, options);
+        // output indices of one kernel offset are unique, so the tiles don't
+        // write the same rows.
+        at::parallel_for(0, size, kFusedTileSize, [&](int64_t begin, int64_t end) {
+          auto inputBuffer = torch::empty({kFusedTileSize, numInPlanes}, options);
+          auto outputBuffer = torch::empty({kFusedTileSize, numOutPlanes}, options);
+          T *inBuf = inputBuffer.template data_ptr<T>();
+          T *outBuf = outputBuffer.template data_ptr<T>();
+          for (int64_t tile = begin; tile < end; tile += kFusedTileSize)
+          {
+            int64_t nRows = std::min(kFusedTileSize, end - tile);
+            for (int64_t i = 0; i < nRows; ++i)
+            {
+              std::memcpy(inBuf + i * numInPlanes,
+                          features.data() + indicesIn[tile + i] * numInPlanes,
+                          sizeof(T) * numInPlanes);
+            }
+            auto outTile = outputBuffer.narrow(0, 0, nRows);
+            torch::mm_out(outTile, inputBuffer.narrow(0, 0, nRows), filterTensor);
+            for (int64_t i = 0; i < nRows; ++i)
+            {
+              T *out = outFeatures.data() + indicesOut[tile + i] * numOutPlanes;
+              const T *buf = outBuf + i * numOutPlanes;
+              for (int64_t c = 0; c < numOutPlanes; ++c)
+              {
+                out[c] += buf[c];
+              }
+            }
+          }
+        });
+      }
+    };
+
+    template <typename T, typename Index>
+    struct SparseConvFilterGradFusedFunctor<tv::CPU, T, Index>
+    {
+      void operator()(const tv::CPU &d, tv::TensorView<T> filterGrad,
+                      tv::TensorView<const T> features, tv::TensorView<const T> outGrad,
+                      tv::TensorView<const Index> indicesIn,
+                      tv::TensorView<const Index> indicesOut, int size)
+      {
+        int64_t numInPlanes = features.dim(1);
+        int64_t numOutPlanes = outGrad.dim(1);
+        auto options = torch::TensorOptions().dtype(torch::CppTypeToScalarType<T>::value);
+        // every chunk accumulates into its own buffer, the buffers are summed
+        // in chunk order so the result doesn't depend on scheduling.
+        int64_t numChunks = (size + kFusedTileSize - 1) / kFusedTileSize;
+        numChunks = std::max<int64_t>(1, std::min<int64_t>(numChunks, at::get_num_threads()));
+        int64_t chunkSize = (size + numChunks - 1) / numChunks;
+        auto partials = torch::zeros({numChunks, numInPlanes, numOutPlanes}, options);
+        at::parallel_for(0, numChunks, 1, [&](int64_t begin, int64_t end) {
+          auto inputBuffer = torch::empty({kFusedTileSize, numInPlanes}, options);
+          auto gradBuffer = torch::empty({kFusedTileSize, numOutPlanes}, options);
+          T *inBuf = inputBuffer.template data_ptr<T>();
+          T *gradBuf = gradBuffer.template data_ptr<T>();
+          for (int64_t chunk = begin; chunk < end; ++chunk)
+          {
+            auto partial = partials[chunk];
+            int64_t rowEnd = std::min<int64_t>(size, (chunk + 1) * chunkSize);
+            for (int64_t tile = chunk * chunkSize; tile < rowEnd; tile += kFusedTileSize)
+            {
+              int64_t nRows = std::min(kFusedTileSize, rowEnd - tile);
+              for (int64_t i = 0; i < nRows; ++i)
+              {
+                std::memcpy(inBuf + i * numInPlanes,
+                            features.data() + indicesIn[tile + i] * numInPlanes,
+                            sizeof(T) * numInPlanes);
+                std::memcpy(gradBuf + i * numOutPlanes,
+                            outGrad.data() + indicesOut[tile + i] * numOutPlanes,
+                            sizeof(T) * numOutPlanes);
+              }
+              partial.addmm_(inputBuffer.narrow(0, 0, nRows).t(),
+                             gradBuffer.narrow(0, 0, nRows));
+            }
+          }
+        });
+        auto grad = torch::from_blob(filterGrad.data(), {numInPlanes, numOutPlanes}, options);
+        grad.add_(partials.sum(0));
+      }
+    };
+
+    template <typename T, typename Index>
+    struct SparseConvOutputStationaryFunctor<tv::CPU, T, Index>
+    {
+      void operator()(const tv::CPU &d, tv::TensorView<T> outFeatures,
+                      tv::TensorView<const T> features, tv::TensorView<const T> filters,
+                      tv::TensorView<const Index> tileOffsets,
+                      tv::TensorView<const Index> tileIndicesIn,
+                      tv::TensorView<const Index> tileIndicesOut,
+                      tv::TensorView<const T> bias)
+      {
+        int64_t numActOut = outFeatures.dim(0);
+        int64_t numInPlanes = features.dim(1);
+        int64_t numOutPlanes = outFeatures.dim(1);
+        int64_t kernelVolume = int64_t(filters.size()) / (numInPlanes * numOutPlanes);
+        int64_t numTiles = (numActOut + kOutputTileSize - 1) / kOutputTileSize;
+        auto options = torch::TensorOptions().dtype(torch::CppTypeToScalarType<T>::value);
+        auto filterTensor = torch::from_blob(const_cast<T *>(filters.data()),
+                                             {kernelVolume, numInPlanes, numOutPlanes}, options);
+        // every task owns the output rows of its tiles, no synchronization
+        // is needed.
+        at::parallel_for(0, numTiles, 1, [&](int64_t begin, int64_t end) {
+          auto inputBuffer = torch::empty({kOutputTileSize, numInPlanes}, options);
+          auto outputBuffer = torch::empty({kOutputTileSize, numOutPlanes}, options);
+          T *inBuf = inputBuffer.template data_ptr<T>();
+          T *outBuf = outputBuffer.template data_ptr<T>();
+          std::vector<T *> rows(kOutputTileSize);
+          std::vector<const T *> inRows(kOutputTileSize);
+          for (int64_t t = begin; t < end; ++t)
+          {
+            int64_t tile = t * kOutputTileSize;
+            int64_t nRows = std::min(kOutputTileSize, numActOut - tile);
+            T *acc = outFeatures.data() + tile * numOutPlanes;
+            for (int64_t r = 0; r < nRows; ++r)
+            {
+              if (bias.empty())
+              {
+                std::fill(acc + r * numOutPlanes, acc + (r + 1) * numOutPlanes, T(0));
+              }
+              else
+              {
+                std::copy(bias.data(), bias.data() + numOutPlanes, acc + r * numOutPlanes);
+              }
+            }
+            for (int64_t k = 0; k < kernelVolume; ++k)
+            {
+              int64_t first = tileOffsets[t * kernelVolume + k];
+              int64_t n = tileOffsets[t * kernelVolume + k + 1] - first;
+              if (n == 0)
+              {
+                continue;
+              }
+              const Index *in = tileIndicesIn.data() + first;
+              const Index *out = tileIndicesOut.data() + first;
+              for (int64_t i = 0; i < n; ++i)
+              {
+                rows[i] = acc + (out[i] - tile) * numOutPlanes;
+                inRows[i] = features.data() + in[i] * numInPlanes;
+              }
+              if (n < kOutputStationaryMinGemmRows &&
+                  fmaRows<T>(rows.data(), inRows.data(),
+                             filters.data() + k * numInPlanes * numOutPlanes, n,
+                             numInPlanes, numOutPlanes))
+              {
+                continue;
+              }
+              if (n == nRows)
+              {
+                // every output of the tile has this neighbor (e.g. the subm
+                // center): gather in output order and accumulate in place.
+                // the inputs of the subm center are already in order.
+                bool ordered = true;
+                for (int64_t i = 0; i < n && ordered; ++i)
+                {
+                  ordered = out[i] == tile + i && in[i] == in[0] + i;
+                }
+                auto input = inputBuffer.narrow(0, 0, n);
+                if (ordered)
+                {
+                  input = torch::from_blob(const_cast<T *>(inRows[0]), {n, numInPlanes},
+                                           options);
+                }
+                else
+                {
+                  for (int64_t i = 0; i < n; ++i)
+                  {
+                    std::memcpy(inBuf + (out[i] - tile) * numInPlanes, inRows[i],
+                                sizeof(T) * numInPlanes);
+                  }
+                }
+                torch::from_blob(acc, {nRows, numOutPlanes}, options)
+                    .addmm_(input, filterTensor[k]);
+                continue;
+              }
+              for (int64_t i = 0; i < n; ++i)
+              {
+                std::memcpy(inBuf + i * numInPlanes, inRows[i], sizeof(T) * numInPlanes);
+              }
+              auto outTile = outputBuffer.narrow(0, 0, n);
+              torch::mm_out(outTile, inputBuffer.narrow(0, 0, n), filterTensor[k]);
+              for (int64_t i = 0; i < n; ++i)
+              {
+                T *a = rows[i];
+                const T *buf = outBuf + i * numOutPlanes;
+                for (int64_t c = 0; c < numOutPlanes; ++c)
+                {
+                  a[c] += buf[c];
+                }
+              }
+            }
+          }
+        });
+      }
+    };
+  } // namespace functor
+
+#define DECLARE_CPU_SPECS_T_INDEX(T, Index)                                 \
+  template struct functor::SparseConvFusedFunctor<tv::CPU, T, Index>; \
+  template struct functor::SparseConvFilterGradFusedFunctor<tv::CPU, T, Index>; \
+  template struct functor::SparseConvOutputStationaryFunctor<tv::CPU, T, Index>;
+
+#define DECLARE_CPU_SPECS(T)         \
+  DECLARE_CPU_SPECS_T_INDEX(T, int); \
+  DECLARE_CPU_SPECS_T_INDEX(T, long);
+
+  DECLARE_CPU_SPECS(float);
+  DECLARE_CPU_SPECS(double);
+  DECLARE_CPU_SPECS(at::Half);
+  DECLARE_CPU_SPECS(at::BFloat16);
+
+#undef DECLARE_CPU_SPECS
+#undef DECLARE_CPU_SPECS_T_INDEX
+
+} // namespace spconv
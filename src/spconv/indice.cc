@@ -12,24 +12,243 @@
 // See the License for the specific language governing permissions and
 // limitations under the License.
 
+#include <ATen/Parallel.h>
 #include <spconv/geometry.h>
 #include <spconv/indice.h>
 #include <spconv/spconv_ops.h>
 #include <torch/script.h>
+#include <utility>
+#include <vector>
 
 namespace spconv
 {
+  // active sites are split into at most one contiguous chunk per thread. each
+  // chunk collects its indice pairs separately and the chunks are then written
+  // to the rulebook in order (see writeChunkIndicePairs), so the result is
+  // identical to the serial path.
+  constexpr int64_t kIndicePairMinChunkSize = 1024;
+
+  inline int64_t getIndicePairNumChunks(int64_t numActIn)
+  {
+    int64_t numChunks = (numActIn + kIndicePairMinChunkSize - 1) / kIndicePairMinChunkSize;
+    return std::max<int64_t>(1, std::min<int64_t>(numChunks, at::get_num_threads()));
+  }
+
+  template <typename Index, typename IndexGrid>
+  struct DenseGridTable
+  {
+    static constexpr bool kConcurrentSet = true;
+    tv::TensorView<IndexGrid> grid;
+    Index find(int64_t index) const { return grid.data()[index]; }
+    void set(int64_t index, Index value) { grid.data()[index] = value; }
+    std::pair<Index, bool> insert(int64_t index, Index value)
+    {
+      auto &v = grid.data()[index];
+      if (v == -1)
+      {
+        v = value;
+        return {value, true};
+      }
+      return {v, false};
+    }
+  };
+
+  template <typename Index>
+  struct HashGridTable
+  {
+    static constexpr bool kConcurrentSet = false;
+    std::unordered_map<int64_t, Index> &table;
+    Index find(int64_t index) const
+    {
+      auto iter = table.find(index);
+      return iter == table.end() ? Index(-1) : iter->second;
+    }
+    void set(int64_t index, Index value) { table[index] = value; }
+    std::pair<Index, bool> insert(int64_t index, Index value)
+    {
+      auto iter = table.emplace(index, value);
+      return {iter.first->second, iter.second};
+    }
+  };
+
+  template <typename Index, unsigned NDim>
+  int64_t getKernelVolume(const Index *kernelSize)
+  {
+    int64_t kernelVolume = 1;
+    for (int i = 0; i < NDim; ++i)
+    {
+      kernelVolume *= kernelSize[i];
+    }
+    return kernelVolume;
+  }
+
+  template <typename Index, unsigned NDim, typename Table>
+  Index getIndicePairsSubMParallel(tv::TensorView<const Index> indicesIn, Table table,
+                                   std::vector<std::vector<Index>> &chunkPairs,
+                                   const Index *kernelSize, const Index *stride,
+                                   const Index *padding, const Index *dilation,
+                                   const Index *outSpatialShape, bool half = false)
+  {
+    int64_t numActIn = indicesIn.dim(0);
+    auto kernelVolume = getKernelVolume<Index, NDim>(kernelSize);
+    auto indicesData = indicesIn.data();
+    auto setRange = [&](int64_t begin, int64_t end) {
+      for (int64_t j = begin; j < end; ++j)
+      {
+        table.set(getFlatIndex<Index, NDim>(indicesData + j * (NDim + 1) + 1,
+                                            indicesData[j * (NDim + 1)], outSpatialShape),
+                  j);
+      }
+    };
+    if (Table::kConcurrentSet)
+      at::parallel_for(0, numActIn, kIndicePairMinChunkSize, setRange);
+    else
+      setRange(0, numActIn);
+    auto numChunks = getIndicePairNumChunks(numActIn);
+    auto chunkSize = (numActIn + numChunks - 1) / numChunks;
+    chunkPairs.assign(numChunks * kernelVolume, {});
+    at::parallel_for(0, numChunks, 1, [&](int64_t begin, int64_t end) {
+      std::vector<Index> validPoints(kernelVolume * (NDim + 1));
+      for (int64_t c = begin; c < end; ++c)
+      {
+        auto jEnd = std::min(numActIn, (c + 1) * chunkSize);
+        for (int64_t j = c * chunkSize; j < jEnd; ++j)
+        {
+          auto batchIdx = indicesData[j * (NDim + 1)];
+          auto numValidPoints = getValidOutPos<Index, NDim>(
+              indicesData + j * (NDim + 1) + 1, kernelSize, stride, padding,
+              dilation, outSpatialShape, validPoints.data());
+          for (Index i = 0; i < numValidPoints; ++i)
+          {
+            auto pointPtr = validPoints.data() + i * (NDim + 1);
+            // the mirrored offsets of half rulebooks are not stored.
+            if (half && pointPtr[NDim] > kernelVolume / 2)
+            {
+              continue;
+            }
+            auto outIdx = table.find(
+                getFlatIndex<Index, NDim>(pointPtr, batchIdx, outSpatialShape));
+            if (outIdx > -1)
+            {
+              auto &pairs = chunkPairs[c * kernelVolume + pointPtr[NDim]];
+              pairs.push_back(j);
+              pairs.push_back(outIdx);
+            }
+          }
+        }
+      }
+    });
+    return numActIn;
+  }
+
+  // the neighbor search runs in parallel. output ids must be assigned in the
+  // order the serial algorithm discovers them, so that step is serial, but it
+  // is only one table lookup per pair.
+  template <typename Index, unsigned NDim, typename Table>
+  Index getIndicePairsConvParallel(tv::TensorView<const Index> indicesIn,
+                                   std::vector<Index> &indicesOut, Table table,
+                                   std::vector<std::vector<Index>> &chunkPairs,
+                                   const Index *kernelSize, const Index *stride,
+                                   const Index *padding, const Index *dilation,
+                                   const Index *outSpatialShape, bool transpose)
+  {
+    struct OutPoint
+    {
+      Index in;
+      Index offset;
+      int64_t index;
+    };
+    int64_t numActIn = indicesIn.dim(0);
+    auto kernelVolume = getKernelVolume<Index, NDim>(kernelSize);
+    auto indicesData = indicesIn.data();
+    auto numChunks = getIndicePairNumChunks(numActIn);
+    auto chunkSize = (numActIn + numChunks - 1) / numChunks;
+    std::vector<std::vector<OutPoint>> chunkPoints(numChunks);
+    at::parallel_for(0, numChunks, 1, [&](int64_t begin, int64_t end) {
+      std::vector<Index> validPoints(kernelVolume * (NDim + 1));
+      for (int64_t c = begin; c < end; ++c)
+      {
+        auto jEnd = std::min(numActIn, (c + 1) * chunkSize);
+        auto &points = chunkPoints[c];
+        points.reserve((jEnd - c * chunkSize) * kernelVolume);
+        for (int64_t j = c * chunkSize; j < jEnd; ++j)
+        {
+          auto batchIdx = indicesData[j * (NDim + 1)];
+          Index numValidPoints;
+          if (transpose)
+            numValidPoints = getValidOutPosTranspose<Index, NDim>(
+                indicesData + j * (NDim + 1) + 1, kernelSize, stride, padding,
+                dilation, outSpatialShape, validPoints.data());
+          else
+            numValidPoints = getValidOutPos<Index, NDim>(
+                indicesData + j * (NDim + 1) + 1, kernelSize, stride, padding,
+                dilation, outSpatialShape, validPoints.data());
+          for (Index i = 0; i < numValidPoints; ++i)
+          {
+            auto pointPtr = validPoints.data() + i * (NDim + 1);
+            points.push_back(
+                {Index(j), pointPtr[NDim],
+                 getFlatIndex<Index, NDim>(pointPtr, batchIdx, outSpatialShape)});
+          }
+        }
+      }
+    });
+    Index numAct = 0;
+    chunkPairs.assign(numChunks * kernelVolume, {});
+    for (int64_t c = 0; c < numChunks; ++c)
+    {
+      for (auto &point : chunkPoints[c])
+      {
+        auto res = table.insert(point.index, numAct);
+        if (res.second)
+        {
+          indicesOut.resize(indicesOut.size() + NDim + 1);
+          auto out = indicesOut.data() + numAct * (NDim + 1);
+          auto index = point.index;
+          for (int k = NDim; k > 0; --k)
+          {
+            out[k] = index % outSpatialShape[k - 1];
+            index /= outSpatialShape[k - 1];
+          }
+          out[0] = index;
+          ++numAct;
+        }
+        auto &pairs = chunkPairs[c * kernelVolume + point.offset];
+        pairs.push_back(point.in);
+        pairs.push_back(res.first);
+      }
+      std::vector<OutPoint>().swap(chunkPoints[c]);
+    }
+    return numAct;
+  }
+
+  // reset the grid cells of the given sites to -1. only the cells written by
+  // the indice generation are touched, so reusing a pre-allocated grid costs
+  // time proportional to the number of active sites instead of its volume.
+  template <typename Index, typename IndexGrid, unsigned NDim>
+  void resetGridCells(const Index *indices, int64_t numAct,
+                      tv::TensorView<IndexGrid> gridsOut,
+                      const Index *outSpatialShape)
+  {
+    at::parallel_for(0, numAct, kIndicePairMinChunkSize, [&](int64_t begin, int64_t end) {
+      for (int64_t j = begin; j < end; ++j)
+      {
+        auto pos = indices + j * (NDim + 1);
+        gridsOut.data()[getFlatIndex<Index, NDim>(pos + 1, pos[0], outSpatialShape)] = -1;
+      }
+    });
+  }
 
   namespace functor
   {
+    // the serial paths collect the pairs as a single chunk.
     template <typename Index, typename IndexGrid, unsigned NDim>
     struct CreateConvIndicePairFunctor<tv::CPU, Index, IndexGrid, NDim>
     {
       Index operator()(const tv::CPU &d, tv::TensorView<const Index> indicesIn,
-                       tv::TensorView<Index> indicesOut,
+                       std::vector<Index> &indicesOut,
                        tv::TensorView<IndexGrid> gridsOut,
-                       tv::TensorView<Index> indicePairs,
-                       tv::TensorView<Index> indiceNum,
+                       std::vector<std::vector<Index>> &chunkPairs,
                        const tv::SimpleVector<Index, NDim> kernelSize,
                        const tv::SimpleVector<Index, NDim> stride,
                        const tv::SimpleVector<Index, NDim> padding,
@@ -37,18 +256,35 @@ namespace spconv
                        const tv::SimpleVector<Index, NDim> outSpatialShape,
                        bool transpose, bool resetGrid)
       {
-        if (transpose)
-          return getIndicePairsDeConv<Index, IndexGrid, NDim>(
+        Index numAct;
+        if (at::get_num_threads() > 1)
+        {
+          numAct = getIndicePairsConvParallel<Index, NDim>(
               indicesIn, indicesOut,
-              gridsOut, indicePairs, indiceNum,
+              DenseGridTable<Index, IndexGrid>{gridsOut}, chunkPairs,
               kernelSize.data(), stride.data(), padding.data(), dilation.data(),
-              outSpatialShape.data());
+              outSpatialShape.data(), transpose);
+        }
         else
-          return getIndicePairsConv<Index, IndexGrid, NDim>(
-              indicesIn, indicesOut,
-              gridsOut, indicePairs, indiceNum,
-              kernelSize.data(), stride.data(), padding.data(), dilation.data(),
-              outSpatialShape.data());
+        {
+          chunkPairs.assign(getKernelVolume<Index, NDim>(kernelSize.data()), {});
+          if (transpose)
+            numAct = getIndicePairsDeConv<Index, IndexGrid, NDim>(
+                indicesIn, indicesOut,
+                gridsOut, chunkPairs,
+                kernelSize.data(), stride.data(), padding.data(), dilation.data(),
+                outSpatialShape.data());
+          else
+            numAct = getIndicePairsConv<Index, IndexGrid, NDim>(
+                indicesIn, indicesOut,
+                gridsOut, chunkPairs,
+                kernelSize.data(), stride.data(), padding.data(), dilation.data(),
+                outSpatialShape.data());
+        }
+        if (resetGrid)
+          resetGridCells<Index, IndexGrid, NDim>(indicesOut.data(), numAct, gridsOut,
+                                                 outSpatialShape.data());
+        return numAct;
       }
     };
     template <typename Index, typename IndexGrid, unsigned NDim>
@@ -56,19 +292,97 @@ namespace spconv
     {
       Index operator()(const tv::CPU &d, tv::TensorView<const Index> indicesIn,
                        tv::TensorView<IndexGrid> gridsOut,
-                       tv::TensorView<Index> indicePairs,
-                       tv::TensorView<Index> indiceNum,
+                       std::vector<std::vector<Index>> &chunkPairs,
                        const tv::SimpleVector<Index, NDim> kernelSize,
                        const tv::SimpleVector<Index, NDim> stride,
                        const tv::SimpleVector<Index, NDim> padding,
                        const tv::SimpleVector<Index, NDim> dilation,
                        const tv::SimpleVector<Index, NDim> outSpatialShape,
-                       bool transpose, bool resetGrid)
+                       bool transpose, bool resetGrid, bool half)
+      {
+        Index numAct;
+        if (at::get_num_threads() > 1)
+        {
+          numAct = getIndicePairsSubMParallel<Index, NDim>(
+              indicesIn,
+              DenseGridTable<Index, IndexGrid>{gridsOut}, chunkPairs,
+              kernelSize.data(), stride.data(), padding.data(), dilation.data(), outSpatialShape.data(),
+              half);
+        }
+        else
+        {
+          chunkPairs.assign(getKernelVolume<Index, NDim>(kernelSize.data()), {});
+          numAct = getIndicePairsSubM<Index, IndexGrid, NDim>(
+              indicesIn,
+              gridsOut, chunkPairs,
+              kernelSize.data(), stride.data(), padding.data(), dilation.data(), outSpatialShape.data(),
+              half);
+        }
+        if (resetGrid)
+          resetGridCells<Index, IndexGrid, NDim>(indicesIn.data(), indicesIn.dim(0), gridsOut,
+                                                 outSpatialShape.data());
+        return numAct;
+      }
+    };
+    template <typename Index, unsigned NDim>
+    struct CreateConvIndicePairHashFunctor<tv::CPU, Index, NDim>
+    {
+      Index operator()(const tv::CPU &d, tv::TensorView<const Index> indicesIn,
+                       std::vector<Index> &indicesOut,
+                       std::unordered_map<int64_t, Index> &table,
+                       std::vector<std::vector<Index>> &chunkPairs,
+                       const tv::SimpleVector<Index, NDim> kernelSize,
+                       const tv::SimpleVector<Index, NDim> stride,
+                       const tv::SimpleVector<Index, NDim> padding,
+                       const tv::SimpleVector<Index, NDim> dilation,
+                       const tv::SimpleVector<Index, NDim> outSpatialShape,
+                       bool transpose)
+      {
+        if (at::get_num_threads() > 1)
+        {
+          table.reserve(indicesIn.dim(0));
+          return getIndicePairsConvParallel<Index, NDim>(
+              indicesIn, indicesOut,
+              HashGridTable<Index>{table}, chunkPairs,
+              kernelSize.data(), stride.data(), padding.data(), dilation.data(),
+              outSpatialShape.data(), transpose);
+        }
+        chunkPairs.assign(getKernelVolume<Index, NDim>(kernelSize.data()), {});
+        return getIndicePairsConvHash<Index, NDim>(
+            indicesIn, indicesOut,
+            table, chunkPairs,
+            kernelSize.data(), stride.data(), padding.data(), dilation.data(),
+            outSpatialShape.data(), transpose);
+      }
+    };
+    template <typename Index, unsigned NDim>
+    struct CreateSubMIndicePairHashFunctor<tv::CPU, Index, NDim>
+    {
+      Index operator()(const tv::CPU &d, tv::TensorView<const Index> indicesIn,
+                       std::unordered_map<int64_t, Index> &table,
+                       std::vector<std::vector<Index>> &chunkPairs,
+                       const tv::SimpleVector<Index, NDim> kernelSize,
+                       const tv::SimpleVector<Index, NDim> stride,
+                       const tv::SimpleVector<Index, NDim> padding,
+                       const tv::SimpleVector<Index, NDim> dilation,
+                       const tv::SimpleVector<Index, NDim> outSpatialShape,
+                       bool transpose, bool half)
       {
-        return getIndicePairsSubM<Index, IndexGrid, NDim>(
+        if (at::get_num_threads() > 1)
+        {
+          table.reserve(indicesIn.dim(0));
+          return getIndicePairsSubMParallel<Index, NDim>(
+              indicesIn,
+              HashGridTable<Index>{table}, chunkPairs,
+              kernelSize.data(), stride.data(), padding.data(), dilation.data(), outSpatialShape.data(),
+              half);
+        }
+        chunkPairs.assign(getKernelVolume<Index, NDim>(kernelSize.data()), {});
+        return getIndicePairsSubMHash<Index, NDim>(
             indicesIn,
-            gridsOut, indicePairs, indiceNum,
-            kernelSize.data(), stride.data(), padding.data(), dilation.data(), outSpatialShape.data());
+            table, chunkPairs,
+            kernelSize.data(), stride.data(), padding.data(), dilation.data(), outSpatialShape.data(),
+            half);
       }
     };
   } // namespace functor
@@ -76,7 +390,9 @@ namespace spconv
 #define DECLARE_CPU_SPECS_INDEX_NDIM(Index, NDIM)                                  \
   template struct functor::CreateConvIndicePairFunctor<tv::CPU, Index, int, NDIM>; \
   template struct functor::CreateSubMIndicePairFunctor<tv::CPU, Index, int,        \
-                                                       NDIM>;
+                                                       NDIM>;                      \
+  template struct functor::CreateConvIndicePairHashFunctor<tv::CPU, Index, NDIM>;  \
+  template struct functor::CreateSubMIndicePairHashFunctor<tv::CPU, Index, NDIM>;
 
 #define DECLARE_CPU_INDEX(Index)          \
   DECLARE_CPU_SPECS_INDEX_NDIM(Index, 1); \
@@ -83,6 +83,7 @@ namespace spconv
   DECLARE_CPU_SPECS(float);
   DECLARE_CPU_SPECS(double);
   DECLARE_CPU_SPECS(at::Half);
+  DECLARE_CPU_SPECS(at::BFloat16);
 
 #undef DECLARE_CPU_SPECS
 #undef DECLARE_CPU_SPECS_T_INDEX
@@ -0,0 +1,357 @@
+// Copyright 2019 Yan Yan
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#include <ATen/Parallel.h>
+#include <algorithm>
+#include <cstring>
+#include <spconv/indice_pairs.h>
+#include <spconv/quantized_conv.h>
+#include <torch/script.h>
+#include <vector>
+
+#if defined(__GNUC__) && defined(__x86_64__)
+#include <immintrin.h>
+#define SPCONV_INT8_VNNI
+#endif
+
+namespace spconv
+{
+  // outputs are processed in the tiles of kOutputTileSize rows of the tiled
+  // rulebook: the int32 accumulators of a tile stay in cache for all kernel
+  // offsets and are requantized to uint8 at the end, so no [numActOut,
+  // numOutPlanes] int32 buffer is written to memory.
+  constexpr float kRoundMagic = 12582912.0f;
+
+  namespace
+  {
+#ifdef SPCONV_INT8_VNNI
+    bool hasVnni()
+    {
+      static bool res = __builtin_cpu_supports("avx512vnni");
+      return res;
+    }
+
+    __attribute__((target("avx512f,avx512bw,avx512vnni"))) inline void
+    addStore(int32_t *out, __m512i acc, __m512i corr)
+    {
+      _mm512_storeu_si512(out, _mm512_add_epi32(_mm512_loadu_si512(out),
+                                                _mm512_sub_epi32(acc, corr)));
+    }
+
+    // out[r][col:] += in[r] * w - corr for NB (1 to 4) blocks of 16 output
+    // channels. in rows have k4 groups of 4 uint8, w is packed as
+    // [k4][numOutPlanes][4] int8 so vpdpbusd multiplies 4 input channels of
+    // 16 outputs per instruction. 2 rows of NB blocks are accumulated in
+    // separate variables (not arrays) to stay in registers.
+    template <int NB>
+    __attribute__((target("avx512f,avx512bw,avx512vnni"))) void
+    gemmVnniBlock(int32_t *const *outRows, int64_t col, const uint8_t *const *inRows,
+                  const int8_t *w, const int32_t *corr, int64_t nRows, int64_t k4,
+                  int64_t numOutPlanes)
+    {
+      __m512i zero = _mm512_setzero_si512();
+      __m512i c0 = _mm512_loadu_si512(corr);
+      __m512i c1 = NB > 1 ? _mm512_loadu_si512(corr + 16) : zero;
+      __m512i c2 = NB > 2 ? _mm512_loadu_si512(corr + 32) : zero;
+      __m512i c3 = NB > 3 ? _mm512_loadu_si512(corr + 48) : zero;
+      int64_t wStride = numOutPlanes * 4;
+      for (int64_t r = 0; r < nRows; r += 2)
+      {
+        // an odd last row is computed twice and stored once.
+        bool pair = r + 1 < nRows;
+        const uint8_t *x0 = inRows[r];
+        const uint8_t *x1 = pair ? inRows[r + 1] : x0;
+        __m512i a00 = zero, a01 = zero, a02 = zero, a03 = zero;
+        __m512i a10 = zero, a11 = zero, a12 = zero, a13 = zero;
+        const int8_t *wk = w;
+        for (int64_t k = 0; k < k4; ++k, wk += wStride)
+        {
+          int32_t v0, v1;
+          std::memcpy(&v0, x0 + 4 * k, 4);
+          std::memcpy(&v1, x1 + 4 * k, 4);
+          __m512i b0 = _mm512_set1_epi32(v0);
+          __m512i b1 = _mm512_set1_epi32(v1);
+          __m512i w0 = _mm512_loadu_si512(wk);
+          a00 = _mm512_dpbusd_epi32(a00, b0, w0);
+          a10 = _mm512_dpbusd_epi32(a10, b1, w0);
+          if (NB > 1)
+          {
+            __m512i w1 = _mm512_loadu_si512(wk + 64);
+            a01 = _mm512_dpbusd_epi32(a01, b0, w1);
+            a11 = _mm512_dpbusd_epi32(a11, b1, w1);
+          }
+          if (NB > 2)
+          {
+            __m512i w2 = _mm512_loadu_si512(wk + 128);
+            a02 = _mm512_dpbusd_epi32(a02, b0, w2);
+            a12 = _mm512_dpbusd_epi32(a12, b1, w2);
+          }
+          if (NB > 3)
+          {
+            __m512i w3 = _mm512_loadu_si512(wk + 192);
+            a03 = _mm512_dpbusd_epi32(a03, b0, w3);
+            a13 = _mm512_dpbusd_epi32(a13, b1, w3);
+          }
+        }
+        int32_t *o0 = outRows[r] + col;
+        addStore(o0, a00, c0);
+        if (NB > 1)
+          addStore(o0 + 16, a01, c1);
+        if (NB > 2)
+          addStore(o0 + 32, a02, c2);
+        if (NB > 3)
+          addStore(o0 + 48, a03, c3);
+        if (pair)
+        {
+          int32_t *o1 = outRows[r + 1] + col;
+          addStore(o1, a10, c0);
+          if (NB > 1)
+            addStore(o1 + 16, a11, c1);
+          if (NB > 2)
+            addStore(o1 + 32, a12, c2);
+          if (NB > 3)
+            addStore(o1 + 48, a13, c3);
+        }
+      }
+    }
+
+    void gemmVnni(int32_t *const *outRows, const uint8_t *const *inRows, const int8_t *w,
+                  const int32_t *corr, int64_t nRows, int64_t k4, int64_t numOutPlanes)
+    {
+      // 4 blocks of 16 outputs and 2 rows keep 8 accumulators in registers.
+      int64_t c = 0;
+      for (; c + 64 <= numOutPlanes; c += 64)
+      {
+        gemmVnniBlock<4>(outRows, c, inRows, w + c * 4, corr + c, nRows, k4,
+                         numOutPlanes);
+      }
+      switch ((numOutPlanes - c) / 16)
+      {
+      case 1:
+        gemmVnniBlock<1>(outRows, c, inRows, w + c * 4, corr + c, nRows, k4,
+                         numOutPlanes);
+        break;
+      case 2:
+        gemmVnniBlock<2>(outRows, c, inRows, w + c * 4, corr + c, nRows, k4,
+                         numOutPlanes);
+        break;
+      case 3:
+        gemmVnniBlock<3>(outRows, c, inRows, w + c * 4, corr + c, nRows, k4,
+                         numOutPlanes);
+        break;
+      default:
+        break;
+      }
+    }
+
+    // requantize for numOutPlanes % 16 == 0, _mm512_cvtps_epi32 rounds half
+    // to even like std::nearbyint.
+    __attribute__((target("avx512f,avx512bw,avx512vnni"))) void
+    requantizeAvx512(uint8_t *out, const int32_t *acc, const float *m, const float *b,
+                     int64_t nRows, int64_t numOutPlanes, int outputZeroPoint,
+                     float negativeSlope)
+    {
+      __m512 slope = _mm512_set1_ps(negativeSlope);
+      __m512i zero = _mm512_setzero_si512();
+      __m512i zp = _mm512_set1_epi32(outputZeroPoint);
+      for (int64_t i = 0; i < nRows; ++i)
+      {
+        for (int64_t c = 0; c < numOutPlanes; c += 16)
+        {
+          __m512 y = _mm512_fmadd_ps(_mm512_cvtepi32_ps(_mm512_loadu_si512(acc + c)),
+                                     _mm512_loadu_ps(m + c), _mm512_loadu_ps(b + c));
+          y = _mm512_mask_mul_ps(y, _mm512_cmp_ps_mask(y, _mm512_setzero_ps(), _CMP_LT_OQ),
+                                 y, slope);
+          __m512i q = _mm512_add_epi32(_mm512_cvtps_epi32(y), zp);
+          // negative values are clamped here, values above 255 saturate in
+          // the unsigned narrowing.
+          _mm_storeu_si128(reinterpret_cast<__m128i *>(out + c),
+                           _mm512_cvtusepi32_epi8(_mm512_max_epi32(q, zero)));
+        }
+        acc += numOutPlanes;
+        out += numOutPlanes;
+      }
+    }
+#endif
+
+    // out = clamp(round(act(acc * m + b)) + outputZeroPoint, 0, 255) for nRows
+    // rows, see SparseConvInt8Functor.
+    void requantize(uint8_t *out, const int32_t *acc, const float *m, const float *b,
+                    int64_t nRows, int64_t numOutPlanes, int outputZeroPoint,
+                    float negativeSlope)
+    {
+#ifdef SPCONV_INT8_VNNI
+      if (hasVnni() && numOutPlanes % 16 == 0)
+      {
+        requantizeAvx512(out, acc, m, b, nRows, numOutPlanes, outputZeroPoint,
+                         negativeSlope);
+        return;
+      }
+#endif
+      for (int64_t i = 0; i < nRows * numOutPlanes; i += numOutPlanes)
+      {
+        for (int64_t c = 0; c < numOutPlanes; ++c)
+        {
+          float y = acc[i + c] * m[c] + b[c];
+          y = std::max(y, 0.0f) + std::min(y, 0.0f) * negativeSlope;
+          // round half to even like std::nearbyint, but vectorizable:
+          // adding 1.5 * 2^23 drops the fraction of |y| < 2^22.
+          y = std::min(std::max(y, -512.0f), 512.0f);
+          y = (y + kRoundMagic) - kRoundMagic + outputZeroPoint;
+          out[i + c] = uint8_t(std::min(std::max(y, 0.0f), 255.0f));
+        }
+      }
+    }
+  } // namespace
+
+  namespace functor
+  {
+    template <typename Index>
+    struct SparseConvInt8Functor<tv::CPU, Index>
+    {
+      void operator()(const tv::CPU &d, tv::TensorView<uint8_t> outFeatures,
+                      tv::TensorView<const uint8_t> features,
+                      tv::TensorView<const int8_t> filters, int inputZeroPoint,
+                      tv::TensorView<const Index> tileOffsets,
+                      tv::TensorView<const Index> tileIndicesIn,
+                      tv::TensorView<const Index> tileIndicesOut,
+                      tv::TensorView<const float> multiplier,
+                      tv::TensorView<const float> bias, int outputZeroPoint,
+                      float negativeSlope)
+      {
+        int64_t numActOut = outFeatures.dim(0);
+        int64_t kernelVolume = filters.dim(0);
+        int64_t numInPlanes = features.dim(1);
+        int64_t numOutPlanes = outFeatures.dim(1);
+        int64_t filterSize = numInPlanes * numOutPlanes;
+        int64_t numTiles = (numActOut + kOutputTileSize - 1) / kOutputTileSize;
+        std::vector<float> b(numOutPlanes, 0.0f);
+        if (!bias.empty())
+        {
+          std::copy(bias.data(), bias.data() + numOutPlanes, b.begin());
+        }
+        bool vnni = false;
+#ifdef SPCONV_INT8_VNNI
+        vnni = hasVnni() && numOutPlanes % 16 == 0;
+#endif
+        // the vnni kernel reads the filters packed for vpdpbusd, input
+        // channels are padded to a multiple of 4 with zeros. the zero point
+        // is removed by subtracting inputZeroPoint * sum of the filter column.
+        int64_t k4 = (numInPlanes + 3) / 4;
+        int64_t inStride = k4 * 4;
+        int64_t packedSize = k4 * numOutPlanes * 4;
+        std::vector<int8_t> packed;
+        std::vector<int32_t> corr;
+        if (vnni)
+        {
+          packed.assign(kernelVolume * packedSize, 0);
+          corr.assign(kernelVolume * numOutPlanes, 0);
+          for (int64_t k = 0; k < kernelVolume; ++k)
+          {
+            const int8_t *w = filters.data() + k * filterSize;
+            int8_t *p = packed.data() + k * packedSize;
+            int32_t *cs = corr.data() + k * numOutPlanes;
+            for (int64_t ci = 0; ci < numInPlanes; ++ci)
+            {
+              for (int64_t c = 0; c < numOutPlanes; ++c)
+              {
+                p[((ci / 4) * numOutPlanes + c) * 4 + ci % 4] = w[ci * numOutPlanes + c];
+                cs[c] += w[ci * numOutPlanes + c];
+              }
+            }
+            for (int64_t c = 0; c < numOutPlanes; ++c)
+            {
+              cs[c] *= inputZeroPoint;
+            }
+          }
+        }
+        // every task owns its output tiles, no synchronization is needed.
+        at::parallel_for(0, numTiles, 1, [&](int64_t begin, int64_t end) {
+          std::vector<int32_t> acc(kOutputTileSize * numOutPlanes);
+          bool padded = vnni && numInPlanes != inStride;
+          std::vector<uint8_t> inBuf(padded ? kOutputTileSize * inStride : 0, 0);
+          std::vector<int32_t *> rows(kOutputTileSize);
+          std::vector<const uint8_t *> inRows(kOutputTileSize);
+          for (int64_t t = begin; t < end; ++t)
+          {
+            int64_t tile = t * kOutputTileSize;
+            int64_t nRows = std::min(kOutputTileSize, numActOut - tile);
+            std::fill(acc.begin(), acc.begin() + nRows * numOutPlanes, 0);
+            for (int64_t k = 0; k < kernelVolume; ++k)
+            {
+              int64_t first = tileOffsets[t * kernelVolume + k];
+              int64_t n = tileOffsets[t * kernelVolume + k + 1] - first;
+              if (n == 0)
+              {
+                continue;
+              }
+              const Index *in = tileIndicesIn.data() + first;
+              const Index *out = tileIndicesOut.data() + first;
+              if (!vnni)
+              {
+                const int8_t *w = filters.data() + k * filterSize;
+                for (int64_t i = 0; i < n; ++i)
+                {
+                  const uint8_t *x = features.data() + in[i] * numInPlanes;
+                  int32_t *__restrict__ a = acc.data() + (out[i] - tile) * numOutPlanes;
+                  for (int64_t ci = 0; ci < numInPlanes; ++ci)
+                  {
+                    int32_t v = int32_t(x[ci]) - inputZeroPoint;
+                    const int8_t *__restrict__ wRow = w + ci * numOutPlanes;
+                    for (int64_t c = 0; c < numOutPlanes; ++c)
+                    {
+                      a[c] += v * wRow[c];
+                    }
+                  }
+                }
+                continue;
+              }
+#ifdef SPCONV_INT8_VNNI
+              // inputs are read in place unless numInPlanes isn't a multiple
+              // of 4, then they are copied to zero padded rows.
+              for (int64_t i = 0; i < n; ++i)
+              {
+                rows[i] = acc.data() + (out[i] - tile) * numOutPlanes;
+                inRows[i] = features.data() + in[i] * numInPlanes;
+              }
+              if (padded)
+              {
+                for (int64_t i = 0; i < n; ++i)
+                {
+                  std::memcpy(inBuf.data() + i * inStride, inRows[i], numInPlanes);
+                  inRows[i] = inBuf.data() + i * inStride;
+                }
+              }
+              gemmVnni(rows.data(), inRows.data(), packed.data() + k * packedSize,
+                       corr.data() + k * numOutPlanes, n, k4, numOutPlanes);
+#endif
+            }
+            requantize(outFeatures.data() + tile * numOutPlanes, acc.data(),
+                       multiplier.data(), b.data(), nRows, numOutPlanes, outputZeroPoint,
+                       negativeSlope);
+          }
+        });
+      }
+    };
+  } // namespace functor
+
+#define DECLARE_CPU_SPECS_INDEX(Index) \
+  template struct functor::SparseConvInt8Functor<tv::CPU, Index>;
+
+  DECLARE_CPU_SPECS_INDEX(int);
+  DECLARE_CPU_SPECS_INDEX(long);
+
+#undef DECLARE_CPU_SPECS_INDEX
+
+} // namespace spconv
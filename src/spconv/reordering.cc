@@ -12,6 +12,9 @@
 // See the License for the specific language governing permissions and
 // limitations under the License.
 
+#include <ATen/Parallel.h>
+#include <algorithm>
+#include <cstring>
 #include <spconv/reordering.h>
 #include <torch/script.h>
 
@@ -19,6 +22,13 @@ namespace spconv
 {
   namespace functor
   {
+    // rows per task of the parallel loops, so every task copies at least
+    // GRAIN_SIZE elements.
+    inline int64_t getReorderGrainSize(int64_t numPlanes)
+    {
+      return std::max<int64_t>(1, at::internal::GRAIN_SIZE / std::max<int64_t>(1, numPlanes));
+    }
+
     template <typename T, typename Index>
     struct SparseGatherFunctor<tv::CPU, T, Index>
     {
@@ -26,12 +36,14 @@ namespace spconv
                       tv::TensorView<const Index> indices, int size)
       {
         int numPlanes = features.dim(1);
-        for (int i = 0; i < size; ++i)
-        {
-          std::memcpy(buffer.data() + i * numPlanes,
-                      features.data() + indices[i] * numPlanes,
-                      sizeof(T) * numPlanes);
-        }
+        at::parallel_for(0, size, getReorderGrainSize(numPlanes), [&](int64_t begin, int64_t end) {
+          for (int64_t i = begin; i < end; ++i)
+          {
+            std::memcpy(buffer.data() + i * numPlanes,
+                        features.data() + indices[i] * numPlanes,
+                        sizeof(T) * numPlanes);
+          }
+        });
       }
     };
 
@@ -43,17 +55,19 @@ namespace spconv
                       int size, bool stable)
       {
         int numPlanes = outFeatures.dim(1);
-        const T *buf = buffer.data();
-        T *out = outFeatures.data();
-        for (int i = 0; i < size; ++i)
-        {
-          buf = buffer.data() + i * numPlanes;
-          out = outFeatures.data() + indices[i] * numPlanes;
-          for (int j = 0; j < numPlanes; ++j)
+        // indices are unique (one kernel offset maps every output at most
+        // once), so the rows of different tasks never overlap.
+        at::parallel_for(0, size, getReorderGrainSize(numPlanes), [&](int64_t begin, int64_t end) {
+          for (int64_t i = begin; i < end; ++i)
           {
-            out[j] += buf[j];
+            const T *__restrict__ buf = buffer.data() + i * numPlanes;
+            T *__restrict__ out = outFeatures.data() + indices[i] * numPlanes;
+            for (int j = 0; j < numPlanes; ++j)
+            {
+              out[j] += buf[j];
+            }
           }
-        }
+        });
       }
     };
 
@@ -70,6 +84,7 @@ namespace spconv
   DECLARE_CPU_SPECS(float);
   DECLARE_CPU_SPECS(double);
   DECLARE_CPU_SPECS(at::Half);
+  DECLARE_CPU_SPECS(at::BFloat16);
 
 #undef DECLARE_CPU_SPECS
 #undef DECLARE_CPU_SPECS_T_INDEX
@@ -32,7 +32,7 @@ namespace spconv
     struct SparseGatherFunctor<tv::GPU, T, Index>
     {
       using vecload_type_t =
-          std::conditional_t<std::is_same<T, at::Half>::value, int2, int4>;
+          std::conditional_t<sizeof(T) == 2, int2, int4>;
       using kernel_block_t = mp_list_c<int, 64, 32, 16>;
       void operator()(const tv::GPU &d, tv::TensorView<T> buffer,
                       tv::TensorView<const T> features,
@@ -90,7 +90,7 @@ namespace spconv
     struct SparseScatterAddFunctor<tv::GPU, T, Index>
     {
       using vecload_type_t =
-          std::conditional_t<std::is_same<T, at::Half>::value, int2, int4>;
+          std::conditional_t<sizeof(T) == 2, int2, int4>;
       using kernel_block_t = mp_list_c<int, 64, 32, 16>;
       void operator()(const tv::GPU &d, tv::TensorView<T> outFeatures,
                       tv::TensorView<const T> buffer,
@@ -156,6 +156,7 @@ namespace spconv
   DECLARE_GPU_SPECS(float);
   DECLARE_GPU_SPECS(double);
   DECLARE_GPU_SPECS(at::Half);
+  DECLARE_GPU_SPECS(at::BFloat16);
 
 #undef DECLARE_GPU_SPECS
 #undef DECLARE_GPU_SPECS_T_INDEX
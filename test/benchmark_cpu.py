@@ -0,0 +1,348 @@
+# Copyright 2019 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""cpu benchmarks of spconv ops.
+
+usage: python test/benchmark_cpu.py BENCHMARK [--num_points N] [--batch_size B]
+[--num_threads T]. BENCHMARK is a key of BENCHMARKS, --help lists them.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import spconv
+import torch
+
+
+def random_indices(shape, num_points, batch_size):
+    """[batch_size * num_points, ndim + 1] unique int32 indices, batch first.
+    """
+    res = []
+    volume = int(np.prod(shape))
+    for i in range(batch_size):
+        flat = np.unique(np.random.randint(0, volume, size=[num_points * 2]))
+        flat = np.random.permutation(flat)[:num_points]
+        coors = np.stack(np.unravel_index(flat, shape), axis=1)
+        res.append(np.pad(coors, ((0, 0), (1, 0)), mode="constant", constant_values=i))
+    return torch.from_numpy(np.concatenate(res).astype(np.int32))
+
+
+def timeit(func, repeat=10):
+    """mean time of func in ms.
+    """
+    func()
+    t = time.time()
+    for _ in range(repeat):
+        func()
+    return (time.time() - t) / repeat * 1000
+
+
+def bench_grid_reset(args):
+    shapes = [[32, 32, 32], [64, 64, 64], [128, 128, 128], [41, 800, 704]]
+    bs = args.batch_size
+    print("{:>16} {:>12} {:>16} {:>16}".format(
+        "shape", "no grid(ms)", "pre-grid(ms)", "full reset(ms)"))
+    for shape in shapes:
+        indices = random_indices(shape, args.num_points, bs)
+        grid = torch.full([bs * int(np.prod(shape))], -1, dtype=torch.int32)
+        get_pairs = lambda grid: spconv.ops.get_indice_pairs(
+            indices, bs, shape, 3, 1, subm=True, grid=grid)
+
+        def full_reset():
+            # cost of the previous implementation which reset the whole grid
+            get_pairs(grid)
+            grid.fill_(-1)
+
+        print("{:>16} {:>12.3f} {:>16.3f} {:>16.3f}".format(
+            "x".join(map(str, shape)), timeit(lambda: get_pairs(None)),
+            timeit(lambda: get_pairs(grid)), timeit(full_reset)))
+
+
+def bench_order(args):
+    shape = [41, 400, 352]
+    bs = args.batch_size
+    channels = 64
+    indices = random_indices(shape, args.num_points, bs)
+    features = torch.randn(indices.shape[0], channels)
+    weight = torch.randn(3, 3, 3, channels, channels)
+    print("{:>8} {:>6} {:>12}".format("order", "subm", "conv(ms)"))
+    for order, subm in [(None, True), ("morton", True), (None, False), ("morton", False)]:
+        x = spconv.SparseConvTensor(features, indices, shape, bs, order=order)
+        outids, indice_pairs, indice_pair_num = spconv.ops.get_indice_pairs(
+            x.indices, bs, shape, 3, 1 if subm else 2, subm=subm, order=order)
+        run = lambda: spconv.ops.indice_conv(x.features, weight, indice_pairs,
+                                             indice_pair_num, outids.shape[0],
+                                             False, subm)
+        print("{:>8} {:>6} {:>12.3f}".format(str(order), str(subm), timeit(run)))
+
+
+def bench_algo(args):
+    shape = [41, 400, 352]
+    bs = args.batch_size
+    indices = random_indices(shape, args.num_points, bs)
+    algos = [spconv.ConvAlgo.Native, spconv.ConvAlgo.Fused, spconv.ConvAlgo.Batch,
+             spconv.ConvAlgo.OutputStationary]
+    print("{:>8} {:>6} {:>36} {:>36}".format(
+        "channels", "subm", "forward native/fused/batch/os(ms)",
+        "backward native/fused/batch(ms)"))
+    for channels, subm in [(4, True), (16, True), (64, True), (128, True), (16, False),
+                           (64, False)]:
+        features = torch.randn(indices.shape[0], channels)
+        weight = torch.randn(3, 3, 3, channels, channels)
+        outids, indice_pairs, indice_pair_num = spconv.ops.get_indice_pairs(
+            indices, bs, shape, 3, 1 if subm else 2, subm=subm)
+        out_bp = torch.randn(outids.shape[0], channels)
+        res = []
+        for algo in algos:
+            res.append(timeit(lambda: spconv.ops.indice_conv(
+                features, weight, indice_pairs, indice_pair_num, outids.shape[0],
+                False, subm, algo)))
+        for algo in algos[:3]:
+            res.append(timeit(lambda: spconv.ops.indice_conv_backward(
+                features, weight, out_bp, indice_pairs, indice_pair_num, False,
+                subm, algo)))
+        print("{:>8} {:>6} {:>36} {:>36}".format(
+            channels, str(subm), "/".join("{:.3f}".format(t) for t in res[:4]),
+            "/".join("{:.3f}".format(t) for t in res[4:])))
+
+
+def bench_autocast(args):
+    # training step of subm blocks with and without cpu autocast (bfloat16).
+    shape = [41, 400, 352]
+    bs = args.batch_size
+    indices = random_indices(shape, args.num_points, bs)
+    print("{:>8} {:>10} {:>12} {:>16}".format(
+        "channels", "autocast", "step(ms)", "features(MB)"))
+    for channels in [32, 64]:
+        net = spconv.SparseSequential(*[
+            spconv.SubMConv3d(channels, channels, 3, bias=False, indice_key="subm0")
+            for _ in range(4)
+        ])
+        features = torch.randn(indices.shape[0], channels)
+        for autocast in [False, True]:
+            x = spconv.SparseConvTensor(features, indices, shape, bs)
+            outputs = []
+
+            def step():
+                with torch.autocast("cpu", dtype=torch.bfloat16, enabled=autocast):
+                    out = net(x)
+                out.features.float().sum().backward()
+                outputs[:] = [out.features]
+
+            t = timeit(step)
+            nbytes = outputs[0].numel() * outputs[0].element_size()
+            print("{:>8} {:>10} {:>12.3f} {:>16.2f}".format(
+                channels, str(autocast), t, nbytes / 2**20))
+
+
+def bench_dense(args):
+    # sparse and dense subm conv for increasing occupancy of a bev sized grid.
+    shape = [8, 128, 128]
+    bs = args.batch_size
+    volume = int(np.prod(shape))
+    print("{:>10} {:>8} {:>12} {:>12}".format(
+        "occupancy", "channels", "sparse(ms)", "dense(ms)"))
+    for occupancy in [0.1, 0.3, 0.5, 0.7, 0.9]:
+        indices = random_indices(shape, int(volume * occupancy), bs)
+        for channels in [32, 64]:
+            features = torch.randn(indices.shape[0], channels)
+            res = []
+            for algo in [spconv.ConvAlgo.Native, spconv.ConvAlgo.Dense]:
+                conv = spconv.SubMConv3d(channels, channels, 3, algo=algo)
+                x = spconv.SparseConvTensor(features, indices, shape, bs)
+                # the indice pairs are generated in the warm-up run of timeit.
+                with torch.no_grad():
+                    res.append(timeit(lambda: conv(x)))
+            print("{:>10.2f} {:>8} {:>12.3f} {:>12.3f}".format(occupancy, channels, *res))
+
+
+def bench_dtype(args):
+    shape = [41, 400, 352]
+    bs = args.batch_size
+    indices = random_indices(shape, args.num_points, bs)
+    dtypes = [torch.float32, torch.bfloat16, torch.float64]
+    print("{:>8} {:>6} ".format("channels", "subm") +
+          " ".join("{:>16}".format(str(t).split(".")[-1] + "(ms)") for t in dtypes))
+    for channels, subm in [(16, True), (64, True), (64, False)]:
+        outids, indice_pairs, indice_pair_num = spconv.ops.get_indice_pairs(
+            indices, bs, shape, 3, 1 if subm else 2, subm=subm)
+        res = []
+        for dtype in dtypes:
+            features = torch.randn(indices.shape[0], channels).to(dtype)
+            weight = torch.randn(3, 3, 3, channels, channels).to(dtype)
+            res.append(timeit(lambda: spconv.ops.indice_conv(
+                features, weight, indice_pairs, indice_pair_num, outids.shape[0],
+                False, subm)))
+        print("{:>8} {:>6} ".format(channels, str(subm)) +
+              " ".join("{:>16.3f}".format(t) for t in res))
+
+
+def bench_fusion(args):
+    # conv -> bn -> relu blocks, before and after spconv.fuse_modules.
+    shape = [41, 400, 352]
+    bs = args.batch_size
+    indices = random_indices(shape, args.num_points, bs)
+    print("{:>8} {:>16} {:>16}".format("channels", "unfused(ms)", "fused(ms)"))
+    for channels in [16, 32, 64]:
+        features = torch.randn(indices.shape[0], channels)
+        net = spconv.SparseSequential(*[
+            m for _ in range(4) for m in (
+                spconv.SubMConv3d(channels, channels, 3, bias=False, indice_key="subm0"),
+                torch.nn.BatchNorm1d(channels),
+                torch.nn.ReLU())
+        ]).eval()
+        fused = spconv.fuse_modules(net)
+        res = []
+        for n in [net, fused]:
+            # the indice pairs are generated in the warm-up run of timeit.
+            x = spconv.SparseConvTensor(features, indices, shape, bs)
+            with torch.no_grad():
+                res.append(timeit(lambda: n(x)))
+        print("{:>8} {:>16.3f} {:>16.3f}".format(channels, *res))
+
+
+def bench_int8(args):
+    # fused subm conv -> bn -> relu blocks in fp32 and after int8 quantization,
+    # and the size of the features passed between the blocks.
+    shape = [41, 400, 352]
+    bs = args.batch_size
+    indices = random_indices(shape, args.num_points, bs)
+    print("{:>8} {:>16} {:>16} {:>12} {:>16} {:>16}".format(
+        "channels", "fp32(ms)", "fp32 fused(ms)", "int8(ms)", "fp32 feat(KB)",
+        "int8 feat(KB)"))
+    for channels in [16, 32, 64]:
+        features = torch.randn(indices.shape[0], channels)
+        res = []
+        for algo in [spconv.ConvAlgo.Native, spconv.ConvAlgo.Fused]:
+            net = spconv.fuse_modules(spconv.SparseSequential(*[
+                m for _ in range(4) for m in (
+                    spconv.SubMConv3d(channels, channels, 3, bias=False,
+                                      indice_key="subm0", algo=algo),
+                    torch.nn.BatchNorm1d(channels),
+                    torch.nn.ReLU())
+            ]).eval())
+            x = spconv.SparseConvTensor(features, indices, shape, bs)
+            with torch.no_grad():
+                res.append(timeit(lambda: net(x)))
+        net = spconv.prepare_quantization(net)
+        with torch.no_grad():
+            net(spconv.SparseConvTensor(features, indices, shape, bs))
+        net = spconv.convert_quantization(net)
+        x = spconv.SparseConvTensor(features, indices, shape, bs)
+        with torch.no_grad():
+            res.append(timeit(lambda: net(x)))
+        print("{:>8} {:>16.3f} {:>16.3f} {:>12.3f} {:>16.1f} {:>16.1f}".format(
+            channels, *res, features.numel() * 4 / 1024, features.numel() / 1024))
+
+
+def bench_half_rulebook(args):
+    # subm indice pair generation and conv with full and half rulebooks.
+    shape = [41, 400, 352]
+    bs = args.batch_size
+    indices = random_indices(shape, args.num_points, bs)
+    print("{:>8} {:>6} {:>12} {:>12} {:>12}".format(
+        "channels", "half", "pairs(ms)", "pairs(KB)", "conv(ms)"))
+    for channels in [16, 64]:
+        features = torch.randn(indices.shape[0], channels)
+        weight = torch.randn(3, 3, 3, channels, channels)
+        for half in [False, True]:
+            t_pairs = timeit(lambda: spconv.ops.get_indice_pairs(
+                indices, bs, shape, 3, subm=True, half=half))
+            outids, indice_pairs, indice_pair_num = spconv.ops.get_indice_pairs(
+                indices, bs, shape, 3, subm=True, half=half)
+            t_conv = timeit(lambda: spconv.ops.indice_conv(
+                features, weight, indice_pairs, indice_pair_num, outids.shape[0],
+                False, True))
+            print("{:>8} {:>6} {:>12.3f} {:>12.1f} {:>12.3f}".format(
+                channels, str(half), t_pairs, indice_pairs.numel() * 4 / 1024, t_conv))
+
+
+def bench_reorder(args):
+    # gather and scatter add dominate conv with few pairs per offset, compare
+    # one thread with all threads.
+    shape = [41, 400, 352]
+    bs = args.batch_size
+    indices = random_indices(shape, args.num_points, bs)
+    outids, indice_pairs, indice_pair_num = spconv.ops.get_indice_pairs(
+        indices, bs, shape, 3, 2)
+    num_threads = torch.get_num_threads()
+    print("{:>8} {:>16} {:>16}".format(
+        "channels", "1 thread(ms)", "{} threads(ms)".format(num_threads)))
+    for channels in [16, 32, 64, 128, 256]:
+        features = torch.randn(indices.shape[0], channels)
+        weight = torch.randn(3, 3, 3, channels, channels)
+        res = []
+        for n in [1, num_threads]:
+            torch.set_num_threads(n)
+            res.append(timeit(lambda: spconv.ops.indice_conv(
+                features, weight, indice_pairs, indice_pair_num, outids.shape[0])))
+        torch.set_num_threads(num_threads)
+        print("{:>8} {:>16.3f} {:>16.3f}".format(channels, *res))
+
+
+def bench_workspace(args):
+    shape = [41, 400, 352]
+    bs = args.batch_size
+    indices = random_indices(shape, args.num_points, bs)
+    print("{:>8} {:>6} {:>16} {:>16}".format(
+        "channels", "subm", "no workspace(ms)", "workspace(ms)"))
+    for channels, subm in [(16, True), (64, True), (16, False), (64, False)]:
+        features = torch.randn(indices.shape[0], channels)
+        weight = torch.randn(3, 3, 3, channels, channels)
+        outids, indice_pairs, indice_pair_num = spconv.ops.get_indice_pairs(
+            indices, bs, shape, 3, 1 if subm else 2, subm=subm)
+        out_bp = torch.randn(outids.shape[0], channels)
+
+        def run():
+            spconv.ops.indice_conv(features, weight, indice_pairs, indice_pair_num,
+                                   outids.shape[0], False, subm)
+            spconv.ops.indice_conv_backward(features, weight, out_bp, indice_pairs,
+                                            indice_pair_num, False, subm)
+
+        t = timeit(run)
+        with spconv.Workspace():
+            t_ws = timeit(run)
+        print("{:>8} {:>6} {:>16.3f} {:>16.3f}".format(channels, str(subm), t, t_ws))
+
+
+BENCHMARKS = {
+    "algo": bench_algo,
+    "autocast": bench_autocast,
+    "dense": bench_dense,
+    "dtype": bench_dtype,
+    "fusion": bench_fusion,
+    "grid_reset": bench_grid_reset,
+    "half_rulebook": bench_half_rulebook,
+    "int8": bench_int8,
+    "order": bench_order,
+    "reorder": bench_reorder,
+    "workspace": bench_workspace,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS.keys()))
+    parser.add_argument("--num_points", type=int, default=20000)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+    np.random.seed(484)
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
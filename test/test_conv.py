@@ -12,12 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 from pathlib import Path
 import spconv
 import torch
 from torch import nn
 import numpy as np
 import time
+import tempfile
+import threading
 from spconv.test_utils import params_grid, generate_sparse_data, TestCase
 import unittest
 
@@ -808,6 +811,1077 @@ class TestSpConv(TestCase):
             # Compare outputs
             self.assertAllClose(out_np, out_ref_np, atol=1e-4)
 
+    def testGetIndicePairsHash(self):
+        """Test that the hash table indice generation produces the same
+        indices and indice pairs as the dense grid one.
+        """
+        np.random.seed(484)
+        shapes = [[19, 18, 17]]
+        batchsizes = [1, 2]
+        ksizes = [2, 3]
+        strides = [1, 2]
+        subms = [False, True]
+        transposes = [False, True]
+
+        for shape, bs, k, s, subm, transpose in params_grid(
+            shapes, batchsizes, ksizes, strides, subms, transposes
+        ):
+            if subm and (transpose or s > 1 or k % 2 == 0):
+                continue
+            num_points = [1000] * bs
+            sparse_dict = generate_sparse_data(shape, num_points, 1)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices)
+            res = spconv.ops.get_indice_pairs(
+                indices_t, bs, shape, k, s, subm=subm, transpose=transpose,
+                use_hash=False
+            )
+            res_hash = spconv.ops.get_indice_pairs(
+                indices_t, bs, shape, k, s, subm=subm, transpose=transpose,
+                use_hash=True
+            )
+            for t, t_hash in zip(res, res_hash):
+                self.assertAllEqual(t.numpy(), t_hash.numpy())
+
+    def testGetIndicePairsMultiThread(self):
+        """Test that the multithreaded cpu indice generation produces the
+        same indices and indice pairs as the single threaded one.
+        """
+        np.random.seed(484)
+        shape = [50, 30, 30]
+        bs = 2
+        num_threads = torch.get_num_threads()
+        for use_hash, subm, s in params_grid([False, True], [False, True], [1, 2]):
+            if subm and s > 1:
+                continue
+            sparse_dict = generate_sparse_data(shape, [5000] * bs, 1)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices)
+            try:
+                torch.set_num_threads(1)
+                res = spconv.ops.get_indice_pairs(
+                    indices_t, bs, shape, 3, s, subm=subm, use_hash=use_hash
+                )
+            finally:
+                torch.set_num_threads(max(num_threads, 4))
+            res_mt = spconv.ops.get_indice_pairs(
+                indices_t, bs, shape, 3, s, subm=subm, use_hash=use_hash
+            )
+            torch.set_num_threads(num_threads)
+            for t, t_mt in zip(res, res_mt):
+                self.assertAllEqual(t.numpy(), t_mt.numpy())
+
+    def testIndicePairsCompact(self):
+        """Test that indice pairs are returned in the compact layout, that
+        the output indices are allocated with their exact size and that the
+        pair counts are kept on cpu.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev, subm, s in params_grid(devices, [False, True], [1, 2]):
+            if subm and s > 1:
+                continue
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 1)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            outids, indice_pairs, indice_pair_num = spconv.ops.get_indice_pairs(
+                indices_t, bs, shape, 3, s, subm=subm
+            )
+            self.assertEqual(indice_pairs.dim(), 1)
+            self.assertEqual(indice_pairs.device.type, device.type)
+            self.assertEqual(indice_pair_num.device, torch.device("cpu"))
+            self.assertEqual(indice_pairs.numel(), 2 * int(indice_pair_num.sum()))
+            self.assertEqual(outids.untyped_storage().nbytes(),
+                             outids.numel() * outids.element_size())
+            outids_set = set(map(tuple, outids.cpu().numpy().tolist()))
+            self.assertEqual(len(outids_set), outids.shape[0])
+            start = 0
+            for n in indice_pair_num.cpu().numpy().tolist():
+                block = indice_pairs[start:start + 2 * n].view(2, n).cpu().numpy()
+                self.assertTrue(np.all(block[0] >= 0) and np.all(block[0] < indices.shape[0]))
+                self.assertTrue(np.all(block[1] >= 0) and np.all(block[1] < outids.shape[0]))
+                self.assertEqual(len(np.unique(block[1])), n)
+                start += 2 * n
+
+    def testAutoIndiceKey(self):
+        """Test that layers without indice_key reuse indice pairs of layers
+        with the same input coordinates and geometry.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev in devices:
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = torch.from_numpy(sparse_dict["features"]).to(device)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            layers = [
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseConv3d(16, 16, 3, 2, bias=False),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+            ]
+            net = spconv.SparseSequential(*layers).to(device)
+            keys = ["subm0", "subm0", "down0", "subm1", "subm1"]
+            net_keyed = spconv.SparseSequential(*[
+                l.__class__(16, 16, 3, l.stride, bias=False, indice_key=k)
+                for l, k in zip(layers, keys)
+            ]).to(device)
+            net_keyed.load_state_dict(net.state_dict())
+            x = spconv.SparseConvTensor(features, indices_t, shape, bs)
+            out = net(x)
+            self.assertEqual(len(out.indice_dict), 3)
+            self.assertEqual(out.coord_id, (x.coord_id, ) + layers[2].geometry_key())
+            x = spconv.SparseConvTensor(features, indices_t, shape, bs)
+            out_keyed = net_keyed(x)
+            self.assertAllEqual(out.indices.cpu().numpy(),
+                                out_keyed.indices.cpu().numpy())
+            self.assertAllClose(out.features.detach().cpu().numpy(),
+                                out_keyed.features.detach().cpu().numpy())
+
+    def testIndicePairCache(self):
+        """Test that the rulebook cache returns cached results for repeated
+        inputs and respects its byte budget.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev in devices:
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 1)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            cache = spconv.IndicePairCache()
+            prev = spconv.set_indice_pair_cache(cache)
+            try:
+                res = spconv.ops.get_indice_pairs(indices_t, bs, shape, 3, 2)
+                res_cached = spconv.ops.get_indice_pairs(indices_t.clone(), bs, shape, 3, 2)
+                spconv.ops.get_indice_pairs(indices_t, bs, shape, 3, 1, subm=True)
+                self.assertEqual(cache.hits, 1)
+                self.assertEqual(cache.misses, 2)
+                self.assertEqual(len(cache), 2)
+                for a, b in zip(res, res_cached):
+                    self.assertTrue(a is b)
+                # the least recently used entry (stride 2, kernel 3) is evicted
+                cache.max_bytes = cache.nbytes - 1
+                spconv.ops.get_indice_pairs(indices_t, bs, shape, 2, 2)
+                self.assertTrue(cache.nbytes <= cache.max_bytes)
+                spconv.ops.get_indice_pairs(indices_t, bs, shape, 3, 2)
+                self.assertEqual(cache.hits, 1)
+                self.assertEqual(cache.misses, 4)
+            finally:
+                spconv.set_indice_pair_cache(prev)
+
+    def testUpdateIndiceDict(self):
+        """Test that incrementally updated indice pairs match the indice pairs
+        generated from scratch for the new frame.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+
+        def pair_set(outids, indices, indice_pairs, indice_pair_num):
+            outids = outids.cpu().numpy()
+            indices = indices.cpu().numpy()
+            res = set()
+            start = 0
+            for k, n in enumerate(indice_pair_num.cpu().numpy().tolist()):
+                block = indice_pairs[start:start + 2 * n].view(2, n).cpu().numpy()
+                for i, o in zip(block[0], block[1]):
+                    res.add((k, tuple(indices[i]), tuple(outids[o])))
+                start += 2 * n
+            return res
+
+        for dev in devices:
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1500] * bs, 16)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            perm = np.random.permutation(indices.shape[0])
+            prev_indices = torch.from_numpy(indices[perm[:1200]]).to(device)
+            added = torch.from_numpy(indices[perm[1200:1400]]).to(device)
+            removed = prev_indices[:150]
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseConv3d(16, 16, 3, 2, bias=False, indice_key="down0"),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseInverseConv3d(16, 16, 3, bias=False, indice_key="down0"),
+                spconv.SparseMaxPool3d(2, 2),
+            ).to(device)
+            features = torch.randn(prev_indices.shape[0], 16, device=device)
+            x = spconv.SparseConvTensor(features, prev_indices, shape, bs)
+            net(x)
+            new_indices, indice_dict = spconv.update_indice_dict(
+                x.indice_dict, x.coord_id, prev_indices, added, removed, bs,
+                spconv.get_indice_key_geometries(net))
+            self.assertEqual(new_indices.shape[0], 1200 - 150 + 200)
+            self.assertAllEqual(new_indices[1050:].cpu().numpy(), added.cpu().numpy())
+            features = torch.randn(new_indices.shape[0], 16, device=device)
+            x_ref = spconv.SparseConvTensor(features, new_indices, shape, bs, coord_id=x.coord_id)
+            net(x_ref)
+            self.assertEqual(set(indice_dict.keys()), set(x_ref.indice_dict.keys()))
+            for key, datas in indice_dict.items():
+                datas_ref = x_ref.indice_dict[key]
+                self.assertEqual(pair_set(*datas[:4]), pair_set(*datas_ref[:4]))
+                self.assertEqual(set(map(tuple, datas[0].cpu().numpy().tolist())),
+                                 set(map(tuple, datas_ref[0].cpu().numpy().tolist())))
+                self.assertEqual(datas[0].shape[0], datas_ref[0].shape[0])
+
+    def testGetIndicePairsGridReset(self):
+        """Test that the pre-allocated grid path generates the same indice
+        pairs and leaves the grid reset for the next layer.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev, subm, s in params_grid(devices, [False, True], [1, 2]):
+            if subm and s > 1:
+                continue
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 1)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            grid = torch.full([bs * int(np.prod(shape))], -1, dtype=torch.int32, device=device)
+            for _ in range(2):
+                res = spconv.ops.get_indice_pairs(indices_t, bs, shape, 3, s, subm=subm)
+                res_grid = spconv.ops.get_indice_pairs(indices_t, bs, shape, 3, s, subm=subm, grid=grid)
+                self.assertTrue(bool((grid == -1).all()))
+                for a, b in zip(res, res_grid):
+                    self.assertAllEqual(a.cpu().numpy(), b.cpu().numpy())
+
+    def testMortonOrder(self):
+        """Test that morton ordered tensors give the same results and that the
+        order is kept by non-submanifold layers.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+
+        def assert_sorted(x):
+            codes = spconv.ordering.morton_codes(x.indices, x.spatial_shape).cpu().numpy()
+            batch = x.indices[:, 0].cpu().numpy()
+            keys = list(zip(batch.tolist(), codes.tolist()))
+            self.assertEqual(keys, sorted(keys))
+
+        for dev in devices:
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = torch.from_numpy(sparse_dict["features"]).to(device)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseConv3d(16, 16, 3, 2, bias=False),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseMaxPool3d(2, 2),
+            ).to(device)
+            x = spconv.SparseConvTensor(features, indices_t, shape, bs, order="morton")
+            assert_sorted(x)
+            inv = x.inverse_permutation
+            self.assertAllEqual(x.indices[inv].cpu().numpy(), indices)
+            self.assertAllEqual(x.features[inv].cpu().numpy(), sparse_dict["features"])
+            out = net(x)
+            assert_sorted(out)
+            out_ref = net(spconv.SparseConvTensor(features, indices_t, shape, bs))
+            self.assertAllClose(out.dense().detach().cpu().numpy(),
+                                out_ref.dense().detach().cpu().numpy())
+
+    def testMortonOrderIndiceDict(self):
+        """Test that a morton ordered tensor rejects an indice_dict generated
+        for the unordered indices and uses one precomputed with the order as
+        is.
+        """
+        np.random.seed(484)
+        shape = [19, 18, 17]
+        sparse_dict = generate_sparse_data(shape, [1000], 16)
+        features = torch.from_numpy(sparse_dict["features"])
+        indices = torch.from_numpy(np.ascontiguousarray(
+            sparse_dict["indices"][:, [3, 0, 1, 2]]).astype(np.int32))
+        net = spconv.SparseSequential(
+            spconv.SubMConv3d(16, 16, 3, bias=False),
+            spconv.SparseConv3d(16, 16, 3, 2, bias=False),
+        )
+        coord_id, indice_dict = spconv.precompute_indice_dict(
+            indices, 1, shape, spconv.get_layer_geometries(net))
+        with self.assertRaises(AssertionError):
+            spconv.SparseConvTensor(features, indices, shape, 1, coord_id=coord_id,
+                                    indice_dict=indice_dict, order="morton")
+        out = net(spconv.SparseConvTensor(features, indices, shape, 1, coord_id=coord_id,
+                                          indice_dict=indice_dict))
+        out_ref = net(spconv.SparseConvTensor(features, indices, shape, 1))
+        self.assertAllEqual(out.features.detach().numpy(),
+                            out_ref.features.detach().numpy())
+
+        x_ref = spconv.SparseConvTensor(features, indices, shape, 1, order="morton")
+        out_ref = net(x_ref)
+        coord_id, indice_dict = spconv.precompute_indice_dict(
+            indices, 1, shape, spconv.get_layer_geometries(net), order="morton")
+        x = spconv.SparseConvTensor(features, indices, shape, 1, coord_id=coord_id,
+                                    indice_dict=indice_dict, order="morton")
+        out = net(x)
+        self.assertEqual(set(out.indice_dict.keys()), set(indice_dict.keys()))
+        self.assertAllEqual(out.indices.numpy(), out_ref.indices.numpy())
+        self.assertAllEqual(out.features.detach().numpy(),
+                            out_ref.features.detach().numpy())
+
+    def testPrecomputeIndiceDict(self):
+        """Test that precomputed indice pairs are used by the forward as is and
+        give the same result as the lazily generated ones.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev in devices:
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = torch.from_numpy(sparse_dict["features"]).to(device)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseConv3d(16, 16, 3, 2, bias=False, indice_key="down0"),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseConv3d(16, 16, 1, bias=False),
+                spconv.SparseInverseConv3d(16, 16, 3, bias=False, indice_key="down0"),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseMaxPool3d(2, 2),
+            ).to(device)
+            # indice pairs are generated on cpu as in DataLoader workers.
+            coord_id, indice_dict = spconv.precompute_indice_dict(
+                torch.from_numpy(indices), bs, shape, spconv.get_layer_geometries(net))
+            indice_dict = spconv.indice_dict_to(indice_dict, device)
+            keys = set(indice_dict.keys())
+            self.assertEqual(len(keys), 4)
+            indices_t = torch.from_numpy(indices).to(device)
+            x = spconv.SparseConvTensor(features, indices_t, shape, bs,
+                                        coord_id=coord_id, indice_dict=indice_dict)
+            out = net(x)
+            self.assertEqual(set(out.indice_dict.keys()), keys)
+            out_ref = net(spconv.SparseConvTensor(features, indices_t, shape, bs))
+            self.assertAllClose(out.dense().detach().cpu().numpy(),
+                                out_ref.dense().detach().cpu().numpy())
+
+    def testIndicePairPlanner(self):
+        """Test that the planner generates exactly the indice pairs of a
+        multi-scale network.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev in devices:
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = torch.from_numpy(sparse_dict["features"]).to(device)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseConv3d(16, 16, 3, 2, bias=False, indice_key="down0"),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseConv3d(16, 16, 3, 2, bias=False, indice_key="down1"),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseInverseConv3d(16, 16, 3, bias=False, indice_key="down1"),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+                spconv.SparseInverseConv3d(16, 16, 3, bias=False, indice_key="down0"),
+                spconv.SubMConv3d(16, 16, 3, bias=False),
+            ).to(device)
+            planner = spconv.IndicePairPlanner(net)
+            self.assertEqual(len(planner.coord_sets), 3)
+            self.assertEqual(len(planner.rulebooks), 5)
+            self.assertEqual(planner.num_levels, 3)
+            for num_workers, order in [(1, None), (2, None), (1, "morton")]:
+                coord_id, indice_dict = planner.build(indices_t, bs, shape,
+                                                      num_workers=num_workers, order=order)
+                self.assertEqual(set(planner.timings.keys()), set(indice_dict.keys()))
+                x = spconv.SparseConvTensor(features, indices_t, shape, bs, coord_id=coord_id,
+                                            order=order)
+                net(x)
+                self.assertEqual(set(x.indice_dict.keys()), set(indice_dict.keys()))
+                for key, datas in indice_dict.items():
+                    datas_ref = x.indice_dict[key]
+                    self.assertAllEqual(datas[3].cpu().numpy(), datas_ref[3].cpu().numpy())
+                    if dev != "cpu:0":
+                        # gpu indice generation isn't deterministic.
+                        continue
+                    for a, b in zip(datas[:3], datas_ref[:3]):
+                        self.assertAllEqual(a.cpu().numpy(), b.cpu().numpy())
+
+    def testSpConv3dAlgo(self):
+        """Test that the other algorithms give the same features and gradients
+        as the native one.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        algos = [spconv.ConvAlgo.Fused, spconv.ConvAlgo.Batch,
+                 spconv.ConvAlgo.OutputStationary]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev, C, algo in params_grid(devices, [16, 70], algos):
+            cpu_only = [spconv.ConvAlgo.Fused, spconv.ConvAlgo.OutputStationary]
+            if algo in cpu_only and dev != "cpu:0":
+                continue
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, C)
+            features = np.ascontiguousarray(sparse_dict["features"]).astype(np.float32)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+
+            def make_net(algo):
+                return spconv.SparseSequential(
+                    spconv.SubMConv3d(C, C, 3, bias=False, algo=algo),
+                    spconv.SparseConv3d(C, 32, 3, 2, bias=False, indice_key="cp0",
+                                        algo=algo),
+                    spconv.SparseInverseConv3d(32, C, 3, "cp0", bias=False, algo=algo),
+                ).to(device)
+
+            net_ref = make_net(spconv.ConvAlgo.Native)
+            net = make_net(algo)
+            net.load_state_dict(net_ref.state_dict())
+            outs = []
+            for n in [net_ref, net]:
+                features_t = torch.from_numpy(features).to(device)
+                features_t.requires_grad = True
+                out = n(spconv.SparseConvTensor(features_t, indices_t, shape, bs))
+                out.features.sum().backward()
+                grads = [p.grad.cpu().numpy() for p in n.parameters()]
+                outs.append((out.features.detach().cpu().numpy(),
+                             features_t.grad.cpu().numpy(), grads))
+            (out_ref, din_ref, dw_ref), (out, din, dw) = outs
+            self.assertAllClose(out, out_ref, atol=1e-4)
+            self.assertAllClose(din, din_ref, atol=1e-4)
+            for g, g_ref in zip(dw, dw_ref):
+                self.assertAllClose(g, g_ref, atol=1e-3)
+
+    def testTiledIndicePairCache(self):
+        """Test that the tiled rulebook of the output stationary algorithm is
+        built once per indice pairs and gives the native result.
+        """
+        np.random.seed(484)
+        shape = [19, 18, 17]
+        sparse_dict = generate_sparse_data(shape, [1000], 20)
+        features = torch.from_numpy(
+            np.ascontiguousarray(sparse_dict["features"]).astype(np.float32))
+        indices = torch.from_numpy(np.ascontiguousarray(
+            sparse_dict["indices"][:, [3, 0, 1, 2]]).astype(np.int32))
+        filters = torch.randn(3, 3, 3, 20, 24)
+        for subm in [True, False]:
+            outids, indice_pairs, indice_pair_num = spconv.ops.get_indice_pairs(
+                indices, 1, shape, 3, 1 if subm else 2, subm=subm)
+            num_out = outids.shape[0]
+            tiled = spconv.ops.get_tiled_indice_pairs(indice_pairs, indice_pair_num,
+                                                      num_out, 27)
+            self.assertIs(spconv.ops.get_tiled_indice_pairs(
+                indice_pairs, indice_pair_num, num_out, 27), tiled)
+            for inverse in [False, True]:
+                if inverse and subm:
+                    continue
+                num = features.shape[0] if inverse else num_out
+                feats = torch.randn(num_out, 20) if inverse else features
+                outs = [spconv.ops.indice_conv(feats, filters, indice_pairs,
+                                               indice_pair_num, num, inverse, subm, algo)
+                        for algo in [spconv.ConvAlgo.Native,
+                                     spconv.ConvAlgo.OutputStationary]]
+                self.assertAllClose(outs[1], outs[0], atol=1e-4)
+            self.assertEqual(len(indice_pairs._spconv_tiled_pairs), 1 if subm else 2)
+
+    def testWorkspace(self):
+        """Test that convolutions inside a workspace give the same results and
+        that the workspace stops growing after the first iteration.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev in devices:
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = np.ascontiguousarray(sparse_dict["features"]).astype(np.float32)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(16, 32, 3, bias=False),
+                spconv.SparseConv3d(32, 64, 3, 2, bias=False, indice_key="cp0"),
+                spconv.SparseInverseConv3d(64, 16, 3, "cp0", bias=False),
+            ).to(device)
+
+            def run():
+                features_t = torch.from_numpy(features).to(device)
+                features_t.requires_grad = True
+                x = spconv.SparseConvTensor(features_t, indices_t, shape, bs)
+                out = net(x).features
+                out.sum().backward()
+                res = (out.detach().cpu().numpy(), features_t.grad.cpu().numpy())
+                net.zero_grad()
+                return res
+
+            out_ref, grad_ref = run()
+            workspace = spconv.Workspace()
+            nbytes = []
+            for _ in range(2):
+                with workspace:
+                    out, grad = run()
+                self.assertIsNone(spconv.get_workspace())
+                nbytes.append(workspace.nbytes)
+                self.assertAllClose(out, out_ref)
+                self.assertAllClose(grad, grad_ref)
+            self.assertGreater(nbytes[0], 0)
+            self.assertEqual(nbytes[0], nbytes[1])
+
+    def testWorkspaceThreads(self):
+        """Test that threads using workspaces at the same time don't replace
+        each other's workspace or share buffers.
+        """
+        np.random.seed(484)
+        shape = [19, 18, 17]
+        sparse_dict = generate_sparse_data(shape, [1000], 16)
+        features = torch.from_numpy(
+            np.ascontiguousarray(sparse_dict["features"]).astype(np.float32))
+        indices = torch.from_numpy(np.ascontiguousarray(
+            sparse_dict["indices"][:, [3, 0, 1, 2]]).astype(np.int32))
+        nets = [spconv.SparseSequential(
+            spconv.SubMConv3d(16, C, 3, bias=False),
+            spconv.SparseConv3d(C, 32, 3, 2, bias=False),
+        ) for C in [16, 48]]
+
+        def run(net):
+            x = spconv.SparseConvTensor(features, indices, shape, 1)
+            with torch.no_grad():
+                return net(x).features.numpy()
+
+        refs = [run(net) for net in nets]
+        shared = spconv.Workspace()
+        workspaces = [spconv.Workspace(), spconv.Workspace(), shared, shared]
+        barrier = threading.Barrier(len(workspaces))
+        results = [None] * len(workspaces)
+
+        def worker(i):
+            workspace = workspaces[i]
+            barrier.wait()
+            outs = []
+            for _ in range(5):
+                with workspace:
+                    outs.append(run(nets[i % 2]))
+                    active = spconv.get_workspace()
+            results[i] = (outs, active, spconv.get_workspace())
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(len(workspaces))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for i, (outs, active, after) in enumerate(results):
+            self.assertIs(active, workspaces[i])
+            self.assertIsNone(after)
+            for out in outs:
+                self.assertAllClose(out, refs[i % 2])
+        self.assertEqual(len(shared._buffers), 2)
+        self.assertIsNone(spconv.get_workspace())
+
+    def testConvBackwardPartialGrad(self):
+        """Test that the backward only computes the requested gradients and
+        that they match the full backward.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        algos = [spconv.ConvAlgo.Native, spconv.ConvAlgo.Fused, spconv.ConvAlgo.Batch]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev, subm, algo in params_grid(devices, [False, True], algos):
+            if algo == spconv.ConvAlgo.Fused and dev != "cpu:0":
+                continue
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = torch.from_numpy(sparse_dict["features"]).to(device)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            weight = torch.randn(3, 3, 3, 16, 32, device=device)
+            outids, indice_pairs, indice_pair_num = spconv.ops.get_indice_pairs(
+                indices_t, bs, shape, 3, 1 if subm else 2, subm=subm)
+            out_bp = torch.randn(outids.shape[0], 32, device=device)
+            args = (features, weight, out_bp, indice_pairs, indice_pair_num, False,
+                    subm, algo)
+            din_ref, dw_ref = spconv.ops.indice_conv_backward(*args)
+            din, dw = spconv.ops.indice_conv_backward(*args, filter_grad=False)
+            self.assertIsNone(dw)
+            self.assertAllClose(din.cpu().numpy(), din_ref.cpu().numpy())
+            din, dw = spconv.ops.indice_conv_backward(*args, input_grad=False)
+            self.assertIsNone(din)
+            self.assertAllClose(dw.cpu().numpy(), dw_ref.cpu().numpy())
+
+            # first layer: features don't require grad.
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(16, 32, 3, bias=False, algo=algo)).to(device)
+            out = net(spconv.SparseConvTensor(features, indices_t, shape, bs))
+            out.features.sum().backward()
+            self.assertIsNotNone(net[0].weight.grad)
+
+    def testSpConvGroups(self):
+        """Test grouped and depthwise convolutions against the dense grouped
+        Conv3d from Pytorch.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        C = 16
+        for dev, subm, k, (groups, OC) in params_grid(
+                devices, [False, True], [1, 3], [(2, 32), (C, C)]):
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, C)
+            features = np.ascontiguousarray(sparse_dict["features"]).astype(np.float32)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            features_dense = sparse_dict["features_dense"].astype(np.float32)
+            indices_t = torch.from_numpy(indices).to(device)
+            features_t = torch.from_numpy(features).to(device)
+            features_t.requires_grad = True
+            features_dense_t = torch.from_numpy(features_dense).to(device)
+            features_dense_t.requires_grad = True
+            if subm:
+                conv = spconv.SubMConv3d(C, OC, k, groups=groups, bias=False)
+            else:
+                conv = spconv.SparseConv3d(C, OC, k, padding=k // 2, groups=groups,
+                                           bias=False)
+            conv = conv.to(device)
+            conv_ref = nn.Conv3d(C, OC, k, padding=k // 2, groups=groups,
+                                 bias=False).to(device)
+            conv_ref.weight.data[:] = conv.weight.data.permute(4, 3, 0, 1, 2)
+
+            out = conv(spconv.SparseConvTensor(features_t, indices_t, shape, bs)).dense()
+            out_ref = conv_ref(features_dense_t)
+            if subm:
+                mask = torch.zeros(bs, 1, *shape, device=device)
+                idx = indices_t.long()
+                mask[idx[:, 0], 0, idx[:, 1], idx[:, 2], idx[:, 3]] = 1
+                out_ref = out_ref * mask
+            dout = torch.from_numpy(
+                np.random.uniform(-0.2, 0.2, out_ref.shape).astype(np.float32)).to(device)
+            out.backward(dout)
+            out_ref.backward(dout)
+            din_dense = features_dense_t.grad.detach().permute(0, 2, 3, 4, 1).contiguous()
+            din_ref = gather_nd(din_dense, indices_t.long())
+            dw = conv.weight.grad.detach().permute(4, 3, 0, 1, 2)
+            self.assertAllClose(out.detach().cpu().numpy(),
+                                out_ref.detach().cpu().numpy(), atol=1e-4)
+            self.assertAllClose(features_t.grad.cpu().numpy(),
+                                din_ref.cpu().numpy(), atol=1e-4)
+            self.assertAllClose(dw.cpu().numpy(),
+                                conv_ref.weight.grad.cpu().numpy(), atol=1e-3)
+
+    def testFuseModules(self):
+        """Test that folding BatchNorm and the activation into the conv gives
+        the same inference results.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        algos = [spconv.ConvAlgo.Native, spconv.ConvAlgo.Batch,
+                 spconv.ConvAlgo.OutputStationary]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev, algo in params_grid(devices, algos):
+            if algo == spconv.ConvAlgo.OutputStationary and dev != "cpu:0":
+                continue
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = torch.from_numpy(sparse_dict["features"]).to(device)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(16, 32, 3, bias=False, algo=algo),
+                nn.BatchNorm1d(32),
+                nn.ReLU(),
+                spconv.SparseConv3d(32, 32, 3, 2, algo=algo),
+                nn.BatchNorm1d(32),
+                nn.LeakyReLU(0.1),
+                spconv.SubMConv3d(32, 16, 1),
+                nn.ReLU(),
+            ).to(device)
+            for m in net.modules():
+                if isinstance(m, nn.BatchNorm1d):
+                    m.running_mean.uniform_(-1, 1)
+                    m.running_var.uniform_(0.5, 2)
+                    m.weight.data.uniform_(0.5, 2)
+                    m.bias.data.uniform_(-1, 1)
+            net.eval()
+            fused = spconv.fuse_modules(net)
+            self.assertIsInstance(net[1], nn.BatchNorm1d)
+            for i in [1, 2, 4, 5, 7]:
+                self.assertIsInstance(fused[i], nn.Identity)
+            self.assertEqual(fused[3].act, spconv.ConvActivation.LeakyReLU)
+            x = spconv.SparseConvTensor(features, indices_t, shape, bs)
+            out_ref = net(x).features
+            with torch.no_grad():
+                x = spconv.SparseConvTensor(features, indices_t, shape, bs)
+                out = fused(x).features
+            self.assertAllClose(out.cpu().numpy(), out_ref.detach().cpu().numpy(),
+                                atol=1e-4)
+            # bias and activation outside of the op when grads are needed.
+            x = spconv.SparseConvTensor(features, indices_t, shape, bs)
+            out = fused(x).features
+            self.assertTrue(out.requires_grad)
+            self.assertAllClose(out.detach().cpu().numpy(),
+                                out_ref.detach().cpu().numpy(), atol=1e-4)
+
+    def testAutotune(self):
+        """Test that layers with ConvAlgo.Auto match the native algorithm, that
+        decisions are made after num_trials calls and survive save and load.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev in devices:
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = np.ascontiguousarray(sparse_dict["features"]).astype(np.float32)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+
+            def make_net(algo):
+                return spconv.SparseSequential(
+                    spconv.SubMConv3d(16, 32, 3, bias=False, algo=algo),
+                    spconv.SparseConv3d(32, 32, 3, 2, bias=False, indice_key="cp0",
+                                        algo=algo),
+                    spconv.SparseInverseConv3d(32, 16, 3, "cp0", bias=False, algo=algo),
+                ).to(device)
+
+            net_ref = make_net(spconv.ConvAlgo.Native)
+            net = make_net(spconv.ConvAlgo.Auto)
+            net.load_state_dict(net_ref.state_dict())
+
+            def run(n):
+                features_t = torch.from_numpy(features).to(device)
+                features_t.requires_grad = True
+                out = n(spconv.SparseConvTensor(features_t, indices_t, shape, bs))
+                out.features.sum().backward()
+                return out.features.detach().cpu().numpy(), features_t.grad.cpu().numpy()
+
+            out_ref, din_ref = run(net_ref)
+            tuner = spconv.ConvAutotuner(num_trials=2)
+            prev = spconv.set_autotuner(tuner)
+            try:
+                for i in range(3):
+                    out, din = run(net)
+                    self.assertEqual(len(tuner), 0 if i == 0 else 3)
+                    self.assertAllClose(out, out_ref, atol=1e-4)
+                    self.assertAllClose(din, din_ref, atol=1e-4)
+            finally:
+                spconv.set_autotuner(prev)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = Path(tmpdir) / "autotune.json"
+                tuner.save(path)
+                loaded = spconv.ConvAutotuner()
+                loaded.load(path)
+            self.assertEqual(loaded.decisions, tuner.decisions)
+
+
+    def testSubMHalfRulebook(self):
+        """Test that subm convs with half rulebooks give the same results and
+        gradients as with full rulebooks and that the half rulebook is the
+        first half of the full one.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        algos = [spconv.ConvAlgo.Native, spconv.ConvAlgo.Fused, spconv.ConvAlgo.Batch,
+                 spconv.ConvAlgo.OutputStationary]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev, algo, groups, use_hash in params_grid(devices, algos, [1, 16],
+                                                       [False, True]):
+            # fused, output stationary and hash indice pairs are cpu only.
+            if dev != "cpu:0" and (use_hash or algo in algos[1::2]):
+                continue
+            if groups > 1 and algo != spconv.ConvAlgo.Native:
+                continue
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = np.ascontiguousarray(sparse_dict["features"]).astype(np.float32)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            _, pairs, num = spconv.ops.get_indice_pairs(indices_t, bs, shape, 3,
+                                                        subm=True, use_hash=use_hash)
+            _, pairs_half, num_half = spconv.ops.get_indice_pairs(
+                indices_t, bs, shape, 3, subm=True, use_hash=use_hash, half=True)
+            self.assertEqual(num_half.tolist(), num[:14].tolist())
+            n = 2 * int(num_half.sum())
+            self.assertEqual(pairs_half.numel(), n)
+            start = 0
+            for k in num_half.tolist():
+                block = pairs[start:start + 2 * k].view(2, k).cpu().numpy()
+                block_half = pairs_half[start:start + 2 * k].view(2, k).cpu().numpy()
+                self.assertEqual(set(map(tuple, block.T.tolist())),
+                                 set(map(tuple, block_half.T.tolist())))
+                start += 2 * k
+
+            conv = spconv.SubMConv3d(16, 16, 3, groups=groups, algo=algo).to(device)
+            conv_half = spconv.SubMConv3d(16, 16, 3, groups=groups, algo=algo,
+                                          half_rulebook=True).to(device)
+            conv_half.load_state_dict(conv.state_dict())
+            res = []
+            for c in [conv, conv_half]:
+                features_t = torch.from_numpy(features).to(device)
+                features_t.requires_grad = True
+                out = c(spconv.SparseConvTensor(features_t, indices_t, shape, bs))
+                out.features.sum().backward()
+                res.append((out.features.detach().cpu().numpy(),
+                            features_t.grad.cpu().numpy(),
+                            c.weight.grad.cpu().numpy()))
+            for a, b in zip(*res):
+                self.assertAllClose(a, b, atol=1e-4)
+
+
+    def testSpConvDense(self):
+        """Test that the dense torch conv path gives the same results and
+        gradients as the sparse algorithms and that it's only used above
+        dense_threshold.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        shape = [19, 18, 17]
+        bs = 2
+        C = 16
+        for dev, layer, groups in params_grid(
+                devices, ["subm", "conv", "deconv"], [1, 2]):
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, C)
+            features = np.ascontiguousarray(sparse_dict["features"]).astype(np.float32)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+
+            def make_conv(**kwargs):
+                if layer == "subm":
+                    return spconv.SubMConv3d(C, 32, 3, groups=groups, **kwargs)
+                if layer == "conv":
+                    return spconv.SparseConv3d(C, 32, 3, 2, 1, groups=groups, **kwargs)
+                return spconv.SparseConvTranspose3d(C, 32, 3, 2, 1, groups=groups,
+                                                    **kwargs)
+
+            conv_ref = make_conv().to(device)
+            x = spconv.SparseConvTensor(torch.from_numpy(features), indices_t, shape, bs)
+            occupancy = x.sparity
+            res = []
+            for conv in [conv_ref, make_conv(algo=spconv.ConvAlgo.Dense),
+                         make_conv(dense_threshold=occupancy)]:
+                conv = conv.to(device)
+                conv.load_state_dict(conv_ref.state_dict())
+                features_t = torch.from_numpy(features).to(device)
+                features_t.requires_grad = True
+                out = conv(spconv.SparseConvTensor(features_t, indices_t, shape, bs))
+                out.features.sum().backward()
+                res.append((out.indices.cpu().numpy(), out.features.detach().cpu().numpy(),
+                            features_t.grad.cpu().numpy(), conv.weight.grad.cpu().numpy(),
+                            conv.bias.grad.cpu().numpy()))
+            for r in res[1:]:
+                for a, b in zip(r, res[0]):
+                    self.assertAllClose(a, b, atol=1e-4)
+            # below the threshold the sparse algorithm generates indice pairs.
+            conv = make_conv(dense_threshold=occupancy * 2).to(device)
+            x = spconv.SparseConvTensor(torch.from_numpy(features).to(device), indices_t,
+                                        shape, bs)
+            conv(x)
+            self.assertEqual(len(x.indice_dict), 1)
+            self.assertIn(spconv.ConvAlgo.Dense,
+                          spconv.ConvAutotuner.candidates(conv, device, True))
+
+
+    def testSpConvDtypes(self):
+        """Test float64 and bfloat16 convs and max pooling against float32.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        algos = [spconv.ConvAlgo.Native, spconv.ConvAlgo.Fused, spconv.ConvAlgo.Batch,
+                 spconv.ConvAlgo.OutputStationary]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev, dtype, algo in params_grid(devices, [torch.float64, torch.bfloat16],
+                                            algos):
+            # fused and output stationary are cpu only.
+            if dev != "cpu:0" and algo in algos[1::2]:
+                continue
+            device = torch.device(dev)
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = np.ascontiguousarray(sparse_dict["features"]).astype(np.float32)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(16, 32, 3, algo=algo),
+                spconv.SparseConv3d(32, 32, 3, 2, algo=algo),
+            ).to(device)
+            res = []
+            for t in [torch.float32, dtype]:
+                n = copy.deepcopy(net).to(t)
+                features_t = torch.from_numpy(features).to(device).to(t)
+                features_t.requires_grad = True
+                out = n(spconv.SparseConvTensor(features_t, indices_t, shape, bs))
+                self.assertEqual(out.features.dtype, t)
+                dout = torch.from_numpy(np.random.RandomState(0).uniform(
+                    -1, 1, out.features.shape)).to(device).to(t)
+                out.features.backward(dout)
+                res.append((out.features.detach().float().cpu().numpy(),
+                            features_t.grad.float().cpu().numpy(),
+                            n[0].weight.grad.float().cpu().numpy()))
+            tol = 1e-4 if dtype == torch.float64 else 2e-2
+            for a, b in zip(*res):
+                self.assertAllClose(a, b, atol=tol * np.abs(a).max(), rtol=tol)
+            # max pooling of the same values selects the same inputs.
+            res = []
+            x = out.features.detach()
+            for t in [torch.float32, dtype]:
+                features_t = x.to(t).requires_grad_()
+                pooled = spconv.SparseMaxPool3d(2, 2)(
+                    spconv.SparseConvTensor(features_t, out.indices, out.spatial_shape, bs))
+                self.assertEqual(pooled.features.dtype, t)
+                pooled.features.sum().backward()
+                res.append((pooled.features.detach().float().cpu().numpy(),
+                            features_t.grad.float().cpu().numpy()))
+            for a, b in zip(*res):
+                self.assertAllClose(a, b)
+
+
+    def testAutocast(self):
+        """Test that convs run in the autocast dtype and that the parameters
+        get float32 gradients close to the ones without autocast.
+        """
+        np.random.seed(484)
+        devices = ["cuda:0", "cpu:0"]
+        algos = [spconv.ConvAlgo.Native, spconv.ConvAlgo.Batch, spconv.ConvAlgo.Dense]
+        shape = [19, 18, 17]
+        bs = 2
+        for dev, algo, grad in params_grid(devices, algos, [True, False]):
+            device = torch.device(dev)
+            dtype = torch.float16 if device.type == "cuda" else torch.bfloat16
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, 16)
+            features = np.ascontiguousarray(sparse_dict["features"]).astype(np.float32)
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices).to(device)
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(16, 32, 3, algo=algo),
+                spconv.SparseConv3d(32, 32, 3, 2, algo=algo),
+            ).to(device)
+            res = []
+            for autocast in [False, True]:
+                net.zero_grad()
+                features_t = torch.from_numpy(features).to(device)
+                features_t.requires_grad = grad
+                with torch.autocast(device.type, dtype=dtype, enabled=autocast):
+                    with torch.set_grad_enabled(grad):
+                        out = net(spconv.SparseConvTensor(features_t, indices_t, shape, bs))
+                        # max pooling keeps the dtype of its input.
+                        pooled = spconv.SparseMaxPool3d(2, 2)(out)
+                self.assertEqual(out.features.dtype, dtype if autocast else torch.float32)
+                self.assertEqual(pooled.features.dtype, out.features.dtype)
+                r = [out.features.detach().float().cpu().numpy()]
+                if grad:
+                    out.features.float().sum().backward()
+                    self.assertEqual(net[0].weight.grad.dtype, torch.float32)
+                    self.assertEqual(features_t.grad.dtype, torch.float32)
+                    r += [features_t.grad.cpu().numpy(), net[0].weight.grad.cpu().numpy(),
+                          net[1].bias.grad.cpu().numpy()]
+                res.append(r)
+            for a, b in zip(*res):
+                self.assertAllClose(a, b, atol=3e-2 * np.abs(a).max(), rtol=3e-2)
+
+    def testQuantization(self):
+        """Test that the int8 convs of a calibrated net are close to the float
+        net and pass quantized features between consecutive convs.
+        """
+        np.random.seed(484)
+        torch.manual_seed(484)
+        shape = [19, 18, 17]
+        bs = 2
+        # 6 input channels aren't a multiple of 4 and 24 output channels aren't
+        # a multiple of 16, which use the padded and the scalar kernels.
+        for half, in_channels in params_grid([False, True], [6, 16]):
+            sparse_dict = generate_sparse_data(shape, [1000] * bs, in_channels)
+            features = torch.from_numpy(sparse_dict["features"]).float()
+            indices = np.ascontiguousarray(
+                sparse_dict["indices"][:, [3, 0, 1, 2]]
+            ).astype(np.int32)
+            indices_t = torch.from_numpy(indices)
+            net = spconv.SparseSequential(
+                spconv.SubMConv3d(in_channels, 32, 3, bias=False, indice_key="subm0",
+                                  half_rulebook=half),
+                nn.BatchNorm1d(32),
+                nn.ReLU(),
+                spconv.SubMConv3d(32, 32, 3, indice_key="subm0", half_rulebook=half),
+                nn.LeakyReLU(0.1),
+                spconv.SparseConv3d(32, 24, 3, 2, indice_key="down0"),
+                nn.ReLU(),
+                spconv.SubMConv3d(24, 16, 1),
+                spconv.SparseInverseConv3d(16, 16, 3, indice_key="down0"),
+            )
+            for m in net.modules():
+                if isinstance(m, nn.BatchNorm1d):
+                    m.running_mean.uniform_(-1, 1)
+                    m.running_var.uniform_(0.5, 2)
+            net = spconv.fuse_modules(net.eval())
+            prepared = spconv.prepare_quantization(net)
+            with torch.no_grad():
+                out_ref = net(spconv.SparseConvTensor(features, indices_t, shape, bs))
+                prepared(spconv.SparseConvTensor(features, indices_t, shape, bs))
+                quantized = spconv.convert_quantization(prepared)
+                out = quantized(spconv.SparseConvTensor(features, indices_t, shape, bs))
+            convs = [m for m in quantized if isinstance(m, spconv.QuantizedSparseConvolution)]
+            self.assertEqual(len(convs), 5)
+            self.assertEqual([m.dequantize for m in convs], [False] * 4 + [True])
+            self.assertEqual(convs[0].weight.dtype, torch.int8)
+            self.assertEqual(out.features.dtype, torch.float32)
+            self.assertAllClose(out.indices.numpy(), out_ref.indices.numpy())
+            ref = out_ref.features.numpy()
+            err = np.abs(out.features.numpy() - ref).max()
+            self.assertLess(err, 0.05 * np.abs(ref).max())
+
 
 def main():
     # function for develop.